@@ -0,0 +1,216 @@
+'''
+Benchmark of the processing stages on a synthetic experiment:
+
+    changeFileName  rename the scans and move them to original_images
+    crop            extract sub-images (or measure in memory with --fusedMeasure)
+    measureImgs     measure the sub-images of every position
+    plotMeasured    process the raw values and aggregate them for the figure
+    saveResults     store the tables, write the figure and a tsv export
+
+Every stage is timed on its own, per frame latency comes from timing each call
+inside the workers. The report (JSON) holds the dataset setup, seconds, frames per
+second, latency percentiles and peak RSS after each stage, compare two reports
+with --compare.
+
+    python benchmarks/benchScanLapse.py --frames 96 --positions 12 --report before.json
+    python benchmarks/benchScanLapse.py --frames 96 --positions 12 --report after.json --compare before.json
+'''
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from funcs import changeFileName, createFolders, getPositions, getPosToCrop, getInfo, getMeasureInfo
+from funcs import measureImgs, processMeasurements, plotMeasured, runChunked
+from funcs.crop import crop
+from funcs.scanCatalog import ScanCatalog
+from funcs.resultStore import saveResults, exportTables, measuredToTable
+from funcs.perfStats import peakRss
+from benchmarks.syntheticScans import makeDataset
+
+
+def timedCall(func, *args, **kwargs):
+    """Run func in a worker, return (seconds, result)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+# timedCall
+
+
+def stageReport(seconds, frames, latencies=None):
+    """Summary of one stage, latencies are seconds per frame"""
+    report = {'seconds': seconds, 'frames': frames,
+              'framesPerSecond': frames / seconds if seconds > 0 else None}
+    if latencies != None and len(latencies) > 0:
+        latencies = np.array(latencies) * 1000
+        report['latencyMs'] = {'mean': latencies.mean(), 'p50': np.percentile(latencies, 50),
+                               'p95': np.percentile(latencies, 95), 'max': latencies.max()}
+    report['peakRssMiB'], report['peakRssChildrenMiB'] = peakRss()
+    return report
+# stageReport
+
+
+def runStages(rootPath, dataset, workers=1, chunkSize=4, fusedMeasure=False, resizeFactor=0.35):
+    """Run every stage on the dataset in rootPath
+
+    Returns:
+        dict: {stage: stageReport()}
+    """
+    stages = {}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def run(func, jobs):
+        # [(args, kwargs), ...] -> [(seconds, result), ...], in the pool if there is one
+        jobs = [((func, ) + tuple(args), kwargs) for args, kwargs in jobs]
+        if executor == None:
+            return [timedCall(*args, **kwargs) for args, kwargs in jobs]
+        return runChunked(executor, timedCall, jobs, chunkSize)
+
+    start = time.perf_counter()
+    changeFileName(rootPath, reverse=False)
+    with ScanCatalog(rootPath) as catalog:
+        scanNames = catalog.names()
+        dictOldScanTime = catalog.dictOldScanTime()
+    dictOld2New = dict(scanNames)
+    stages['changeFileName'] = stageReport(time.perf_counter() - start, len(dictOld2New))
+
+    # Groups of scans sharing one position file, same as --diffPos
+    imgPath = os.path.join(rootPath, 'original_images')
+    scanFiles = [newName for _, newName in scanNames]
+    positionFiles = [dataset['sampleInfo']] + dataset['diffPos'][1::2]
+    groupStarts = [0] + [scanFiles.index(dictOld2New[f]) for f in dataset['diffPos'][0::2]] + [len(scanFiles)]
+    sampleInfo = getInfo(positionFiles[0])
+    posDicts = [getPositions(f) for f in positionFiles]
+    paddingPos = posDicts[0]['removePadding']['paddingPos']
+    folders = [] if fusedMeasure else [os.path.join('subImages', posName) for posName in sampleInfo]
+    targetPaths = createFolders(rootPath, folders + ['cropped_ori', 'resized'], reset=True)
+
+    cropJobs = []
+    for g, posDict in enumerate(posDicts):
+        posToCrop = getPosToCrop(posDict)
+        measureInfo = getMeasureInfo(sampleInfo, posDict) if fusedMeasure else None
+        for f in scanFiles[groupStarts[g]:groupStarts[g + 1]]:
+            cropJobs.append(((os.path.join(imgPath, f), posToCrop, targetPaths),
+                             dict(paddingPos=paddingPos, resizeFactor=resizeFactor, measureInfo=measureInfo,
+                                  saveSubImages=not fusedMeasure)))
+    start = time.perf_counter()
+    cropResults = run(crop, cropJobs)
+    stages['crop'] = stageReport(time.perf_counter() - start, len(cropJobs), [t for t, _ in cropResults])
+
+    times = np.array([dictOldScanTime[f] for f in scanFiles]) / 3600
+    if fusedMeasure:
+        measured = dict(result for _, result in cropResults)
+        measuredData = {posName: np.column_stack((times, [measured[os.path.join(imgPath, f)][posName]
+                                                          for f in scanFiles]))
+                        for posName in sampleInfo}
+    else:
+        measureJobs = []
+        for posName in sampleInfo:
+            measureType = sampleInfo[posName]['measure']
+            polygons = [(0, 0, 1, 0, 0, 1), ]
+            if measureType == 'polygon':
+                polygons = []
+                for g, posDict in enumerate(posDicts):
+                    polygons.extend([posDict['Polygon_poly'][posName]] * (groupStarts[g + 1] - groupStarts[g]))
+            measureJobs.append(((os.path.join(rootPath, 'subImages', posName), dictOldScanTime, measureType,
+                                 polygons), {}))
+        start = time.perf_counter()
+        measureResults = run(measureImgs, measureJobs)
+        seconds = time.perf_counter() - start
+        # per frame latency of each position, every frame of a position costs about the same
+        latencies = [t / len(data) for t, (_, data) in measureResults for _ in range(len(data))]
+        stages['measureImgs'] = stageReport(seconds, len(latencies), latencies)
+        measuredData = {posName: data for posName, (_, (_, data)) in zip(sampleInfo, measureResults)}
+
+    start = time.perf_counter()
+    allPicsData = processMeasurements(measuredData)
+    fig, plotData = plotMeasured(allPicsData, sampleInfo, 'strain', vlines=[], vlineColours=[],
+                                 timeRange=(0., None), show=False)
+    stages['plotMeasured'] = stageReport(time.perf_counter() - start, len(scanFiles))
+
+    start = time.perf_counter()
+    resultDir = os.path.join(rootPath, 'result_bench')
+    saveResults(os.path.join(rootPath, 'measuredData', 'raw'), measuredToTable(measuredData))
+    saveResults(os.path.join(resultDir, 'allData'), allPicsData)
+    saveResults(os.path.join(resultDir, 'plotData'), plotData)
+    exportTables(os.path.join(resultDir, 'allData'), formats=('tsv', ))
+    fig.savefig(os.path.join(resultDir, 'figure.svg'))
+    plt.close(fig)
+    stages['saveResults'] = stageReport(time.perf_counter() - start, len(scanFiles))
+
+    if executor != None:
+        executor.shutdown()
+    return stages
+# runStages
+
+
+def compareReports(report, oldReport):
+    """Print seconds of every stage of two reports side by side"""
+    print(f'{"stage":<16}{"before (s)":>12}{"after (s)":>12}{"speedup":>10}')
+    for stage, current in report['stages'].items():
+        old = oldReport['stages'].get(stage)
+        if old == None:
+            print(f'{stage:<16}{"-":>12}{current["seconds"]:>12.3f}{"-":>10}')
+            continue
+        print(f'{stage:<16}{old["seconds"]:>12.3f}{current["seconds"]:>12.3f}'
+              f'{old["seconds"] / current["seconds"]:>9.2f}x')
+# compareReports
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument('--scanSize', type=int, nargs=2, default=[1200, 1600], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--frames', type=int, default=48)
+    parser.add_argument('--positions', type=int, default=6)
+    parser.add_argument('--measureTypes', nargs='+', default=['centreDisk'], choices=['centreDisk', 'square', 'polygon'])
+    parser.add_argument('--diffPosSplits', type=int, default=0, help='Number of times the plate moves')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes, 1 runs everything in this process')
+    parser.add_argument('--chunkSize', type=int, default=4)
+    parser.add_argument('--fusedMeasure', action='store_true', help='Measure while cropping, no sub-images written')
+    parser.add_argument('--path', help='Folder for the synthetic experiment, a temporary one is used and removed if not set')
+    parser.add_argument('--report', help='Output JSON, default benchReport_<time>.json')
+    parser.add_argument('--compare', help='Earlier report to compare with')
+    args = parser.parse_args()
+
+    rootPath = args.path or tempfile.mkdtemp(prefix='scanLapseBench_')
+    dataset = makeDataset(rootPath, tuple(args.scanSize), args.frames, args.positions,
+                          tuple(args.measureTypes), args.diffPosSplits)
+    try:
+        stages = runStages(rootPath, dataset, args.workers, args.chunkSize, args.fusedMeasure)
+    finally:
+        if args.path == None:
+            shutil.rmtree(rootPath)
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'dataset': {'scanSize': args.scanSize, 'frames': args.frames, 'positions': args.positions,
+                    'measureTypes': args.measureTypes, 'diffPosSplits': args.diffPosSplits,
+                    'megabytes': dataset['bytes'] / 1024**2},
+        'options': {'workers': args.workers, 'chunkSize': args.chunkSize, 'fusedMeasure': args.fusedMeasure},
+        'stages': stages,
+    }
+    reportFile = args.report or f'benchReport_{datetime.now().strftime("%Y.%m.%d-%H.%M.%S")}.json'
+    with open(reportFile, 'w') as f:
+        json.dump(report, f, indent=2)
+    for stage, s in stages.items():
+        latency = f', p95 {s["latencyMs"]["p95"]:.1f} ms/frame' if 'latencyMs' in s else ''
+        print(f'{stage:<16}{s["seconds"]:8.3f} s, {s["framesPerSecond"]:8.1f} frames/s{latency}')
+    print(f'Report written to {reportFile}')
+    if args.compare != None:
+        with open(args.compare, 'r') as f:
+            compareReports(report, json.load(f))
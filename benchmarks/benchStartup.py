@@ -0,0 +1,124 @@
+'''
+Benchmark of the start up time of the command line entry points:
+
+    importFuncs     python -c "import funcs"
+    importPipeline  python -c "import funcs.pipeline"
+    help            python extractPicAndMeasure.py -h
+    batchRunHelp    python -m funcs.batchRun -h
+
+Each command runs in a new interpreter (--repeats times, the median is reported)
+with -X importtime, the heavy libraries it imported are listed. None of these
+commands should import them, they are loaded by the stages that need them.
+
+The run fails (exit code 1) if a heavy library is imported, or with --compare if
+a command got slower than --tolerance times the earlier report.
+
+    python benchmarks/benchStartup.py --report startup.json
+    python benchmarks/benchStartup.py --compare startup.json
+'''
+
+
+import os
+import sys
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+
+rootDir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+heavyModules = ['numpy', 'pandas', 'PIL', 'matplotlib', 'skimage', 'scipy']
+commands = {
+    'importFuncs': ['-c', 'import funcs'],
+    'importPipeline': ['-c', 'import funcs.pipeline'],
+    'help': [os.path.join(rootDir, 'extractPicAndMeasure.py'), '-h'],
+    'batchRunHelp': ['-m', 'funcs.batchRun', '-h'],
+}
+
+
+def importedModules(importTimeLog):
+    """Top level package names in the output of python -X importtime"""
+    modules = set()
+    for line in importTimeLog.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            modules.add(name.split('.')[0])
+    return modules
+# importedModules
+
+
+def timeCommand(args, repeats=5):
+    """Median seconds of running python with args, and the heavy modules imported
+
+    Returns:
+        dict: {'seconds', 'runs', 'heavyImports'}
+    """
+    runs = []
+    heavy = set()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=rootDir,
+                                capture_output=True, text=True)
+        runs.append(time.perf_counter() - start)
+        assert result.returncode == 0, f'{" ".join(args)} failed:\n{result.stderr[-2000:]}'
+        heavy |= importedModules(result.stderr) & set(heavyModules)
+    return {'seconds': statistics.median(runs), 'runs': runs, 'heavyImports': sorted(heavy)}
+# timeCommand
+
+
+def compareReports(report, oldReport, tolerance=1.5):
+    """Print seconds of every command of two reports side by side
+
+    Returns:
+        list: commands slower than tolerance times the old report
+    """
+    slower = []
+    print(f'{"command":<16}{"before (s)":>12}{"after (s)":>12}{"ratio":>8}')
+    for name, current in report['commands'].items():
+        old = oldReport['commands'].get(name)
+        if old == None:
+            print(f'{name:<16}{"-":>12}{current["seconds"]:>12.3f}{"-":>8}')
+            continue
+        ratio = current['seconds'] / old['seconds']
+        print(f'{name:<16}{old["seconds"]:>12.3f}{current["seconds"]:>12.3f}{ratio:>7.2f}x')
+        if ratio > tolerance:
+            slower.append(name)
+    return slower
+# compareReports
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--report', help='Output JSON, default startupReport_<time>.json')
+    parser.add_argument('--compare', help='Earlier report to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='With --compare, fail if a command takes longer than TOLERANCE times before, default 1.5')
+    args = parser.parse_args()
+
+    results = {name: timeCommand(command, args.repeats) for name, command in commands.items()}
+    report = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'commands': results,
+    }
+    reportFile = args.report or f'startupReport_{datetime.now().strftime("%Y.%m.%d-%H.%M.%S")}.json'
+    with open(reportFile, 'w') as f:
+        json.dump(report, f, indent=2)
+    failed = False
+    for name, r in results.items():
+        heavy = f', imports {", ".join(r["heavyImports"])}' if len(r['heavyImports']) > 0 else ''
+        print(f'{name:<16}{r["seconds"]:8.3f} s{heavy}')
+        failed |= len(r['heavyImports']) > 0
+    print(f'Report written to {reportFile}')
+    if args.compare != None:
+        with open(args.compare, 'r') as f:
+            slower = compareReports(report, json.load(f), args.tolerance)
+        for name in slower:
+            print(f'{name} is more than {args.tolerance} times slower than before.')
+        failed |= len(slower) > 0
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,161 @@
+'''
+Synthetic time lapse scans for benchmarking:
+
+Writes scanner-like images (prefix_1.jpg, prefix_2.jpg, ...) with their modification
+times one interval apart, plus the position and sample information tsv files that
+extractPicAndMeasure.py needs. Every position holds a colony that grows and darkens
+over time on a noisy plate. With diffPos splits, the plate is moved a bit at the
+start of each group and one position file is written for each group.
+'''
+
+
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def gridPositions(scanSize, positions, margin=0.05):
+    """Square boxes of positions laid out in a grid inside the scan
+
+    Returns:
+        list: [(x, y, size), ...] upper left corner and size of each box
+    """
+    width, height = scanSize
+    cols = int(np.ceil(np.sqrt(positions * width / height)))
+    rows = int(np.ceil(positions / cols))
+    cellW = width * (1 - 2 * margin) / cols
+    cellH = height * (1 - 2 * margin) / rows
+    size = int(min(cellW, cellH) * 0.8)
+    boxes = []
+    for i in range(positions):
+        r, c = divmod(i, cols)
+        x = int(width * margin + c * cellW + (cellW - size) / 2)
+        y = int(height * margin + r * cellH + (cellH - size) / 2)
+        boxes.append((x, y, size))
+    return boxes
+# gridPositions
+
+
+def hexagon(x, y, size):
+    """imageJ polygon (x1, y1, x2, y2, ...) of a hexagon inside a box"""
+    cx, cy, r = x + size / 2, y + size / 2, size / 2 - 1
+    angles = np.arange(6) * np.pi / 3
+    return [int(v) for a in angles for v in (cx + r * np.cos(a), cy + r * np.sin(a))]
+# hexagon
+
+
+def writePositionFile(tsvPath, boxes, names, measureTypes, strains, scanSize, shift=(0, 0)):
+    """Position and sample information file in the format of extractPicture_PositionsAndInfo.tsv"""
+    dx, dy = shift
+    width, height = scanSize
+    padX, padY = int(width * 0.02), int(height * 0.02)
+    with open(tsvPath, 'w') as f:
+        f.write('CornerSize\tx\ty\tsize\n')
+        for (x, y, size), name, measureType in zip(boxes, names, measureTypes):
+            if measureType != 'polygon':
+                f.write(f'{name}\t{x + dx}\t{y + dy}\t{size}\n')
+        f.write('WidthHeight\tx1\ty1\tWidth\tHeight\n')
+        f.write(f'removePadding\t{padX}\t{padY}\t{width - 2 * padX}\t{height - 2 * padY}\n')
+        f.write('Polygon\tmakePolygon();\n')
+        for (x, y, size), name, measureType in zip(boxes, names, measureTypes):
+            if measureType == 'polygon':
+                f.write(f'{name}\tmakePolygon({",".join(str(v) for v in hexagon(x + dx, y + dy, size))});\n')
+        f.write('END_POSITION\n\n')
+        f.write('sampleInfo\tstrain\tmeasure\tcolour\n')
+        for name, measureType, strain in zip(names, measureTypes, strains):
+            f.write(f'{name}\t{strain}\t{measureType}\t\n')
+        f.write('END_INFO\n')
+# writePositionFile
+
+
+def makeDataset(
+    path,
+    scanSize=(1200, 1600),
+    frames=48,
+    positions=6,
+    measureTypes=('centreDisk', ),
+    diffPosSplits=0,
+    strains=3,
+    interval=3600,
+    quality=90,
+    prefix='scan_',
+    seed=0
+):
+    """Write a synthetic experiment in path (must be empty or not exist)
+
+    Args:
+        path (str): root path of the experiment
+        scanSize (tuple, optional): (width, height) of the scans. Defaults to (1200, 1600).
+        frames (int, optional): number of scans. Defaults to 48.
+        positions (int, optional): number of positions (colonies). Defaults to 6.
+        measureTypes (tuple, optional): measure types, used in turn by the positions. Defaults to ('centreDisk', ).
+        diffPosSplits (int, optional): number of times the plate moves, one position file per group. Defaults to 0.
+        strains (int, optional): number of strains the positions belong to. Defaults to 3.
+        interval (float, optional): seconds between scans. Defaults to 3600.
+        quality (int, optional): JPEG quality of the scans. Defaults to 90.
+        prefix (str, optional): file name prefix, should end with "_". Defaults to 'scan_'.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict: {'sampleInfo': first position file, 'diffPos': [start file, position file, ...], 'bytes': total size}
+    """
+    os.makedirs(path, exist_ok=True)
+    assert len([f for f in os.listdir(path) if f.endswith('.jpg')]) == 0, f'{path} already has scans.'
+    rng = np.random.default_rng(seed)
+    width, height = scanSize
+    boxes = gridPositions(scanSize, positions)
+    names = [f'P{i + 1}' for i in range(positions)]
+    posMeasureTypes = [measureTypes[i % len(measureTypes)] for i in range(positions)]
+    posStrains = [f'S{i % strains + 1}' for i in range(positions)]
+    groupStarts = [int(frames * g / (diffPosSplits + 1)) for g in range(diffPosSplits + 1)]
+    shifts = [(8 * g, 5 * g) for g in range(diffPosSplits + 1)]
+
+    positionFiles = []
+    for g, shift in enumerate(shifts):
+        tsvPath = os.path.join(path, f'positions_{g}.tsv')
+        writePositionFile(tsvPath, boxes, names, posMeasureTypes, posStrains, scanSize, shift)
+        positionFiles.append(tsvPath)
+
+    plate = rng.normal(200, 6, (height, width, 1)).clip(0, 255).astype(np.uint8).repeat(3, axis=2)
+    growth = rng.uniform(0.5, 1.5, positions)
+    t0 = 1.6e9
+    totalBytes = 0
+    diffPos = []
+    for i in range(frames):
+        group = max(g for g, start in enumerate(groupStarts) if start <= i)
+        dx, dy = shifts[group]
+        im = Image.fromarray(np.roll(plate, (dy, dx), axis=(0, 1)))
+        draw = ImageDraw.Draw(im)
+        progress = i / max(1, frames - 1)
+        for (x, y, size), rate in zip(boxes, growth):
+            r = size / 2 * min(0.9, 0.2 + 0.7 * progress * rate)
+            cx, cy = x + dx + size / 2, y + dy + size / 2
+            grey = int(200 - 150 * min(1, progress * rate))
+            draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=(grey, grey, int(grey * 0.8)))
+        fileName = f'{prefix}{i + 1}.jpg'
+        filePath = os.path.join(path, fileName)
+        im.save(filePath, 'jpeg', quality=quality)
+        os.utime(filePath, (t0 + i * interval, t0 + i * interval))
+        totalBytes += os.path.getsize(filePath)
+        if group > 0 and i == groupStarts[group]:
+            diffPos.extend([fileName, positionFiles[group]])
+    return {'sampleInfo': positionFiles[0], 'diffPos': diffPos, 'bytes': totalBytes}
+# makeDataset
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a synthetic time lapse experiment')
+    parser.add_argument('path', help='Output folder, empty or not exist')
+    parser.add_argument('--scanSize', type=int, nargs=2, default=[1200, 1600], metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--frames', type=int, default=48)
+    parser.add_argument('--positions', type=int, default=6)
+    parser.add_argument('--measureTypes', nargs='+', default=['centreDisk'], choices=['centreDisk', 'square', 'polygon'])
+    parser.add_argument('--diffPosSplits', type=int, default=0)
+    args = parser.parse_args()
+    dataset = makeDataset(args.path, tuple(args.scanSize), args.frames, args.positions,
+                          tuple(args.measureTypes), args.diffPosSplits)
+    print(f'Written {args.frames} scans ({dataset["bytes"] / 1024**2:.1f} MiB) in {args.path}')
+    print(f'python extractPicAndMeasure.py {args.path} {dataset["sampleInfo"]}' +
+          (f' --diffPos {" ".join(dataset["diffPos"])}' if len(dataset['diffPos']) > 0 else ''))
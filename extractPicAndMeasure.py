@@ -7,25 +7,20 @@
 # durand.dc@gmail.com
 #####################################
 
-import traceback
 import os
-import pickle
-import argparse
-import hashlib
 import sys
-from datetime import datetime
-from shutil import copy2, copytree, rmtree
-from concurrent.futures import ThreadPoolExecutor
-
-import numpy as np
-import pandas as pd
+import argparse
+import traceback
+from multiprocessing import freeze_support
 
-from funcs import crop, getPositions, createFolders, getPosToCrop
-from funcs import getInfo, measureImgs, plotMeasured, changeFileName
-from funcs.changeName import genLogFile  # To get old file name when parsing multiple location data using old file name as reference
+from funcs import perfStats
+from funcs.pipeline import Pipeline, WorkerError, defaultOptions
+from funcs.batchPlot import loadPlotArguments, parseNumber, parseTimeRange
+from funcs.misc import parseMemorySize
 
 
 if __name__ == '__main__':
+    freeze_support()  # for the PyInstaller binary using process pool
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
                                      description='')
     parser.add_argument('rootPath', help='Path to process, with original_images dir')
@@ -42,8 +37,23 @@ if __name__ == '__main__':
                         help='This precent is to specify the precentage of the picture width to be considered')
     parser.add_argument('--resizeFactor', type=float, default=0.35, metavar='FLOAT',
                         help='Factor of original size (0-1), default 0.35')
+    parser.add_argument('--resizeProfile', choices=['fast', 'hq'], default='fast',
+                        help='JPEG encoding of the resized images. "fast" (default) for browsing, "hq" is progressive '+\
+                            'and optimised but slow. High quality versions can be made later, see --hqResized.')
+    parser.add_argument('--hqResized', action='store_true',
+                        help='After extraction, make high quality versions of the resized images in "resized_hq" '+\
+                            'in a low priority background process. Also "python -m funcs.preview rootPath [names]".')
     parser.add_argument('--noTimeFromFile', action='store_true',
                         help='Time from original file will be stored in all new files if this is not set')
+    parser.add_argument('--timeSource', choices=['auto', 'header', 'file'], default='auto',
+                        help='Scan times from the image headers (EXIF DateTimeOriginal, TIFF DateTime) or from the '+\
+                            'file modification times. "auto" uses the headers if every scan has one. Default auto.')
+    parser.add_argument('--timeWindow', nargs=2, metavar=('START', 'END'),
+                        help='Only extract and measure the scans from START to END hours (as in the figure, END can be '+\
+                            '"end"). The first 3 scans are always used for zeroing. Scans outside are not decoded, '+\
+                            'widening the window later only extracts the missing ones. Also the default --timeRange.')
+    parser.add_argument('--frameStride', type=int, default=1, metavar='N',
+                        help='Only extract and measure every N-th scan (the first 3 are always used), default 1')
     parser.add_argument('--locationFromCropped', action='store_true',
                         help='Set if the locations are measured from images in "cropped_ori" folder. Will only take effect if "original_images" folder is gone.')
     parser.add_argument('--forceNoFillBetween', action='store_true',
@@ -55,7 +65,76 @@ if __name__ == '__main__':
     parser.add_argument('--reExtract', action='store_true',
                         help='Force re-extract pictures')
     parser.add_argument('--reMeasure', action='store_true',
-                        help='Force re-measure')
+                        help='Force re-measure, also clears the measurement cache')
+    parser.add_argument('--fusedMeasure', action='store_true',
+                        help='Measure all positions while extracting, each original image is decoded only once. '+\
+                            'Sub-images are not written unless --saveSubImages is set.')
+    parser.add_argument('--saveSubImages', action='store_true',
+                        help='Also write sub-images to "subImages" folder when --fusedMeasure is set')
+    parser.add_argument('--subImageStore', choices=['files', 'stack'], default='files',
+                        help='How sub-images are stored in "subImages". "files" (default) writes one image per scan '+\
+                            'and position, "stack" one raw frame stack per position, faster to write and measure '+\
+                            'on network storage. 8 bit images only.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes for extracting pictures and measurement, default is the number of CPUs')
+    parser.add_argument('--chunkSize', type=int, default=4,
+                        help='Number of images sent to a worker process together, default 4')
+    parser.add_argument('--lowResMeasure', type=float, metavar='FACTOR',
+                        help='With --fusedMeasure, measure from images decoded at reduced resolution (0-1, JPEG '+\
+                            'only, one of 1/2, 1/4, 1/8 is used). Faster, but approximate.')
+    parser.add_argument('--lowResCheck', type=int, default=5, metavar='N',
+                        help='With --lowResMeasure, also measure N images at full resolution and report the deviation, '+\
+                            'saved to "lowResCheck.tsv" in rootPath. Default 5, 0 to skip.')
+    parser.add_argument('--frameCache', choices=['gray', 'rgb'],
+                        help='Keep decoded original images in a memory mapped stack in "frameCache" folder, '+\
+                            'later runs with changed positions read it instead of decoding again. '+\
+                            '"gray" is only used for --fusedMeasure without writing images, "rgb" also for writing.')
+    parser.add_argument('--framesPerJob', type=int, default=256,
+                        help='Number of sub-images measured in one job, default 256')
+    parser.add_argument('--memoryBudget', type=parseMemorySize, metavar='SIZE',
+                        help='Memory for the decoded images of all workers together, eg. 8G or 512M. Fewer scans '+\
+                            'are decoded at the same time and fewer sub-images measured together to stay within it, '+\
+                            'whatever the number and size of the scans. Default no limit (two scans per worker).')
+    parser.add_argument('--statistics', nargs='+', metavar='STAT',
+                        help='Also measure these statistics of every position, from the same decoded images: mean, '+\
+                            'median, std, pNN (percentile, eg. p10 p90) and hist (fraction of the pixels in each '+\
+                            'of --histBins bins). Stored as "position.channel.statistic" columns next to the '+\
+                            'greyness in the raw table and in "allData". Not with --frameCache gray.')
+    parser.add_argument('--channels', nargs='+', choices=['gray', 'rgb', 'hsv', 'lab'],
+                        help='Channels of --statistics, default gray. Values in [0, 1], Lab in its usual range.')
+    parser.add_argument('--histBins', type=int, default=8, help='Bins of the "hist" statistic, default 8')
+    parser.add_argument('--append', action='store_true',
+                        help='Only rename, extract and measure newly arrived scans, append them to the '+\
+                            'stored data and refresh "live_figure.svg" in rootPath without the interactive plot. '+\
+                            'New scans are measured in memory as with --fusedMeasure.')
+    parser.add_argument('--watch', type=float, metavar='MINUTES',
+                        help='With --append, keep checking rootPath for new scans every MINUTES. Ctrl-C to stop.')
+    parser.add_argument('--exportTables', nargs='*', choices=['tsv', 'xlsx'],
+                        help='Also write the saved result tables as spreadsheets (default both tsv and xlsx). '+\
+                            'Can be done later with "python -m funcs.resultStore result_*/allData".')
+    parser.add_argument('--exportSubImages', action='store_true',
+                        help='Also copy the sub-images that cannot be hard linked (stacks, other file system) into '+\
+                            'the result folder. Otherwise they are only listed with their content hashes, export '+\
+                            'later with "python -m funcs.snapshot result_*".')
+    parser.add_argument('--batchPlot', action='store_true',
+                        help='Plot without interaction (no window, Agg backend), one figure for every level in '+\
+                            '--levels and every --timeRange, drawn in parallel from the measured data.')
+    parser.add_argument('--plotArguments', metavar='arguments.txt',
+                        help='Take vertical lines, colours, time range and level from the arguments.txt of an '+\
+                            'earlier result, the plot arguments below override them.')
+    parser.add_argument('--vlines', nargs='*', type=parseNumber, help='Vertical lines, hours')
+    parser.add_argument('--vlineColours', nargs='*', help='Colours of the vertical lines')
+    parser.add_argument('--lowerVlines', nargs='+', type=parseNumber,
+                        help='Vertical lines that will plot at bottom, default 24')
+    parser.add_argument('--timeRange', nargs=2, action='append', metavar=('START', 'END'),
+                        help='Hours, END can be "end". Repeat for more figures with --batchPlot.')
+    parser.add_argument('--levels', nargs='+',
+                        help='Levels (columns of sampleInfo) to group by, "all" for every level. '+\
+                            'Only the first one is used without --batchPlot. Default is the first level.')
+    parser.add_argument('--perfReport', action='store_true',
+                        help='Time each stage, decoding, encoding and measuring, count bytes written and report '+\
+                            'per frame latency and peak memory. Printed at the end and saved as "perfReport.json" '+\
+                            'in the result folder (rootPath in --append mode).')
     parser.add_argument('--diffPos', nargs='*',
                         help='''If your plates was moved during experiment, then you need multiple
                         position files.
@@ -63,318 +142,121 @@ if __name__ == '__main__':
                         [start file] [positionTsvPath] [start file] [positionTsvPath]...
                         DO NOT add the first file (start from 0) again.
                         The START FILE is the file name of the original file name. Check the log file for the old name.
+                        Without it, plate movements are detected from the scans, see --noDriftDetection.
                         ''')
+    parser.add_argument('--noDriftDetection', action='store_true',
+                        help='Do not look for plate movements when --diffPos is not given. Otherwise consecutive '+\
+                            'scans are registered (thumbnails, phase correlation) and the positions of the scans '+\
+                            'after a movement are moved by the offset, written in "driftPositions".')
 
     args = parser.parse_args()
-    rootPath = args.rootPath.strip()
-    sampleInfoTsvPath = args.sampleInfoTsvPath.strip()
-    resizeFactor = args.resizeFactor
-    locFromCropped = args.locationFromCropped
-    forceNoFillBetween = args.forceNoFillBetween
-    noTimeFromFile = args.noTimeFromFile
-    imageInterval = args.imageInterval
-    normType = args.normType
-    startImageTiming = args.startImageTiming
-    timeZ = args.endTiming
-    percentage = args.percentage
-    reExtract = args.reExtract
-    reMeasure = args.reMeasure
-    diffPos = args.diffPos
-
-    # convert to realpath in case of failure in some systems 1/2
-    rootPath = os.path.realpath(rootPath)
-
-    assert os.path.isdir(rootPath), f'rootPath {rootPath} does not exist.'
-
-    # Get file names to crop
-    renameLogFile = genLogFile(rootPath)
-    if not os.path.isfile(renameLogFile):
-        changeFileName(rootPath, reverse=False)
-    oldFiles, newFiles = ([], [])
-    with open(renameLogFile, 'rb') as f:
-        dictOld2New, dictOldScanTime, _ = pickle.load(f)
-    for of in dictOld2New:
-        oldFiles.append(of)
-        newFiles.append(dictOld2New[of])
-    # sort oldFiles based on newFiles
-    oldFiles = [f for _, f in sorted(zip(newFiles, oldFiles))]
-    # sort newFIles after oldFiles is sorted
-    newFiles.sort()
-
-    # If the targets moved during time lapse experiment, you might need to specify different
-    # metadata files for the moved location
-    diffPosNums = [0, ]
-    diffPosFiles = [sampleInfoTsvPath, ]
-    diffPosFileHashes = []
-    if diffPos != None:
-        if len(diffPos) % 2 != 0:
-            parser.error('The --diffPos argument requires both number and file')
-        # PARSE args
-        for imgfile, posFile in zip(diffPos[0::2], diffPos[1::2]):
-            if imgfile in oldFiles:
-                idx = oldFiles.index(imgfile)
-            elif imgfile in newFiles:
-                idx = newFiles.index(imgfile)
-            else:
-                raise ValueError(f'File {imgfile} missing from the original file names ({oldFiles[:5]}...) ({newFiles[:5]}...)')
-            diffPosNums.append(oldFiles.index(imgfile))
-            diffPosFiles.append(posFile)
-    # convert to realpath in case of failure in some systems 2/2
-    diffPosFiles = [os.path.realpath(f) for f in diffPosFiles]
-    for f in diffPosFiles:
-        assert os.path.isfile(f), f'sample information table {f} does not exist.'
-        sha1 = hashlib.sha1()
-        with open(f, 'rb') as f:
-            sha1.update(f.read())
-            diffPosFileHashes.append(sha1.hexdigest())
-
-    # correct names can be found in the pickled log file)
-    useCroppedImg = False
-    imgPath = os.path.join(rootPath, 'original_images')
-    if not os.path.isdir(imgPath):
-        imgPath = os.path.join(rootPath, 'cropped_ori')
-        print(f'original_images folder not found, use cropped_ori folder for source images')
-        assert os.path.isdir(imgPath), f'cropped_ori folder not found in {rootPath}.'
-        useCroppedImg = True
-
-    # Compare hashes with previously runs, extract pictures again if not the same
-    # Also consider reExtract argument
-    posFileHashesFile = os.path.join(rootPath, 'Hashes for last measurement metadata files.pickle'.replace(' ', '_'))
-    doExtractPics = True
-    extractArgsStatic = [diffPosFileHashes, useCroppedImg, locFromCropped, diffPos]
-    if os.path.isdir(os.path.join(rootPath, 'subImages')) and os.path.isfile(posFileHashesFile) and not reExtract:
-        with open(posFileHashesFile, 'rb') as f:
-            try:
-                extractArgsStatic_old = pickle.load(f)
-                if extractArgsStatic_old == extractArgsStatic:
-                    doExtractPics = False
-            except:
-                pass
-    if doExtractPics:
-        with open(posFileHashesFile, 'wb') as f:
-            pickle.dump(extractArgsStatic, f)
-        reMeasure = True
-
-    # Generate file paths to process
-    if useCroppedImg:
-        fns_exts = [os.path.splitext(f) for f in newFiles]
-        newFiles = [f'{n[0]}_cropped{n[1]}' for n in fns_exts]
-    fileList = [os.path.join(imgPath, f) for f in newFiles]
-
-    # Get positions from the first metadata file
-    posDict = getPositions(diffPosFiles[0])
-    posToCrop = getPosToCrop(posDict, useCroppedImg, locFromCropped)
-    paddingPos = posDict['removePadding']['paddingPos']  # Should equal to None when remove padding is not specified
-    # Create folder for each sample (posName)
-    targetPaths = {}
-    folders = [os.path.join('subImages', f) for f in list(posToCrop.keys())]
-
-    # Add additional folder for cropped and resized pictures
-    # Resized folder will store resized cropped images
-    if paddingPos != None and not useCroppedImg:
-        folders.append('cropped_ori')
-    folders.append('resized')
-
-    assert len(set(folders)) == len(folders), f'There are duplications in the sample IDs:\n{[i for i in folders if folders.count(i) > 1]}'
-
-    # See if the previous picture extraction has resulted any file (avoid empty measurment)
-    firstSubFolder = os.path.join(rootPath, folders[0])
-    if os.path.isdir(firstSubFolder):
-        if not len(os.listdir(firstSubFolder)) > 2:
-            doExtractPics = True
-        pass
-
-    ################# EXTRACT PICTURES #########################################################
-
-    if doExtractPics:
-        print('Clearing existing folders...')
-        removeDirList = ['subImages']
-        dirList = []
-        for _, ds, _ in os.walk(rootPath):
-            dirList = ds
-            break
-        if not useCroppedImg:
-            removeDirList.append('cropped_ori')
-        for d in removeDirList:
-            if d in dirList:
-                rmtree(os.path.join(rootPath, d))
-            else:
-                print(f'{d} not found in {rootPath}')
-        print('Creating folders...')
-        targetPaths = createFolders(rootPath, folders, reset=True)
-
-        for i, (num, sampleInfoTsvPath) in enumerate(zip(diffPosNums, diffPosFiles)):
-            try:
-                nextGroupStart = diffPosNums[i + 1]
-            except IndexError:
-                nextGroupStart = len(fileList)
-
-            if i != 0: # Multiple position files
-                posDict = getPositions(sampleInfoTsvPath)
-                posToCrop = getPosToCrop(posDict, useCroppedImg, locFromCropped)
-            # Prepare cropping files
-            print(f'Cropping group {i+1}/{len(diffPosNums)}...')
-            subFileList = fileList[diffPosNums[i]:nextGroupStart]
-            # RUN. Submit cropping threads
-            filePathList = [os.path.join(imgPath, file) for file in subFileList]
-            threadPool = ThreadPoolExecutor(max_workers=os.cpu_count())
-            futures = []
-            for i, file in enumerate(filePathList): # repeated "i"
-                future = threadPool.submit(
-                    crop, file, posToCrop, targetPaths,
-                    paddingPos=paddingPos,
-                    resizeFactor=resizeFactor,
-                    useFileTime=not noTimeFromFile,
-                )
-                print(f'Submitted {i}: {os.path.split(file)[-1]}')
-                if i == 0:
-                    exception = future.exception()
-                    # this will wait the first implementation to finish, and check if
-                    # any exception happened
-                    if exception != None:
-                        print('There is exception in the first implementation:')
-                        traceback.print_tb(exception.__traceback__)
-                        print(exception.__class__, exception)
-                        exit()
-                futures.append(future)
-            print('All images submitted for cropping and creating subimages! Waiting for finish.')
-            exceptions = [future.exception() for future in futures]
-            for i, exception in enumerate(exceptions):
-                if exception != None:
-                    print(f'There is exception in run index {i}:')
-                    traceback.print_tb(exception.__traceback__)
-                    print(type(exception), exception)
-                    break
-            threadPool.shutdown()
-        print('Finished!')
-
-    # Check if dataFile exists and arguments are the same as previous
-    measureArgsStatic = [diffPosNums, diffPosFileHashes, noTimeFromFile, imageInterval, startImageTiming, normType, percentage]
-    allPicsData = pd.DataFrame()
-    measure = True
-    dataPickle = os.path.join(rootPath, 'data.pickle')
-    if not reMeasure and os.path.isfile(dataPickle):
-        if os.stat(dataPickle).st_size > 0:
-            with open(dataPickle, 'rb') as resultData:
-                oldAllPicsData, measureArgsStatic_old = pickle.load(resultData)
-                if measureArgsStatic_old == measureArgsStatic:  # arguments affect measured data
-                    measure = False
-                    allPicsData = oldAllPicsData
-
-    sampleInfo = getInfo(diffPosFiles[0])  # will be used in both measurement and plotting
-    ################# EXTRACT PICTURES DONE #########################################################
-
-    ################# MEASUREMENT #########################################################
-
-    if measure:
-
-        threadPool = ThreadPoolExecutor(max_workers=1)
-        futures = []
-
-        for folder in sampleInfo:
-            measureType = sampleInfo[folder]['measure']
-            assert measureType in ['centreDisk', 'square', 'polygon'], \
-                f'Error found in sample information file, "measure" should be in [\'centreDisk\', \'square\', \'polygon\'], {measureType} found.'
-
-            polygons = [(0, 0, 1, 0, 0, 1), ]  # polygon initiation for non-polygon measurments
-            if measureType == 'polygon':  # needs to go back to posDict to find location
-
-                # Generate polygon locations
-                polygons = []  # reset this to start with 0
-                for i, (num, sampleInfoTsvPath) in enumerate(zip(diffPosNums, diffPosFiles)):
-                    try:
-                        nextGroupStart = diffPosNums[i + 1]
-                    except IndexError:  # reach the end
-                        nextGroupStart = diffPosNums[i] + 1
-                    posDict = getPositions(diffPosFiles[0])
-                    polygon = posDict['Polygon_poly'][folder]
-                    n = nextGroupStart - num
-                    polygons.extend([polygon] * n)
-
-            # Submit measurement to thread pool
-            future = threadPool.submit(
-                measureImgs,
-                os.path.join(rootPath, 'subImages', folder),
-                dictOldScanTime,
-                measureType,
-                polygons=polygons,
-                percentage=percentage,
-                forceUseFileNumber=noTimeFromFile,
-                fileNumberTimeInterval=imageInterval
-            )
-            futures.append(future)
-            print(f'Submitted {folder} for greyness measurement.')
-
-        # Exception handle
-        exceptions = [future.exception() for future in futures]
-        for i, excep in enumerate(exceptions):
-            if excep != None:
-                print(f'There is exception in run index {i}:')
-                print(excep)
-                break
-
-        threadPool.shutdown()  # wait for every thread to complete
-
-        # get results
-        for future in futures:
-            path, data = future.result()
-            posName = os.path.split(path)[-1]
-            # data processing according to arguments
-
-            # rebase time to the first picture (if 3 (hours), then the data will start with 3)
-            # Now the data should be actual hours (after the experimental time zero)
-            data[:, 0] -= (data[:, 0].min() - startImageTiming)
-            # sort on time
-            timeSort = np.argsort(data[:, 0])
-            data = data[timeSort, :]
-            # Normalization
-            if not args.noZeroing:
-                # use first 3 hours data as zero point
-                zeroPoint = data[:3, 1].mean()
-                values = data[:, 1] - zeroPoint
-            if normType == 'Each':
-                data[:, 1] = values/values.max()
+    if args.perfReport:
+        perfStats.enable()
+    appendMode = args.append or args.watch != None
+    exportFormats = args.exportTables
+    batchPlot = args.batchPlot
+    if exportFormats != None and len(exportFormats) == 0:
+        exportFormats = ['tsv', 'xlsx']
+    if args.lowResMeasure != None:
+        if not args.fusedMeasure:
+            parser.error('--lowResMeasure requires --fusedMeasure')
+        if not 0 < args.lowResMeasure <= 1:
+            parser.error('--lowResMeasure should be in range (0, 1]')
+    if args.diffPos != None and len(args.diffPos) % 2 != 0:
+        parser.error('The --diffPos argument requires both number and file')
+
+    if args.frameStride < 1:
+        parser.error('--frameStride should be at least 1')
+    if args.statistics != None:
+        from funcs.roiStats import statSpec
+        try:
+            statSpec(args.statistics, args.channels, args.histBins)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.frameCache == 'gray':
+            parser.error('--statistics are measured from the colours, use --frameCache rgb')
+    if args.timeWindow != None:
+        args.timeWindow = parseTimeRange(args.timeWindow)
+    options = {k: v for k, v in vars(args).items() if k in defaultOptions}
+    options['append'] = appendMode
+    pipeline = Pipeline(args.rootPath, args.sampleInfoTsvPath, args.diffPos, **options)
+    rootPath = pipeline.rootPath
+
+    ################# EXTRACT PICTURES AND MEASUREMENT #########################################################
+
+    hqProcess = None
+    try:
+        pipeline.rename()
+        pipeline.extract()
+        if args.hqResized and not appendMode:
+            from funcs.preview import makeHqResized, genProfileFile
+            if not os.path.isfile(genProfileFile(rootPath)):
+                print('Settings of the resized images not found, use --reExtract to make high quality resized images.')
             else:
-                data[:, 1] = values
-
-            # Put into data frame
-            toDf = pd.DataFrame(data[:, 1], index=data[:, 0], columns=[posName])
-            allPicsData = pd.concat((allPicsData, toDf), axis=1)
-
-        if normType == 'Combined':
-            min = allPicsData.iloc[:3].values.mean()  # will convert to nparray and calculate mean of everything
-            values = allPicsData.values - min
-            newData = values/values.max()
-            # put data back
-            allPicsData = pd.DataFrame(newData, index=allPicsData.index, columns=allPicsData.columns)
-
-        with open(dataPickle, 'wb') as resultData:
-            pickle.dump([allPicsData, measureArgsStatic], resultData)
-        allPicsData.to_excel(f'{os.path.splitext(dataPickle)[0]}.xlsx')
-    ################# MEASUREMENT DONE #########################################################
+                # Encoded with the low priority while measuring and plotting, waited for at exit
+                from multiprocessing import Process
+                hqProcess = Process(target=makeHqResized, args=(rootPath, ), kwargs=dict(lowPriority=True))
+                hqProcess.start()
+                print('Making high quality resized images in "resized_hq" in the background.')
+        pipeline.measure()
+        allPicsData = pipeline.aggregate()
+
+        ################# APPEND NEW SCANS #########################################################
+
+        if appendMode:
+            pipeline.append(args.watch)
+            pipeline.close()
+            perfStats.finish(os.path.join(rootPath, 'perfReport.json'))
+            sys.exit()
+    except WorkerError:
+        traceback.print_exc()  # with the exception of the failed job
+        pipeline.close()
+        sys.exit(1)
+    pipeline.close()
+    ################# EXTRACT PICTURES AND MEASUREMENT DONE #########################################################
 
     ################# PLOTTING #########################################################
 
+    sampleInfo = pipeline.sampleInfo
+    allLevels = pipeline.allLevels
     # groupSequence = [2, 5]  # index of original sequence, see print out for reference
-    vlines = []
-    vlineColours = []
-    timeRange = (startImageTiming, timeZ)
-    lowerVlines = [24, ]
-    allLevels = [k for k in list(list(sampleInfo.values())[0].keys()) if k not in ['measure', 'colour']]
-    level = allLevels[0]  # use the first one
+    plotArgs = {} if args.plotArguments == None else loadPlotArguments(args.plotArguments)
+    vlines = args.vlines if args.vlines != None else plotArgs.get('vlines', [])
+    vlineColours = args.vlineColours if args.vlineColours != None else plotArgs.get('vlineColours', [])
+    if len(vlineColours) != len(vlines):
+        parser.error(f'{len(vlines)} vertical lines need the same number of colours, {vlineColours} found')
+    lowerVlines = args.lowerVlines or plotArgs.get('lowerVlines', [24, ])
+    timeRanges = [plotArgs.get('timeRange', pipeline.defaultTimeRange())]
+    if args.timeRange != None:
+        timeRanges = [parseTimeRange(t) for t in args.timeRange]
+    levels = args.levels or [plotArgs.get('level', allLevels[0])]  # use the first one
+    if 'all' in levels:
+        levels = allLevels
+    for l in levels:
+        if l not in allLevels:
+            parser.error(f'Level {l} not found in {allLevels}')
+    timeRange = timeRanges[0]
+    level = levels[0]
 
     #colours = [sampleInfo[s]['colour'].strip() for s in sampleInfo]
 
-    # copy this script to outputPath for later references
-    isSatisified = 'n'
+    isSatisified = 'y' if batchPlot else 'n'
     fig, plotData = (None, None)
+    figure = None  # one figure kept between rounds, only the changed parts are redrawn
     while isSatisified != 'y':
-        fig, plotData = plotMeasured(allPicsData, sampleInfo, level, forceNoFillBetween,
-                                     vlines=vlines, vlineColours=vlineColours, lowerVlines=lowerVlines, timeRange=timeRange)
+        with perfStats.timer('stage.plot'):
+            if figure == None:
+                from funcs.plotting import MeasuredFigure
+                figure = MeasuredFigure(allPicsData, sampleInfo, args.forceNoFillBetween)
+            plotData = figure.update(level, vlines=vlines, vlineColours=vlineColours, lowerVlines=lowerVlines,
+                                     timeRange=timeRange)
+            fig = figure.fig
+            figure.show()
         isSatisified = input("Satisfied with the result? y/n/q(quit):")
         if isSatisified == 'y':
             break
         elif isSatisified == 'q':
+            perfStats.finish(os.path.join(rootPath, 'perfReport.json'))
             sys.exit()
 
         # Get values for the next plot
@@ -414,39 +296,26 @@ if __name__ == '__main__':
     ################# PLOTTING DONE #########################################################
 
     ################# Save figure and log #########################################################
-    resultDir = os.path.join(rootPath, f'result_{datetime.now().strftime("%Y.%m.%d-%H.%M.%S")}')
-    os.mkdir(resultDir)
-    allPicsData.columns = [f'{sampleInfo[k]["strain"]}_{k}' for k in sampleInfo]
-    allPicsData.to_csv(os.path.join(resultDir, 'allData.tsv'), sep='\t')
-    allPicsData.to_excel(os.path.join(resultDir, 'allData.xlsx'))
-    plotData.to_csv(os.path.join(resultDir, 'plotData.tsv'), sep='\t')
-    plotData.to_excel(os.path.join(resultDir, 'plotData.xlsx'))
-    argumentTxt = os.path.join(resultDir, 'arguments.txt')
-    fig.savefig(os.path.join(resultDir, f'figure_{datetime.now().strftime("%Y.%m.%d-%H.%M.%S")}.svg'))
-    with open(argumentTxt, 'w') as f:
-        f.write('python3 ' + ' '.join(sys.argv) + '\n\n')
-        f.write(str(args))
-        f.write(f'\n{" ".join([str(i) for i in vlines])}\t# Vertical lines')
-        f.write(f'\n{" ".join(vlineColours)}\t# Vertical line colours')
-        f.write(f'\n{" ".join([str(i) for i in lowerVlines])}\t# Lower vertical lines')
-        f.write(f'\n{" ".join([str(i) for i in timeRange])}\t# Time range')
-        f.write(f'\n{level}\t# Level')
-    pathThisScript = os.path.realpath(__file__)
-    for f in diffPosFiles:
-        copy2(f, resultDir)
-    try:
-        copytree(os.path.join(rootPath,'subImages'), os.path.join(resultDir, 'subImages'))
-    except:
-        print('subImages dir not found.')
-    if sys.argv[0].endswith('.py'):
-        pathFuncs = os.path.join(os.path.split(pathThisScript)[0], 'funcs')
-        destFuncs = os.path.join(resultDir, 'funcs')
-        try:
-            copy2(pathThisScript, resultDir)
-        except FileNotFoundError:
-            print(f'Plain python script file {pathThisScript} not found.')
+    if batchPlot:
+        # Every variant in a worker process, from the measured data only
         try:
-            copytree(pathFuncs, destFuncs)
-        except FileNotFoundError:
-            print(f'Sub-modules folder {pathFuncs} not found.')
+            pipeline.plotVariants(levels, timeRanges, vlines, vlineColours, lowerVlines)
+        except WorkerError:
+            traceback.print_exc()
+            pipeline.close()
+            sys.exit(1)
+        pipeline.close()
+    resultDir = pipeline.save(
+        fig, plotData,
+        plotSettings={'vlines': vlines, 'vlineColours': vlineColours, 'lowerVlines': lowerVlines,
+                      'timeRange': timeRange, 'level': level},
+        exportFormats=exportFormats,
+        exportSubImages=args.exportSubImages,
+        commandLine='python3 ' + ' '.join(sys.argv) + '\n\n' + str(args),
+        copySource=sys.argv[0].endswith('.py'),
+    )
     print('Result saved.')
+    if hqProcess != None and hqProcess.is_alive():
+        print('Waiting for the high quality resized images...')
+        hqProcess.join()
+    perfStats.finish(os.path.join(resultDir, 'perfReport.json'))
@@ -1,6 +1,36 @@
-from .parseMetadata import getInfo, getPositions, getPosToCrop
-from .changeName import changeFileName, getScanTime, determinePrefixExtension, determineExtension
-from .misc import createFolders
-from .measureImages import measureImgs
-from .plotting import plotMeasured
-from .crop import crop
\ No newline at end of file
+'''
+Functions are imported from their sub-module on first use, so "import funcs"
+does not load PIL, scikit-image, pandas or matplotlib before a stage needs them.
+funcs.crop is the sub-module, crop() is imported from it.
+'''
+
+
+from importlib import import_module
+
+_lazyNames = {
+    'parseMetadata': ['getInfo', 'getPositions', 'getPosToCrop', 'getMeasureInfo', 'shiftPositionFile'],
+    'changeName': ['changeFileName', 'getScanTime', 'determinePrefixExtension', 'determineExtension',
+                   'appendNewFiles', 'naturalKey'],
+    'misc': ['createFolders', 'runChunked', 'ignoreInterrupt'],
+    'measureImages': ['measureImgs', 'measureFolders', 'measureRoi', 'measureStack', 'getRoiMask', 'getImageTimes',
+                      'processMeasurements', 'processStatistics', 'measureDeviation'],
+    'plotting': ['plotMeasured', 'MeasuredFigure'],
+    'pipeline': ['Pipeline'],
+    'scanCatalog': ['ScanCatalog'],
+    'driftDetection': ['frameShifts', 'driftGroups'],
+    'roiStats': ['statSpec', 'statNames', 'roiStatistics'],
+}
+_moduleOf = {name: module for module, names in _lazyNames.items() for name in names}
+__all__ = list(_moduleOf)
+
+
+def __getattr__(name):
+    if name not in _moduleOf:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(import_module(f'.{_moduleOf[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
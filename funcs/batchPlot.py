@@ -0,0 +1,81 @@
+'''
+Plotting without interaction:
+
+Plot settings (vertical lines and their colours, lower vertical lines, time range
+and level) come from the command line or from the arguments.txt of an earlier
+result. Every (level, time range) variant is drawn with the Agg backend in a
+worker process from the measured data, images are not read.
+'''
+
+
+import os
+
+
+def loadPlotArguments(argumentTxt):
+    """Plot settings saved in the arguments.txt of a result folder
+
+    Returns:
+        dict: {'vlines', 'vlineColours', 'lowerVlines', 'timeRange', 'level'}, only the ones found
+    """
+    parsers = {
+        '# Vertical lines': ('vlines', lambda v: [parseNumber(i) for i in v.split()]),
+        '# Vertical line colours': ('vlineColours', lambda v: v.split()),
+        '# Lower vertical lines': ('lowerVlines', lambda v: [parseNumber(i) for i in v.split()]),
+        '# Time range': ('timeRange', lambda v: parseTimeRange(v.split())),
+        '# Level': ('level', lambda v: v.strip()),
+    }
+    plotArgs = {}
+    with open(argumentTxt, 'r') as f:
+        for line in f:
+            if '\t# ' not in line:
+                continue
+            value, comment = line.rstrip('\n').rsplit('\t', 1)
+            if comment in parsers:
+                key, parse = parsers[comment]
+                plotArgs[key] = parse(value)
+    return plotArgs
+# loadPlotArguments
+
+
+def parseNumber(value):
+    """'24' to 24, '24.5' to 24.5, hours are shown as written in the figure"""
+    number = float(value)
+    return int(number) if number.is_integer() else number
+# parseNumber
+
+
+def parseTimeRange(values):
+    """['0', '72'] to (0., 72.), 'None' or 'end' as the end means until the last image"""
+    start, end = values
+    return (float(start), None if end in ['None', 'end'] else float(end))
+# parseTimeRange
+
+
+def variantName(level, timeRange):
+    start, end = timeRange
+    return f'{level}_{start:g}-{"end" if end == None else f"{end:g}"}'
+# variantName
+
+
+def plotVariant(allPicsData, sampleInfo, level, outPrefix, forceNoFillBetween=False,
+                vlines=[], vlineColours=[], lowerVlines=[24, ], timeRange=(0., None)):
+    """Draw one figure with the Agg backend, save it as outPrefix.svg and its data in outPrefix_plotData
+
+    Can run in a worker process, the arguments are the same as plotMeasured().
+
+    Returns:
+        str: path of the figure
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from funcs.plotting import plotMeasured
+    from funcs.resultStore import saveResults
+    fig, plotData = plotMeasured(allPicsData, sampleInfo, level, forceNoFillBetween,
+                                 vlines=vlines, vlineColours=vlineColours, lowerVlines=lowerVlines,
+                                 timeRange=timeRange, show=False)
+    fig.savefig(f'{outPrefix}.svg')
+    plt.close(fig)
+    saveResults(f'{outPrefix}_plotData', plotData)
+    return f'{outPrefix}.svg'
+# plotVariant
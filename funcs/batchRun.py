@@ -0,0 +1,309 @@
+'''
+Many experiments in one unattended run:
+
+Each scanner writes its own root folder. Instead of one interactive
+extractPicAndMeasure.py per folder, all folders are processed together: rename,
+crop and measure jobs of every experiment go to one shared process pool, so the
+number of busy cores is limited once for the whole run (--workers). Every
+experiment is driven by its own thread, which only submits jobs and waits, so a
+slow or failing experiment does not hold the others back.
+
+Results are stored the same way as extractPicAndMeasure.py does, a later
+interactive run on one of the folders with the same arguments reuses them. The
+figures are made as with --batchPlot.
+
+The status of every experiment (stage, seconds per stage, frames, error) is kept
+up to date in batchStatus.json and batchStatus.tsv of the status folder.
+
+    python -m funcs.batchRun --roots '/data/2026-10-*/scanner*' --sampleInfo positions.tsv
+    python -m funcs.batchRun --list experiments.tsv --workers 32
+
+The list is a tsv file without header: rootPath, sampleInfoTsvPath and optional
+--diffPos values separated by spaces. Relative paths are from the list file.
+'''
+
+
+import os
+import sys
+import glob
+import json
+import time
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from funcs.changeName import naturalKey
+from funcs.misc import ignoreInterrupt
+from funcs.pipeline import Pipeline, defaultOptions, preloadWorkerModules
+
+
+defaultPlotOptions = {
+    'vlines': [],
+    'vlineColours': [],
+    'lowerVlines': [24, ],
+    'timeRanges': [(0., None), ],
+    'levels': None,  # None for the first level, 'all' for every level
+    'exportTables': None,
+}
+
+
+def readExperimentList(listFile):
+    """Experiments in a tsv file: rootPath, sampleInfoTsvPath[, diffPos values separated by spaces]
+
+    Returns:
+        list: [(rootPath, sampleInfoTsvPath, diffPos or None), ...]
+    """
+    listDir = os.path.dirname(os.path.realpath(listFile))
+    experiments = []
+    with open(listFile, 'r') as f:
+        for line in f:
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            assert len(fields) >= 2, f'rootPath and sampleInfoTsvPath needed in {listFile}: {line}'
+            diffPos = fields[2].split() if len(fields) > 2 and fields[2].strip() != '' else None
+            if diffPos != None:
+                # position files are relative to the list, start files are file names
+                diffPos = [p if i % 2 == 0 else os.path.join(listDir, p) for i, p in enumerate(diffPos)]
+            experiments.append((os.path.join(listDir, fields[0]), os.path.join(listDir, fields[1]), diffPos))
+    return experiments
+# readExperimentList
+
+
+def findExperiments(patterns, sampleInfoName):
+    """Root folders matching the glob patterns, each with its sample information table sampleInfoName
+
+    Returns:
+        list: [(rootPath, sampleInfoTsvPath, None), ...]
+    """
+    experiments = []
+    for pattern in patterns:
+        for rootPath in sorted(glob.glob(pattern), key=naturalKey):
+            if not os.path.isdir(rootPath):
+                continue
+            sampleInfoTsvPath = os.path.join(rootPath, sampleInfoName)
+            if not os.path.isfile(sampleInfoTsvPath):
+                print(f'Skip {rootPath}, {sampleInfoName} not found.')
+                continue
+            experiments.append((rootPath, sampleInfoTsvPath, None))
+    return experiments
+# findExperiments
+
+
+class Experiment:
+    """One root folder of the batch, a Pipeline run stage by stage on the shared process pool
+
+    Args:
+        options (dict): Pipeline options (command line arguments of extractPicAndMeasure.py)
+        plotOptions (dict): vlines, vlineColours, lowerVlines, timeRanges and levels of the figures
+    """
+
+    stages = ['rename', 'extract', 'measure', 'plot']
+
+    def __init__(self, rootPath, sampleInfoTsvPath, diffPos=None, options={}, plotOptions={}):
+        self.args = (rootPath, sampleInfoTsvPath, diffPos)
+        self.options = options
+        self.plotOptions = dict(defaultPlotOptions, **plotOptions)
+        self.pipeline = None
+        self.status = {'rootPath': os.path.realpath(rootPath), 'status': 'waiting', 'stage': None, 'frames': 0,
+                       'seconds': {}, 'error': None}
+
+    def runStage(self, stage, executor):
+        if stage == 'rename':
+            self.pipeline = Pipeline(*self.args, executor=executor, **self.options)
+            # No prompt can be answered in the batch, the input() of an unclear extension fails the experiment
+            self.pipeline.rename(inWorker=True)
+            self.status['frames'] = len(self.pipeline.scanFiles)
+        elif stage == 'extract':
+            self.pipeline.extract()
+        elif stage == 'measure':
+            self.pipeline.measure()
+            self.pipeline.aggregate()
+        elif stage == 'plot':
+            plotOptions = self.plotOptions
+            allLevels = self.pipeline.allLevels
+            levels = plotOptions['levels'] or allLevels[:1]
+            if 'all' in levels:
+                levels = allLevels
+            self.pipeline.plotVariants(levels, plotOptions['timeRanges'], plotOptions['vlines'],
+                                       plotOptions['vlineColours'], plotOptions['lowerVlines'])
+            # Settings of the first figure, for --plotArguments of a later interactive run
+            start, end = plotOptions['timeRanges'][0]
+            plotSettings = {'vlines': plotOptions['vlines'], 'vlineColours': plotOptions['vlineColours'],
+                            'lowerVlines': plotOptions['lowerVlines'], 'timeRange': (start, 'end' if end == None else end),
+                            'level': levels[0]}
+            self.status['resultDir'] = self.pipeline.save(
+                plotSettings=plotSettings, exportFormats=plotOptions['exportTables'],
+                commandLine='python3 ' + ' '.join(sys.argv) + '\n\n' + str(self.pipeline.options))
+
+    def run(self, executor, onUpdate=None):
+        """Run all stages, the status is updated (and onUpdate() called) at every stage
+
+        Returns:
+            dict: self.status, 'status' is 'done' or 'failed'
+        """
+        status = self.status
+        status['status'] = 'running'
+        for stage in self.stages:
+            status['stage'] = stage
+            if onUpdate != None:
+                onUpdate()
+            start = time.perf_counter()
+            try:
+                self.runStage(stage, executor)
+            except BaseException as e:
+                status['status'] = 'failed'
+                status['error'] = f'{type(e).__name__}: {e}'
+                print(f'{status["rootPath"]} failed at {stage}:')
+                traceback.print_exc()
+                break
+            finally:
+                status['seconds'][stage] = time.perf_counter() - start
+        else:
+            status['status'] = 'done'
+            status['stage'] = None
+        if onUpdate != None:
+            onUpdate()
+        return status
+    # run
+# Experiment
+
+
+def writeStatus(statusDir, experiments):
+    """Status and timing of every experiment as batchStatus.json and batchStatus.tsv"""
+    statuses = [dict(e.status, seconds=dict(e.status['seconds'])) for e in experiments]
+    with open(os.path.join(statusDir, 'batchStatus.json_temp'), 'w') as f:
+        json.dump(statuses, f, indent=2)
+    os.replace(os.path.join(statusDir, 'batchStatus.json_temp'), os.path.join(statusDir, 'batchStatus.json'))
+    with open(os.path.join(statusDir, 'batchStatus.tsv_temp'), 'w') as f:
+        f.write('\t'.join(['rootPath', 'status', 'stage', 'frames'] + [f'{s} (s)' for s in Experiment.stages] +
+                          ['total (s)', 'frames/s', 'error']) + '\n')
+        for s in statuses:
+            seconds = [s['seconds'].get(stage) for stage in Experiment.stages]
+            total = sum(t for t in seconds if t != None)
+            f.write('\t'.join([s['rootPath'], s['status'], str(s['stage'] or ''), str(s['frames'])] +
+                              ['' if t == None else f'{t:.2f}' for t in seconds] +
+                              [f'{total:.2f}', f'{s["frames"] / total:.1f}' if total > 0 else '',
+                               s['error'] or '']) + '\n')
+    os.replace(os.path.join(statusDir, 'batchStatus.tsv_temp'), os.path.join(statusDir, 'batchStatus.tsv'))
+# writeStatus
+
+
+def runBatch(experiments, workers=None, maxExperiments=None, statusDir='.'):
+    """Run every experiment, all jobs in one process pool of workers processes
+
+    Args:
+        experiments (list): [Experiment, ...]
+        workers (int, optional): worker processes shared by all experiments. Defaults to the number of CPUs.
+        maxExperiments (int, optional): experiments running at the same time. Defaults to all.
+        statusDir (str, optional): folder of batchStatus.json and batchStatus.tsv. Defaults to '.'.
+
+    Returns:
+        list: status of every experiment
+    """
+    os.makedirs(statusDir, exist_ok=True)
+    statusLock = threading.Lock()
+
+    def onUpdate():
+        with statusLock:
+            writeStatus(statusDir, experiments)
+
+    onUpdate()
+    preloadWorkerModules()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=ignoreInterrupt)
+    # Fork all workers now, before the experiment threads are started
+    executor.submit(os.getpid).result()
+    try:
+        with ThreadPoolExecutor(max_workers=maxExperiments or max(1, len(experiments))) as threadPool:
+            statuses = list(threadPool.map(lambda e: e.run(executor, onUpdate), experiments))
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return statuses
+# runBatch
+
+
+if __name__ == '__main__':
+    import argparse
+    from multiprocessing import freeze_support
+    from funcs.batchPlot import parseNumber, parseTimeRange
+    from funcs.misc import parseMemorySize
+    freeze_support()
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument('--roots', nargs='+', default=[], metavar='GLOB', help='Root folders, glob patterns allowed')
+    parser.add_argument('--sampleInfo', default='positions.tsv',
+                        help='File name of the sample information table in each of --roots, default positions.tsv')
+    parser.add_argument('--list', help='tsv file of experiments: rootPath, sampleInfoTsvPath[, diffPos values]')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Worker processes shared by all experiments, default is the number of CPUs')
+    parser.add_argument('--maxExperiments', type=int, help='Experiments running at the same time, default all')
+    parser.add_argument('--statusDir', default='.', help='Folder for batchStatus.json and batchStatus.tsv')
+    parser.add_argument('--normType', choices=['None', 'Each', 'Combined'], default='Combined')
+    parser.add_argument('--noZeroing', action='store_true')
+    parser.add_argument('--percentage', default=1.0, type=float)
+    parser.add_argument('--resizeFactor', type=float, default=0.35)
+    parser.add_argument('--resizeProfile', choices=['fast', 'hq'], default='fast')
+    parser.add_argument('--noTimeFromFile', action='store_true')
+    parser.add_argument('--timeSource', choices=['auto', 'header', 'file'], default='auto')
+    parser.add_argument('--imageInterval', default=1.0, type=float)
+    parser.add_argument('--timeWindow', nargs=2, metavar=('START', 'END'))
+    parser.add_argument('--frameStride', type=int, default=1)
+    parser.add_argument('--noDriftDetection', action='store_true')
+    parser.add_argument('--startImageTiming', type=float, default=0.)
+    parser.add_argument('--reExtract', action='store_true')
+    parser.add_argument('--reMeasure', action='store_true')
+    parser.add_argument('--fusedMeasure', action='store_true')
+    parser.add_argument('--saveSubImages', action='store_true')
+    parser.add_argument('--subImageStore', choices=['files', 'stack'], default='files')
+    parser.add_argument('--chunkSize', type=int, default=4)
+    parser.add_argument('--framesPerJob', type=int, default=256)
+    parser.add_argument('--memoryBudget', type=parseMemorySize, metavar='SIZE',
+                        help='Memory for the decoded images of the whole batch, eg. 16G, shared by the experiments '+\
+                            'running at the same time')
+    parser.add_argument('--statistics', nargs='+', metavar='STAT',
+                        help='Statistics measured with the greyness, see extractPicAndMeasure.py')
+    parser.add_argument('--channels', nargs='+', choices=['gray', 'rgb', 'hsv', 'lab'])
+    parser.add_argument('--histBins', type=int, default=8)
+    parser.add_argument('--forceNoFillBetween', action='store_true')
+    parser.add_argument('--vlines', nargs='*', type=parseNumber, default=[])
+    parser.add_argument('--vlineColours', nargs='*', default=[])
+    parser.add_argument('--lowerVlines', nargs='+', type=parseNumber, default=[24, ])
+    parser.add_argument('--timeRange', nargs=2, action='append', metavar=('START', 'END'))
+    parser.add_argument('--levels', nargs='+')
+    parser.add_argument('--exportTables', nargs='*', choices=['tsv', 'xlsx'])
+    args = parser.parse_args()
+    if len(args.vlines) != len(args.vlineColours):
+        parser.error('--vlines and --vlineColours should have the same length')
+
+    experimentArgs = findExperiments(args.roots, args.sampleInfo)
+    if args.list != None:
+        experimentArgs.extend(readExperimentList(args.list))
+    if len(experimentArgs) == 0:
+        parser.error('No experiment found, use --roots or --list')
+    if args.timeWindow != None:
+        args.timeWindow = parseTimeRange(args.timeWindow)
+    if args.statistics != None:
+        from funcs.roiStats import statSpec
+        try:
+            statSpec(args.statistics, args.channels, args.histBins)
+        except ValueError as e:
+            parser.error(str(e))
+    options = {k: v for k, v in vars(args).items() if k in defaultOptions}
+    if args.memoryBudget != None:
+        options['memoryBudget'] = args.memoryBudget // min(len(experimentArgs), args.maxExperiments or len(experimentArgs))
+    plotOptions = {k: v for k, v in vars(args).items() if k in defaultPlotOptions}
+    plotOptions['timeRanges'] = [parseTimeRange(t) for t in args.timeRange or [['0', 'end']]]
+    if args.timeRange == None and args.timeWindow != None:
+        plotOptions['timeRanges'] = [args.timeWindow]
+    if plotOptions['exportTables'] != None and len(plotOptions['exportTables']) == 0:
+        plotOptions['exportTables'] = ['tsv', 'xlsx']
+    experiments = [Experiment(rootPath, sampleInfoTsvPath, diffPos, options, plotOptions)
+                   for rootPath, sampleInfoTsvPath, diffPos in experimentArgs]
+    print(f'{len(experiments)} experiments, {args.workers} workers.')
+    start = time.perf_counter()
+    statuses = runBatch(experiments, args.workers, args.maxExperiments, args.statusDir)
+    failed = [s for s in statuses if s['status'] != 'done']
+    print(f'{len(statuses) - len(failed)}/{len(statuses)} experiments done in {time.perf_counter() - start:.1f} s, '
+          f'status in {os.path.join(args.statusDir, "batchStatus.tsv")}.')
+    for s in failed:
+        print(f'Failed: {s["rootPath"]} at {s["stage"]}, {s["error"]}')
+    sys.exit(1 if len(failed) > 0 else 0)
@@ -4,23 +4,72 @@ Image names from scanner:
 Aim is to change the numbering of the files for easy parsing
 first image is img_000.jpg    img_001.jpg    img_002.jpg    ...
 Then the file names will be easily connected with the scanned time point.
-The script is also able to preserve the file creation time in a pickle file,
-and able to restore all names and times with a second run of this script on
-the same directory.
+The script is also able to preserve the file creation time in the scan catalog
+(scanCatalog.sqlite, see funcs/scanCatalog.py), and able to restore all names
+and times with a second run of this script on the same directory.
 Why not use the timestamp stored in the file?
     Sometimes that can be lost by copying from and to different file systems.
-    This is also the reason that I stored everything in a pickle and tsv file.
+    This is also the reason that I stored everything in a catalog and tsv file.
 
 After renaming the files, put files in `original_images` folder
+
+The directory is listed once, all renames are planned and checked before the
+first one, and done with a journal (renameJournal.json): an interrupted run is
+finished by the next run, or undone with rollbackRename() (--rollback).
 '''
 
 
 import os
 import re
-import pickle
+import json
 #import platform
+from collections import Counter
 from datetime import datetime
 
+from funcs.scanCatalog import ScanCatalog, genCatalogFile
+
+recognizableImageExtensions = ['.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.png']
+
+
+def scanDirectory(path):
+    """List the files of a directory once, sub-folders are left out
+
+    Returns:
+        dict: {file name: os.DirEntry}, the entries cache their stat()
+    """
+    with os.scandir(path) as entries:
+        return {entry.name: entry for entry in entries if entry.is_file()}
+# scanDirectory
+
+
+def chooseExtension(extCounts, path):
+    """Most common extension, image extensions win a tie, asks if there is still more than one
+
+    Args:
+        extCounts (Counter): {extension: number of files}
+        path (str): path of the files, for the messages
+
+    Returns:
+        extension: ".***", None if no image files found
+    """
+    maxOcc = max(extCounts.values(), default=0)
+    mostExts = [ext for ext, occ in extCounts.items() if occ == maxOcc]
+    if len(mostExts) > 1:
+        # remove none image extensions
+        mostExts = [ext for ext in mostExts if ext in recognizableImageExtensions]
+    if len(mostExts) == 0:
+        print(f"I didn't recognise any image files in this path.\n{path}")
+        return None
+    while len(mostExts) != 1:  # two image format with equal amount, ask for help
+        ext = input(f"I find multiple extensions in {path},\nplease choose one:\n{mostExts}\n")
+        if ext in mostExts:
+            mostExts = [ext, ]
+        else:
+            print('Please type in ".***" (including the dot)')
+    return mostExts[0]
+# chooseExtension
+
+
 def determineExtension(path):
     """Find the most representative file extension in this dir
 
@@ -30,52 +79,17 @@ def determineExtension(path):
     Returns:
         extension: ".***"
     """
-    recognizableImageExtensions = ['.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.png']
-    extList = []
-    for file in os.listdir(path):
-        _, ext = os.path.splitext(file)
-        extList.append(ext)
-
-    allExts = list(set(extList))
-    mostExts = []
-    occurrences = []
-    for ext in allExts:
-        occurrences.append(extList.count(ext))
-    maxOcc = max(occurrences)
-    for i, occ in enumerate(occurrences):
-        if occ == maxOcc:
-            mostExts.append(allExts[i])
-    while len(mostExts) != 1:
-        # remove none image extensions
-        remove = False
-        for ext in mostExts:
-            if ext not in recognizableImageExtensions:
-                mostExts.remove(ext)
-                remove = True
-        if len(mostExts) == 0:
-            print(f"I didn't recognise any image files in this path.\n{path}")
-            return None, None
-        if not remove:  # means there are two image format with equal amount, ask for help
-            isSet = False
-            while not isSet:
-                ext = input(
-                    f"I find multiple extensions in {path},\nplease choose one:\n{mostExts}\n")
-                if ext in mostExts:
-                    mostExts = [ext, ]
-                    isSet = True
-                else:
-                    print('Please type in ".***" (including the dot)')
-    extension = mostExts[0]
-    return extension
+    return chooseExtension(Counter(os.path.splitext(name)[1] for name in scanDirectory(path)), path)
 # determineExtension()
 
 
-def determinePrefixExtension(path):
+def determinePrefixExtension(path, fileNames=None):
     """Find extension first, by the most aboundant and picture ones,
     Find prefix second, by remove numbering of files with found extension.
 
     Args:
         path (str): Path to dir with images
+        fileNames (list, optional): names of the files in path if already listed. Defaults to None.
 
     Returns:
         prefix, extension, totalNum, digits: 
@@ -84,28 +98,19 @@ def determinePrefixExtension(path):
             totalNum - number of files with the prefix and extension
             digits - number of digits of the numbering needed (for downstream zfill)
     """
-    filesFolders = os.listdir(path)
-    if 'original_images' in filesFolders:
+    if os.path.isdir(os.path.join(path, 'original_images')):
         path = os.path.join(path, 'original_images')
-        filesFolders = os.listdir(path)
-    extension = determineExtension(path)
-    # find prefix
-    prefixList = []
-    prefixNums = []
-    totalNum = 0
-    for file in filesFolders:
-        _, ext = os.path.splitext(file)
-        if ext == extension:
-            totalNum += 1
-            prefix, _ = findPrefix(file)
-            if prefix == None:
-                continue
-            if prefix not in prefixList:
-                prefixList.append(prefix)
-                prefixNums.append(1)
-            else:
-                prefixNums[prefixList.index(prefix)] += 1
-    prefix = prefixList[prefixNums.index(max(prefixNums))]
+        fileNames = None
+    if fileNames == None:
+        fileNames = list(scanDirectory(path))
+    extension = chooseExtension(Counter(os.path.splitext(name)[1] for name in fileNames), path)
+    # find prefix, the most common one in listing order
+    withExtension = [name for name in fileNames if os.path.splitext(name)[1] == extension]
+    prefixes = Counter(p for p, _ in map(findPrefix, withExtension) if p != None)
+    if len(prefixes) == 0:
+        raise ValueError(f'No numbered {extension} files (eg. img_1{extension}) found in {path}')
+    prefix = prefixes.most_common(1)[0][0]
+    totalNum = len(withExtension)
     digits = len(str(totalNum))
 
     return prefix, extension, totalNum, digits
@@ -126,6 +131,12 @@ def findPrefix(f):
         n = 0
     return p, n
 
+def naturalKey(name):
+    """Sort key that orders numbers in file names by value (img_99 before img_100)"""
+    return [int(t) if t.isdigit() else t for t in re.split(r'([0-9]+)', name)]
+# naturalKey
+
+
 def getScanTime(filePath):
     """Try to get the date that a file was created, falling back to when it was
     last modified if that isn't possible.
@@ -146,213 +157,310 @@ def getScanTime(filePath):
 # getScanTime
 
 
-def genLogFile(path):
-    return os.path.join(path, 'nameTimeLog.pickle')
+def genJournalFile(path):
+    return os.path.join(path, 'renameJournal.json')
+
+
+def writeFileSafely(filePath, data):
+    """Write bytes to a temporary file, flush it to disk and move it in place"""
+    with open(f'{filePath}_temp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{filePath}_temp', filePath)
+# writeFileSafely
+
+
+def applyRenamePlan(path, plan, newScans, isNew, makeDir=None, removeDir=None):
+    """Rename all files of a plan with a journal, an interrupted run can be finished with
+    resumeRename() or undone with rollbackRename().
+
+    The journal (plan and the catalog update) is on disk before the first rename. Targets
+    never collide with other files of the plan, so whether a file is renamed can be told
+    from which of its two names exists. The scan catalog is updated after the last rename,
+    in one transaction, then the journal is removed.
+
+    Args:
+        path (str): path to dir, names in the plan are relative to it
+        plan (list): [(name, new name, time to set or None), ...]
+        newScans (list): [(old name, new name, scan time, file size), ...] to add to the catalog
+        isNew (bool): state of the names in the catalog when done
+        makeDir (str, optional): folder created before renaming. Defaults to None.
+        removeDir (str, optional): folder removed after renaming, if empty. Defaults to None.
+    """
+    journal = {'plan': plan, 'newScans': newScans, 'isNew': isNew, 'makeDir': makeDir, 'removeDir': removeDir}
+    writeFileSafely(genJournalFile(path), json.dumps(journal).encode())
+    finishJournal(path, journal)
+# applyRenamePlan
+
+
+def existingNames(path, plan):
+    """Names in the plan that exist, each folder of the plan is listed once
+
+    Returns:
+        set: names relative to path, as in the plan
+    """
+    folders = {os.path.dirname(n) for name, newName, _ in plan for n in (name, newName)}
+    existing = set()
+    for folder in folders:
+        if os.path.isdir(os.path.join(path, folder)):
+            existing.update(os.path.join(folder, n) for n in os.listdir(os.path.join(path, folder)))
+    return existing
+# existingNames
+
+
+def finishJournal(path, journal):
+    if journal['makeDir'] != None:
+        os.makedirs(os.path.join(path, journal['makeDir']), exist_ok=True)
+    existing = existingNames(path, journal['plan'])
+    for name, newName, fileTime in journal['plan']:
+        newFilePath = os.path.join(path, newName)
+        if newName not in existing:  # renamed already if resumed
+            os.rename(os.path.join(path, name), newFilePath)
+        if fileTime != None:
+            os.utime(newFilePath, (fileTime, fileTime))
+    with ScanCatalog(path) as catalog:
+        catalog.addScans(journal['newScans'], journal['isNew'])
+    if journal['removeDir'] != None:
+        try:
+            os.rmdir(os.path.join(path, journal['removeDir']))
+        except OSError:
+            pass
+    os.remove(genJournalFile(path))
+# finishJournal
+
 
+def loadJournal(path):
+    """Journal of an interrupted renaming, None if there is none"""
+    journalFile = genJournalFile(path)
+    if not os.path.isfile(journalFile):
+        return None
+    with open(journalFile, 'r') as f:
+        return json.load(f)
+# loadJournal
 
-def changeToNew(path, dictOld2New, dictOldScanTime):
+
+def resumeRename(path):
+    """Finish an interrupted renaming in path
+
+    Returns:
+        bool: True if there was one
+    """
+    journal = loadJournal(path)
+    if journal == None:
+        return False
+    print(f'Finishing the interrupted renaming in {path} ({len(journal["plan"])} files).')
+    finishJournal(path, journal)
+    return True
+# resumeRename
+
+
+def rollbackRename(path):
+    """Undo an interrupted renaming in path, the files renamed so far get their names back
+    and the scan catalog is left as it was before.
+
+    Returns:
+        bool: True if there was one
+    """
+    journal = loadJournal(path)
+    if journal == None:
+        return False
+    undone = 0
+    existing = existingNames(path, journal['plan'])
+    for name, newName, _ in reversed(journal['plan']):
+        if newName in existing and name not in existing:
+            os.rename(os.path.join(path, newName), os.path.join(path, name))
+            undone += 1
+    if journal['makeDir'] != None:
+        try:
+            os.rmdir(os.path.join(path, journal['makeDir']))
+        except OSError:
+            pass
+    os.remove(genJournalFile(path))
+    print(f'{undone} renamed files in {path} got their names back.')
+    return True
+# rollbackRename
+
+
+def checkRenamePlan(path, plan):
+    """Before renaming anything: every file exists, no target is taken or used twice"""
+    targets = Counter(newName for _, newName, _ in plan)
+    duplicates = [newName for newName, n in targets.items() if n > 1]
+    if len(duplicates) > 0:
+        raise NameError(f'Several files would be renamed to {duplicates[:5]}, files with no numbering?')
+    existing = existingNames(path, plan)
+    for name, newName, _ in plan:
+        if name not in existing:
+            raise NameError(f'File not found {os.path.join(path, name)}')
+        if newName in existing:
+            raise NameError(f'{os.path.join(path, newName)} already exists, {name} is not renamed.')
+# checkRenamePlan
+
+
+def changeToNew(path, catalog):
     """Parse all file names, make file names easier to parse in the following steps.
-    Pass {} for dictOld2New and {} for dictOldScanTime if fresh.
-    After rename, moveToOriDir() will be called, all file will be moved to a folder called
-    'original_images' in this path
+    Files already in the catalog get their new names back, all the others in path if
+    the catalog is empty (fresh).
+    The files are moved to a folder called 'original_images' in this path with their
+    new names.
 
     Args:
         path (str): path to dir
-        dictOld2New (dict): {'old': 'new'}
-        dictOldScanTime (dict): {'old': timestamp}
+        catalog (ScanCatalog): catalog of the scans in path
 
     Raises:
         NameError: If more than one file is found with no numbering
     """
-    logFile = genLogFile(path)
-    isFresh = False
-    # if empty dict is passed, then I know file names are intact
-    prefix, extension, totalNum, digits = determinePrefixExtension(path)
-    if len(dictOld2New) == 0:
-        isFresh = True
-        files = [f for f in os.listdir(path) if f.endswith(extension)]
-    else:
-        files = dictOld2New.keys()
-
-    # Collect info, prepare old and new names in a dict
-    nameChangeDict = {}  # {'old': 'new'}
-    for oldName in files:
-        oldFilePath = os.path.join(path, oldName)
-        if isFresh:
-            foundNo1 = False
-            p, n = findPrefix(oldName)
-            if p != prefix:
-                if foundNo1:
-                    raise NameError(f'Another file with no numbering? {oldName}')
-                else:
-                    foundNo1 = True
+    scans = catalog.names()
+    newScans = []
+    # if the catalog is empty, then I know file names are intact
+    if len(scans) == 0:
+        files = scanDirectory(path)
+        prefix, extension, totalNum, digits = determinePrefixExtension(path, list(files))
+        for oldName, entry in files.items():
+            if not oldName.endswith(extension):
+                continue
+            _, n = findPrefix(oldName)
             newName = f'{prefix}{str(n).zfill(digits)}{extension}'
-            dictOld2New[oldName] = newName
-            dictOldScanTime[newName] = getScanTime(oldFilePath)
-        else:
-            newName = dictOld2New[oldName]
-        newFilePath = os.path.join(path, newName)
-        if os.path.isfile(newFilePath):
-            newFilePath = f"{newFilePath}_temp"
-        nameChangeDict[oldFilePath] = newFilePath
-
-    # If preparation finished with no error, do change name
-    for oldFilePath in nameChangeDict:
-        newFilePath = nameChangeDict[oldFilePath]
-        os.rename(oldFilePath, newFilePath)
-    for file in os.listdir(path):
-        if file.endswith('_temp'):
-            name = file[:-5]
-            tempPath = os.path.join(path, file)
-            correctPath = os.path.join(path, name)
-            os.rename(tempPath, correctPath)
-    isNew = True
-
-    # write info to new file
-    with open(logFile, 'wb') as fileNameLog:
-        pickle.dump((dictOld2New, dictOldScanTime, isNew), fileNameLog)
-
-    # Move file:
-    moveToOriDir(path, logFile)
+            st = entry.stat()
+            newScans.append((oldName, newName, st.st_mtime, st.st_size))  # st_mtime same as getScanTime()
+        scans = [(oldName, newName) for oldName, newName, _, _ in newScans]
+    plan = [(oldName, os.path.join('original_images', newName), None) for oldName, newName in scans]
+    checkRenamePlan(path, plan)
+    applyRenamePlan(path, plan, newScans, True, makeDir='original_images')
 # changeToNew
 
 
-def changeToOld(path, dictOld2New, dictOldScanTime):
-    """Will first move all files from 'original_images' dir out and then
-    change file names to the original stats based on info in dictOld2New.
-    The file creation (modification) time will not be altered.
+def changeToOld(path, catalog):
+    """Will move all files from 'original_images' dir out and change file names to the
+    original stats based on the catalog. The file creation (modification) time
+    is set to the one stored.
 
     Args:
         path (str): path to dir
-        dictOld2New (dict): {'old': 'new'}
-        dictOldScanTime (dict): {'old': timestamp}
+        catalog (ScanCatalog): catalog of the scans in path
     """
-    logFile = genLogFile(path)
-    # move file back
-    moveToOriDir(path, logFile, back=True)
-
-    nameChangeDict = {}
-    for oldName in dictOld2New:
-        oldFilePath = os.path.join(path, oldName)
-        newName = dictOld2New[oldName]
-        newFilePath = os.path.join(path, newName)
-        if not os.path.isfile(newFilePath):
-            raise NameError(f'File not found {newFilePath}')
-        if os.path.isfile(oldFilePath) and newFilePath != oldFilePath:
-            # the original file name is being occupied by a different file
-            oldFilePath = f'{oldFilePath}_temp'
-        atime = dictOldScanTime[newName]
-        mtime = dictOldScanTime[newName]
-        nameChangeDict[oldFilePath] = (newFilePath, atime, mtime)
-    for oldFilePath in nameChangeDict:
-        newFilePath, atime, mtime = nameChangeDict[oldFilePath]
-        os.rename(newFilePath, oldFilePath)
-        os.utime(oldFilePath, (atime, mtime))
-    # Deal with temp file names
-    for file in os.listdir(path):
-        if file.endswith('_temp'):
-            name = file[:-5]
-            tempPath = os.path.join(path, file)
-            correctPath = os.path.join(path, name)
-            os.rename(tempPath, correctPath)
-    isNew = False
-    # refresh info file
-    with open(logFile, 'wb') as fileNameLog:
-        pickle.dump((dictOld2New, dictOldScanTime, isNew), fileNameLog)
+    dictOldScanTime = catalog.dictOldScanTime()
+    plan = [(os.path.join('original_images', newName), oldName, dictOldScanTime[newName])
+            for oldName, newName in catalog.names()]
+    checkRenamePlan(path, plan)
+    applyRenamePlan(path, plan, [], False, removeDir='original_images')
 # changeToOld
 
 
 def changeFileName(path, reverse=True):
     """Wraper changeToNew() and changeToOld()
+    An interrupted renaming is finished instead, see resumeRename().
 
     Args:
         path (str): path of the dirctory
 
     Returns:
-        logFile: Path to the log file in the dirctory,
-                 Binary pickle containing (dictOld2New, dictOldScanTime, isNew)
+        catalogFile: Path to the scan catalog in the dirctory, see funcs/scanCatalog.py
     """
-    logFile = genLogFile(path)
-
-    if os.path.isfile(logFile):
-        with open(logFile, 'rb') as f:
-            dictOld2New, dictOldScanTime, isNew = pickle.load(f)
-        if isNew and reverse:
-            changeToOld(path, dictOld2New, dictOldScanTime)
-        else:  # then we need to change back
-            changeToNew(path, dictOld2New, dictOldScanTime)
-    else:
-        dictOld2New = {}
-        dictOldScanTime = {}
-        changeToNew(path, dictOld2New, dictOldScanTime)
-    writeTable(path, logFile)
+    if not resumeRename(path):
+        with ScanCatalog(path) as catalog:
+            if catalog.isNew and reverse:
+                changeToOld(path, catalog)
+            else:  # fresh, or we need to change back
+                changeToNew(path, catalog)
+    writeTable(path)
+    return genCatalogFile(path)
 # changeFileName()
 
 
-def moveToOriDir(path, logFile, back=False):
-    with open(logFile, 'rb') as fileNameLog:
-        dictOld2New, _, _ = pickle.load(fileNameLog)
-    tDir = os.path.join(path, 'original_images')
-    if not os.path.isdir(tDir):
-        os.mkdir(tDir)
-    for oldName in dictOld2New:
-        newName = dictOld2New[oldName]
-        newFileOriPath = os.path.join(path, newName)
-        newFileTarPath = os.path.join(tDir, newName)
-        if back:
-            os.rename(newFileTarPath, newFileOriPath)
-            pass
-        else:
-            os.rename(newFileOriPath, newFileTarPath)
-    if back:
-        try:
-            os.rmdir(tDir)
-        except:
-            pass
-# moveToOriDir()
+def appendNewFiles(path, minAge=10):
+    """Rename scans that arrived after changeFileName() and move them to 'original_images'.
+    Numbering and prefix follow the files already renamed, the scan catalog is updated.
+    Files modified less than minAge seconds ago are left for the next call, the scanner
+    may still be writing them.
 
+    Args:
+        path (str): path to dir, renamed with changeFileName() before
+        minAge (float, optional): seconds since the last modification. Defaults to 10.
+
+    Raises:
+        NameError: If the new name of a file is already taken
 
-def writeTable(path, logFile):
+    Returns:
+        newNames: list of new names added, sorted
     """
-    TSV file is written separately
+    resumeRename(path)
+    with ScanCatalog(path) as catalog:
+        assert catalog.isNew, f'File names in {path} are reverted to the original names, run changeFileName() first.'
+        scans = catalog.names()
+        lastName = catalog.lastScan()['newName']
+    knownOldNames = {oldName for oldName, _ in scans}
+    knownNewNames = {newName for _, newName in scans}
+    lastBase, extension = os.path.splitext(lastName)
+    prefix, _ = findPrefix(lastName)
+    digits = len(re.findall(r'[0-9]+$', lastBase)[-1])
+
+    newScans = []
+    now = datetime.now().timestamp()
+    for oldName, entry in scanDirectory(path).items():
+        if not oldName.endswith(extension) or oldName in knownOldNames:
+            continue
+        st = entry.stat()
+        if now - st.st_mtime < minAge:
+            continue
+        p, n = findPrefix(oldName)
+        if p != prefix:
+            print(f'Skip {oldName}, prefix is not "{prefix}".')
+            continue
+        newName = f'{prefix}{str(n).zfill(digits)}{extension}'
+        if newName in knownNewNames:
+            raise NameError(f'New name {newName} of {oldName} already exists.')
+        newScans.append((oldName, newName, st.st_mtime, st.st_size))  # st_mtime same as getScanTime()
+
+    if len(newScans) > 0:
+        plan = [(oldName, os.path.join('original_images', newName), None) for oldName, newName, _, _ in newScans]
+        checkRenamePlan(path, plan)
+        applyRenamePlan(path, plan, newScans, True)
+        writeTable(path)
+    return sorted([newName for _, newName, _, _ in newScans], key=naturalKey)
+# appendNewFiles()
+
+
+def writeTable(path, catalogPath=None):
+    """
+    TSV file is written separately, from the scan catalog
     path can be a different directory
-    logFile is the full path to the logFile
+    The table is written again when scans are added, the one written for the earlier date range is removed
 
     Args:
         path (str): path to the directory
-        logFile (str): path of log file generated by changeFileName(path),
-                       This file is binary pickle containing (dictOld2New, dictOldScanTime, isNew)
+        catalogPath (str, optional): path of the experiment with the catalog made by changeFileName().
+                                     Defaults to None, same as path.
     """
-    with open(logFile, 'rb') as fileNameLog:
-        dictOld2New, dictOldScanTime, _ = pickle.load(fileNameLog)
-    for newName in dictOldScanTime:
-        timeCreation = dictOldScanTime[newName]
-    maxTime = max(dictOldScanTime.values())
-    minTime = min(dictOldScanTime.values())
-    maxDate = datetime.fromtimestamp(
-        maxTime).strftime("%A, %d %B %Y, %H:%M:%S").split(', ')[1]
-    minDate = datetime.fromtimestamp(
-        minTime).strftime("%A, %d %B %Y, %H:%M:%S").split(', ')[1]
-    logTsv = os.path.join(path, f'scanLog{minDate}-{maxDate}.tsv'.replace(' ', '_'))
-
+    with ScanCatalog(catalogPath or path) as catalog:
+        scans = catalog.scans()
+        names = catalog.names()
+    if len(scans) == 0:
+        return
+    minDate = datetime.fromtimestamp(scans[0]['scanTime']).strftime('%d %B %Y')
+    maxDate = datetime.fromtimestamp(scans[-1]['scanTime']).strftime('%d %B %Y')
+    tsvName = f'scanLog{minDate}-{maxDate}.tsv'.replace(' ', '_')
+    logTsv = os.path.join(path, tsvName)
     if os.path.isfile(logTsv):
-        pass
-    else:
-        with open(logTsv, 'w') as logTsv:
-            lines = []
-            for oldName in dictOld2New:
-                newName = dictOld2New[oldName]
-                timeCreation = dictOldScanTime[newName]
-                timeStr = datetime.fromtimestamp(
-                    timeCreation).strftime("%A, %d %B %Y, %H:%M:%S")
-                weekDay = timeStr.split(', ')[0]
-                scanDate = timeStr.split(', ')[1]
-                scanTime = timeStr.split(', ')[2]
-                lines.append(
-                    f'{oldName}\t{newName}\t{weekDay}\t{scanDate}\t{scanTime}\n')
-            lines.sort(key=lambda line: line.split('\t')[1])
-            lines.insert(0, 'old_name\tnew_name\tweek_day\tdate\tscan_time\n')
-            logTsv.writelines(lines)
+        with open(logTsv, 'r') as f:
+            if sum(1 for _ in f) == len(names) + 1:  # no scans added since written
+                return
+
+    scanTimes = {scan['newName']: scan['scanTime'] for scan in scans}
+    lines = ['old_name\tnew_name\tweek_day\tdate\tscan_time\n']
+    for oldName, newName in names:
+        timeStr = datetime.fromtimestamp(scanTimes[newName]).strftime("%A, %d %B %Y, %H:%M:%S")
+        weekDay, scanDate, scanTime = timeStr.split(', ')
+        lines.append(f'{oldName}\t{newName}\t{weekDay}\t{scanDate}\t{scanTime}\n')
+    with open(f'{logTsv}_temp', 'w') as f:
+        f.writelines(lines)
+    os.replace(f'{logTsv}_temp', logTsv)
+    # tables written before the last scans were added: same first date, one of the later dates as the last
+    for scanDate in dict.fromkeys(datetime.fromtimestamp(scan['scanTime']).strftime('%d %B %Y') for scan in scans):
+        oldTsv = os.path.join(path, f'scanLog{minDate}-{scanDate}.tsv'.replace(' ', '_'))
+        if oldTsv != logTsv and os.path.isfile(oldTsv):
+            os.remove(oldTsv)
 # writeTable()
 
 
@@ -360,7 +468,12 @@ if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description='pass a directory as first argument')
     parser.add_argument('path')
+    parser.add_argument('--rollback', action='store_true',
+                        help='Undo an interrupted renaming (renameJournal.json in path) instead of finishing it')
     args = parser.parse_args()
     path = args.path
 
-    changeFileName(path)
+    if args.rollback:
+        rollbackRename(path)
+    else:
+        changeFileName(path)
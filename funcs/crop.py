@@ -1,8 +1,87 @@
 import os
+import numpy as np
 from PIL import Image
-from funcs import getScanTime
+from funcs import getScanTime, perfStats
+from funcs.measureImages import imageToGray, measureRoi, getRoiMask
+from funcs.roiStats import roiStatistics, statPixels
+from funcs.frameCache import getCachedFrame
+from funcs.subImageStack import writeStackFrame
 
-def crop(picPath, posDict, targetPaths, paddingPos=None, resizeFactor=None, useFileTime=True):
+resizedProfiles = {
+    'fast': dict(quality=75),
+    'hq': dict(quality=85, progressive=True, optimize=True),
+}
+
+
+def saveResized(im, resizeFilePath, resizeFactor, profile='fast', iccProfile=None, fileTime=None, scale=1):
+    """Resize and save as JPEG with one of resizedProfiles
+
+    Args:
+        im (PIL.Image): image to resize, already cropped
+        resizeFilePath (str): output path
+        resizeFactor (float): factor of original size
+        profile (str, optional): key of resizedProfiles. Defaults to 'fast'.
+        iccProfile (bytes, optional): ICC profile of the original. Defaults to None.
+        fileTime (float, optional): set as atime and mtime of the output if not None. Defaults to None.
+        scale (float, optional): size of im relative to the original, when decoded with draft. Defaults to 1.
+    """
+    newSize = tuple(int(size / scale * resizeFactor) for size in im.size)
+    if profile == 'hq':
+        im = im.resize(newSize, Image.LANCZOS)
+    else:
+        im = im.resize(newSize, reducing_gap=3.0)
+    im.save(resizeFilePath, 'jpeg', icc_profile=iccProfile, **resizedProfiles[profile])
+    if fileTime != None:
+        os.utime(resizeFilePath, (fileTime, fileTime))
+# saveResized
+
+
+def cropMemory(size, mode):
+    """Peak bytes crop() holds for one image of size (width, height) and mode: the decoded image, its
+    padding removed copy made before the decoded one is freed, and the sub-image being measured"""
+    bytesPerPixel = 1 if mode in ['1', 'L', 'P'] else 2 if mode.startswith('I;16') else 4  # PIL storage
+    return int(size[0] * size[1] * bytesPerPixel * 2.5)
+# cropMemory
+
+
+def crop(picPath, posDict, targetPaths, paddingPos=None, resizeFactor=None, useFileTime=True,
+         measureInfo=None, saveSubImages=True, frameCache=None, frameSlot=None, draftScale=None,
+         resizeProfile='fast', subImageStack=None, statSpec=None):
+    """Crop one original image into sub-images, optionally measure every position in memory
+
+    Args:
+        picPath (str): path to the original image
+        posDict (dict): {posName: (x1, y1, x2, y2)}
+        targetPaths (dict): output of createFolders()
+        paddingPos (list, optional): (x1, y1, x2, y2) to save a padding removed image. Defaults to None.
+        resizeFactor (float, optional): save a resized image if set. Defaults to None.
+        useFileTime (bool, optional): copy the time of the original to new files. Defaults to True.
+        measureInfo (dict, optional): {posName: (measureType, percentage, polygon)}, when set, the
+                                      positions are measured from the decoded original image,
+                                      no need to read sub-images back. Defaults to None.
+        saveSubImages (bool, optional): write sub-images to subImages/posName. Defaults to True.
+        frameCache (dict, optional): output of openFrameCache(), the decoded image is taken from (or
+                                     stored to) the memory mapped frame stack. A 'gray' cache is only
+                                     used when nothing is written and no statistics are measured.
+                                     Defaults to None.
+        frameSlot (int, optional): slot of this image in the frame cache. Defaults to None.
+        draftScale (float, optional): measure from an image decoded at reduced resolution (JPEG DCT
+                                      scaling, PIL draft), the scale used is the closest one not below
+                                      draftScale. Only used when no full resolution image is written.
+                                      Defaults to None.
+        resizeProfile (str, optional): JPEG encoding of the resized image, key of
+                                       resizedProfiles. Defaults to 'fast'.
+        subImageStack (dict, optional): {posName: (stackInfo, slot)} from allocateStack(), sub-images are
+                                        written to the stacks instead of files. Defaults to None.
+        statSpec (tuple, optional): output of roiStats.statSpec(), the statistics are measured with the
+                                    greyness, from the decoded scan if the frame cache is 'gray'.
+                                    Defaults to None.
+
+    Returns:
+        picPath, measured: measured is {posName: value}, empty if measureInfo is None. With statSpec, value
+                           is an np.ndarray, the greyness followed by the statistics.
+    """
+    frameStart = perfStats.clock()
     picName, extension = os.path.splitext(os.path.basename(picPath))
     if extension not in ['.bmp', '.tif', '.tiff', '.png']:
         outputFmt = 'jpeg'
@@ -14,37 +93,93 @@ def crop(picPath, posDict, targetPaths, paddingPos=None, resizeFactor=None, useF
         # bmp files will be easier for compression latter
     scanTime = getScanTime(picPath)
     atime, utime = (scanTime, scanTime)
+    measured = {}
+    writeImages = saveSubImages or paddingPos != None or resizeFactor != None
+    frame = None
+    offset = (0, 0)  # frames in the cache can have the padding removed
+    grayScale = 1  # grey frames in the cache are stored as uint8
+    if frameCache != None and frameSlot != None and (frameCache['mode'] == 'rgb' or (not writeImages and statSpec == None)):
+        h, w = frameCache['shape'][:2]
+        x0, y0 = frameCache['offset']
+        if all(x0 <= b[0] and y0 <= b[1] and b[2] <= x0 + w and b[3] <= y0 + h for b in posDict.values()):
+            with perfStats.timer('crop.frameCache'):
+                frame = getCachedFrame(picPath, frameCache, frameSlot)
+            offset = (x0, y0)
+            if frameCache['mode'] == 'gray':
+                grayScale = frameCache['grayScale']
     with Image.open(picPath) as im:
         iccProfile = im.info.get('icc_profile')
+        fullWidth = im.size[0]
+        if frame is not None:
+            im = Image.fromarray(frame)
+            fullWidth = im.size[0]
+        else:
+            # Decode at reduced resolution when nothing needs the full resolution image
+            needFullRes = saveSubImages or (paddingPos != None and not 'cropped_ori' in picPath) or \
+                (measureInfo and draftScale == None)
+            scales = [f for f in [draftScale if measureInfo else None, resizeFactor] if f != None]
+            targetScale = max(scales) if len(scales) > 0 else None
+            if not needFullRes and targetScale != None and targetScale < 1:
+                im.draft(im.mode, tuple(int(size * targetScale) for size in im.size))
+            with perfStats.timer('crop.decode'):
+                im.load()
+        scale = im.size[0] / fullWidth  # 1 unless decoded with draft
         for posName in posDict:
+            box = [round((c - offset[i % 2]) * scale) for i, c in enumerate(posDict[posName])]
+            subIm = im.crop(box)
+            if measureInfo != None and posName in measureInfo:
+                measureType, percentage, polygon = measureInfo[posName]
+                if polygon != None and scale != 1:
+                    polygon = tuple(round(p * scale) for p in polygon)
+                with perfStats.timer('crop.measure'):
+                    measured[posName] = measureRoi(imageToGray(subIm), measureType, percentage, polygon) * grayScale
+                if statSpec != None:
+                    with perfStats.timer('crop.statistics'):
+                        pixels, mode = statPixels(subIm)
+                        mask = getRoiMask(pixels.shape, measureType, percentage,
+                                          None if polygon == None else tuple(int(p) for p in polygon))
+                        stats = roiStatistics(pixels[mask][np.newaxis], mode, statSpec)[0]
+                    measured[posName] = np.concatenate(([measured[posName]], stats))
+            if not saveSubImages:
+                continue
+            if subImageStack != None:
+                stackInfo, slot = subImageStack[posName]
+                with perfStats.timer('crop.writeStack'):
+                    writeStackFrame(stackInfo, slot, subIm)
+                perfStats.count('crop.bytesWritten', subIm.size[0] * subIm.size[1] * len(subIm.getbands()))
+                continue
             targetPath = targetPaths[os.path.join('subImages', posName)]
             outFilePath = os.path.join(targetPath, f'{picName}_{posName}{outputExt}')
-            im.crop(posDict[posName]).save(outFilePath,
-                                           outputFmt,
-                                           icc_profile=iccProfile,
-                                           )
+            encodeStart = perfStats.clock()
+            subIm.save(outFilePath,
+                       outputFmt,
+                       icc_profile=iccProfile,
+                       )
             if useFileTime:
                 os.utime(outFilePath, (atime, utime))
+            perfStats.addTime('crop.encodeSubImages', encodeStart)
+            perfStats.countFile('crop.bytesWritten', outFilePath)
         if paddingPos != None and not 'cropped_ori' in picPath:
-            im = im.crop(paddingPos)
+            fullIm, im = im, im.crop([c - offset[i % 2] for i, c in enumerate(paddingPos)])
+            # only the padding removed image is used from here, the full one is freed before encoding
+            fullIm.close()
+            del fullIm
             # save cropped pictures
             croppedFilePath = os.path.join(targetPaths['cropped_ori'],
                                            f'{picName}_cropped{outputExt}')
-            im.save(croppedFilePath, outputFmt, icc_profile=iccProfile)
+            with perfStats.timer('crop.encodeCropped'):
+                im.save(croppedFilePath, outputFmt, icc_profile=iccProfile)
             if useFileTime:
                 os.utime(croppedFilePath, (atime, utime))
+            perfStats.countFile('crop.bytesWritten', croppedFilePath)
         if resizeFactor != None:
             resizeFilePath = os.path.join(targetPaths['resized'],
                                           f'{picName}_resized.jpg')
-            newSize = tuple(int(size * resizeFactor) for size in im.size)
-            im = im.resize(newSize)
-            im.save(resizeFilePath,
-                    'jpeg',
-                    icc_profile=iccProfile,
-                    progressive=True,
-                    quality=85,
-                    optimize=True)
-            if useFileTime:
-                os.utime(resizeFilePath, (atime, utime))
-    return
+            with perfStats.timer('crop.encodeResized'):
+                saveResized(im, resizeFilePath, resizeFactor, resizeProfile, iccProfile,
+                            fileTime=utime if useFileTime else None, scale=scale)
+            perfStats.countFile('crop.bytesWritten', resizeFilePath)
+    perfStats.count('crop.frames')
+    perfStats.addSample('crop.frame', perfStats.clock() - frameStart)
+    return picPath, measured
 # crop
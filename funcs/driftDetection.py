@@ -0,0 +1,247 @@
+'''
+Detection of plate movement during a time lapse experiment.
+
+Scans are registered by phase correlation: the region holding the positions is
+read as a small grey thumbnail (JPEG DCT scaling, PIL draft), the thumbnails of a
+chunk of scans are transformed together with one batched FFT, and the peak of the
+normalised cross-power spectrum is the shift of the plate. Every scan of a chunk is
+registered against the first one, so a drift slower than a thumbnail pixel per scan
+adds up while the sub-pixel noise of each scan does not. Shifts are stored in driftLog.json in the root path, scans
+arriving later only need their own thumbnails.
+
+The cumulative shift splits the scans into groups with the plate at different
+places, which is the diffPos grouping of extractPicAndMeasure.py:
+
+    python -m funcs.driftDetection path/to/experiment positions.tsv
+'''
+
+
+import os
+import json
+
+import numpy as np
+
+
+def genDriftLogFile(path):
+    return os.path.join(path, 'driftLog.json')
+
+
+def driftRegion(posToCrop, imageSize, margin=0.1):
+    """Bounding box of all positions, enlarged by margin of its size on every side and clipped to the image
+
+    Args:
+        posToCrop (dict): {posName: (x1, y1, x2, y2)}, output of getPosToCrop()
+        imageSize (tuple): (width, height) of the scans
+        margin (float, optional): Defaults to 0.1.
+
+    Returns:
+        tuple: (x1, y1, x2, y2)
+    """
+    boxes = np.array([p[:4] for p in posToCrop.values()])
+    x1, y1 = boxes[:, :2].min(axis=0)
+    x2, y2 = boxes[:, 2:].max(axis=0)
+    marginX, marginY = int((x2 - x1) * margin), int((y2 - y1) * margin)
+    return (int(max(0, x1 - marginX)), int(max(0, y1 - marginY)),
+            int(min(imageSize[0], x2 + marginX)), int(min(imageSize[1], y2 + marginY)))
+# driftRegion
+
+
+def thumbnailShape(region, thumbSize=256):
+    """(width, height) of the thumbnail of region, the longer side thumbSize, never enlarged"""
+    width, height = region[2] - region[0], region[3] - region[1]
+    scale = min(1, thumbSize / max(width, height))
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+# thumbnailShape
+
+
+def defaultMinShift(region, thumbSize=256):
+    """1.5 pixels of the thumbnails in pixels of the scans, smaller moves are not told apart from noise"""
+    return 1.5 * (region[2] - region[0]) / thumbnailShape(region, thumbSize)[0]
+# defaultMinShift
+
+
+def readThumbnail(filePath, region, thumbShape):
+    """Grey thumbnail of region of an image, decoded at the lowest resolution enough for it
+
+    Returns:
+        np.ndarray: float32, shape (height, width) of thumbShape
+    """
+    from PIL import Image
+    with Image.open(filePath) as im:
+        fullSize = im.size
+        regionScale = thumbShape[0] / (region[2] - region[0])
+        im.draft('L', tuple(int(size * regionScale) + 1 for size in fullSize))
+        scale = im.size[0] / fullSize[0]
+        box = tuple(v * scale for v in region)
+        return np.asarray(im.convert('L').resize(thumbShape, Image.BILINEAR, box=box), dtype=np.float32)
+# readThumbnail
+
+
+def phaseCorrelate(thumbs, reference=False):
+    """Shift of every thumbnail from the one before it, by phase correlation
+
+    Args:
+        thumbs (np.ndarray): shape (n, height, width)
+        reference (bool, optional): shifts from the first thumbnail instead. Defaults to False.
+
+    Returns:
+        np.ndarray: shape (n - 1, 3), columns dx, dy (thumbnail pixels, sub-pixel) and the height
+                    of the correlation peak (1 for identical images, near 0 if unrelated)
+    """
+    n, height, width = thumbs.shape
+    window = np.outer(np.hanning(height), np.hanning(width)).astype(np.float32)
+    spectra = np.fft.rfft2((thumbs - thumbs.mean(axis=(1, 2), keepdims=True)) * window)
+    crossPower = spectra[1:] * np.conj(spectra[:1] if reference else spectra[:-1])
+    crossPower /= np.abs(crossPower) + 1e-12
+    correlation = np.fft.irfft2(crossPower, s=(height, width))
+    flat = correlation.reshape(n - 1, -1)
+    peakIdx = flat.argmax(axis=1)
+    peakY, peakX = np.unravel_index(peakIdx, (height, width))
+    rows = np.arange(n - 1)
+
+    def subPixel(before, peak, after):
+        # vertex of the parabola through the peak and its neighbours
+        denominator = before - 2 * peak + after
+        return np.where(np.abs(denominator) > 1e-12, 0.5 * (before - after) / np.where(denominator == 0, 1, denominator), 0)
+
+    peak = flat[rows, peakIdx]
+    dy = peakY + subPixel(correlation[rows, (peakY - 1) % height, peakX], peak,
+                          correlation[rows, (peakY + 1) % height, peakX])
+    dx = peakX + subPixel(correlation[rows, peakY, (peakX - 1) % width], peak,
+                          correlation[rows, peakY, (peakX + 1) % width])
+    # circular shifts over half the size are negative
+    dy = np.where(peakY > height // 2, dy - height, dy)
+    dx = np.where(peakX > width // 2, dx - width, dx)
+    return np.column_stack((dx, dy, peak))
+# phaseCorrelate
+
+
+def measureShifts(filePaths, region, thumbShape, refineFactor=4):
+    """Shifts of the plate between consecutive images, a job of frameShifts(). Every image is
+    registered against the first one, the images moved by a thumbnail pixel or more are registered
+    again from thumbnails refineFactor times larger.
+
+    Returns:
+        list: [[dx, dy, peak], ...] for images 1 to n - 1, in pixels of the images
+    """
+    thumbs = np.stack([readThumbnail(f, region, thumbShape) for f in filePaths])
+    thumbPixel = np.array([(region[2] - region[0]) / thumbShape[0], (region[3] - region[1]) / thumbShape[1]])
+    offsets = phaseCorrelate(thumbs, reference=True)  # from the first image
+    offsets[:, :2] *= thumbPixel
+    fineShape = thumbnailShape(region, refineFactor * max(thumbShape))
+    moved = np.flatnonzero((np.abs(offsets[:, :2]) >= thumbPixel).any(axis=1))
+    if fineShape != thumbShape and len(moved) > 0:
+        finePixel = ((region[2] - region[0]) / fineShape[0], (region[3] - region[1]) / fineShape[1])
+        fineReference = readThumbnail(filePaths[0], region, fineShape)
+        for i in moved:
+            pair = np.stack([fineReference, readThumbnail(filePaths[i + 1], region, fineShape)])
+            offsets[i, :2] = phaseCorrelate(pair)[0, :2] * finePixel
+    # consecutive differences, their sum over the job is the offset of the last image
+    shifts = offsets.copy()
+    shifts[1:, :2] = np.diff(offsets[:, :2], axis=0)
+    return shifts.tolist()
+# measureShifts
+
+
+def frameShifts(path, filePaths, region, thumbSize=256, executor=None, framesPerJob=64):
+    """Shift of every scan from the scan before it, the ones in driftLog.json are not read again
+
+    Args:
+        path (str): root path of the experiment, where driftLog.json is
+        filePaths (list): paths of the scans, in order
+        region (tuple): (x1, y1, x2, y2) to register, output of driftRegion()
+        thumbSize (int, optional): longer side of the thumbnails. Defaults to 256.
+        executor (concurrent.futures.Executor, optional): pool to read the thumbnails in, see runChunked().
+                                                          Defaults to None, in this process.
+        framesPerJob (int, optional): scans transformed together in one job. Defaults to 64.
+
+    Returns:
+        np.ndarray: shape (len(filePaths), 3), dx, dy (pixels) and the peak height, (0, 0, 1) for the first scan
+    """
+    logFile = genDriftLogFile(path)
+    setup = {'region': list(region), 'thumbSize': thumbSize, 'registration': 'chunkReference'}
+    known = {}  # {scan name: [dx, dy, peak]}
+    if os.path.isfile(logFile):
+        with open(logFile, 'r') as f:
+            driftLog = json.load(f)
+        if driftLog.get('setup') == setup:
+            known = driftLog['shifts']
+    names = [os.path.basename(f) for f in filePaths]
+    known[names[0]] = [0., 0., 1.]
+    missing = [i for i, name in enumerate(names) if name not in known]
+    if len(missing) > 0:
+        # consecutive missing scans are transformed together, each job with the scan before its first one
+        jobs = []
+        for i in missing:
+            if len(jobs) > 0 and jobs[-1][-1] == i - 1 and len(jobs[-1]) <= framesPerJob:
+                jobs[-1].append(i)
+            else:
+                jobs.append([i - 1, i])
+        thumbShape = thumbnailShape(region, thumbSize)
+        jobArgs = [(([filePaths[i] for i in job], region, thumbShape), {}) for job in jobs]
+        if executor != None and len(jobs) > 1:
+            from funcs.misc import runChunked
+            results = runChunked(executor, measureShifts, jobArgs)
+        else:
+            results = [measureShifts(*args, **kwargs) for args, kwargs in jobArgs]
+        for job, shifts in zip(jobs, results):
+            known.update(zip([names[i] for i in job[1:]], shifts))
+        with open(f'{logFile}_temp', 'w') as f:
+            json.dump({'setup': setup, 'shifts': known}, f)
+        os.replace(f'{logFile}_temp', logFile)
+    return np.array([known[name] for name in names])
+# frameShifts
+
+
+def driftGroups(shifts, minShift, minPeak=0.05):
+    """Groups of scans with the plate at the same place
+
+    A group starts where the plate has moved by at least minShift pixels (in x or y) from
+    where it was at the start of the current group, so both a sudden move and a slow drift
+    are found. Shifts with a correlation peak lower than minPeak are not trusted and ignored.
+
+    Args:
+        shifts (np.ndarray): output of frameShifts()
+        minShift (float): pixels
+        minPeak (float, optional): Defaults to 0.05.
+
+    Returns:
+        list: [(index of the first scan, (dx, dy) from the first scan, rounded), ...], starting with (0, (0, 0))
+    """
+    trusted = np.where((shifts[:, 2] >= minPeak)[:, None], shifts[:, :2], 0)
+    offsets = np.cumsum(trusted, axis=0)
+    groups = [(0, (0, 0))]
+    groupOffset = offsets[0]
+    for i in range(1, len(offsets)):
+        if np.abs(offsets[i] - groupOffset).max() >= minShift:
+            groupOffset = offsets[i]
+            groups.append((i, (int(round(groupOffset[0])), int(round(groupOffset[1])))))
+    return groups
+# driftGroups
+
+
+if __name__ == '__main__':
+    import argparse
+    from PIL import Image
+    from funcs.parseMetadata import getPositions, getPosToCrop
+    from funcs.scanCatalog import ScanCatalog
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument('path', help='Path to the experiment, renamed before')
+    parser.add_argument('positionTsvPath', help='Position file of the first scans')
+    parser.add_argument('--thumbSize', type=int, default=256, help='Longer side of the thumbnails, default 256')
+    parser.add_argument('--minShift', type=float,
+                        help='Pixels the plate should move to start a group, default 1.5 thumbnail pixels')
+    args = parser.parse_args()
+
+    imgPath = os.path.join(args.path, 'original_images')
+    with ScanCatalog(args.path) as catalog:
+        filePaths = [os.path.join(imgPath, newName) for _, newName in catalog.names()]
+    if len(filePaths) < 2:
+        parser.error(f'Less than 2 scans in the catalog of {args.path}, run extractPicAndMeasure.py first')
+    with Image.open(filePaths[0]) as im:
+        region = driftRegion(getPosToCrop(getPositions(args.positionTsvPath)), im.size)
+    shifts = frameShifts(args.path, filePaths, region, args.thumbSize)
+    minShift = args.minShift or defaultMinShift(region, args.thumbSize)
+    print(f'Region {region}, {len(filePaths)} scans, lowest correlation peak {shifts[1:, 2].min():.3f}')
+    for i, offset in driftGroups(shifts, minShift):
+        print(f'{os.path.basename(filePaths[i])}\tmoved by {offset}')
@@ -0,0 +1,148 @@
+'''
+Decoded frame cache:
+
+Every decoded original image (padding removed if set) is stored as uint8 in one
+memory mapped stack under rootPath/frameCache, so re-cropping and re-measuring
+after changing position files slice the stack instead of decoding the images again.
+
+    frames.u8     np.memmap uint8, shape (capacity, height, width[, 3]), 'rgb' frames of
+                  grey images have one channel
+    filled.u8     np.memmap uint8, shape (capacity, ), 1 when the slot holds a frame
+    index.pickle  frame shape, mode, padding and {fingerprint: slot}
+
+Slots are assigned in the main process, worker processes only write the slot of
+the image they decode. 'gray' stores the grey image used for measurement (smaller,
+measure only), 'rgb' keeps colour so sub-images can be written from it as well.
+'''
+
+
+import os
+import pickle
+
+import numpy as np
+from PIL import Image
+
+from funcs.measureImages import imageToGray
+
+
+def genFrameCacheDir(path):
+    return os.path.join(path, 'frameCache')
+
+
+def openFrameCache(path, filePaths, fingerprints, mode='gray', paddingPos=None):
+    """Prepare the frame cache for filePaths, assign a slot to every image not cached yet
+
+    Args:
+        path (str): root path of the experiment
+        filePaths (list): original images to be cropped
+        fingerprints (dict): {filePath: content hash}, output of fingerprintFiles()
+        mode (str, optional): 'gray' or 'rgb'. Defaults to 'gray'.
+        paddingPos (list, optional): (x1, y1, x2, y2), only this part of the image is cached.
+
+    Returns:
+        cacheInfo, slots: cacheInfo is passed to crop(), slots is {filePath: slot}. Images with a
+                          different size or bit depth than the first image are not cached.
+    """
+    cacheDir = genFrameCacheDir(path)
+    indexFile = os.path.join(cacheDir, 'index.pickle')
+    os.makedirs(cacheDir, exist_ok=True)
+
+    # Frame shape from the header of the first image, no decoding needed
+    with Image.open(filePaths[0]) as im:
+        fullSize = im.size
+        srcMode = im.mode
+    size = fullSize
+    if srcMode not in ['L', 'RGB', 'RGBA', 'P', 'CMYK']:
+        print(f'Frame cache only supports 8 bit images, {srcMode} found, cache is not used.')
+        return None, {}
+    offset = (0, 0)
+    if paddingPos != None:
+        offset = tuple(paddingPos[:2])
+        size = (paddingPos[2] - paddingPos[0], paddingPos[3] - paddingPos[1])
+    # Grey images are kept single channel so they measure as in the image (0 - 255)
+    shape = (size[1], size[0]) if mode == 'gray' or srcMode == 'L' else (size[1], size[0], 3)
+    # Grey values are stored as uint8, a colour source is converted to [0, 1] by imageToGray()
+    grayScale = 1 if srcMode == 'L' else 1 / 255
+    setup = {'shape': shape, 'mode': mode, 'offset': offset, 'grayScale': grayScale}
+
+    index = {'setup': setup, 'capacity': 0, 'slots': {}}
+    if os.path.isfile(indexFile):
+        with open(indexFile, 'rb') as f:
+            oldIndex = pickle.load(f)
+        if oldIndex['setup'] == setup:
+            index = oldIndex
+        else:
+            print('Frame cache setup changed, cache is cleared.')
+
+    slots = {}
+    for filePath in filePaths:
+        fingerprint = fingerprints[filePath]
+        if fingerprint not in index['slots']:
+            with Image.open(filePath) as im:
+                if im.size != fullSize or im.mode != srcMode:
+                    continue
+            index['slots'][fingerprint] = len(index['slots'])
+        slots[filePath] = index['slots'][fingerprint]
+
+    # Grow the files, new slots are filled with zeros
+    framesFile = os.path.join(cacheDir, 'frames.u8')
+    filledFile = os.path.join(cacheDir, 'filled.u8')
+    needed = len(index['slots'])
+    if index['capacity'] == 0:
+        for f in [framesFile, filledFile]:
+            if os.path.isfile(f):
+                os.remove(f)
+    if needed > index['capacity']:
+        capacity = max(needed, int(index['capacity'] * 1.5))
+        for f, frameBytes in [(framesFile, int(np.prod(shape))), (filledFile, 1)]:
+            with open(f, 'ab') as fh:
+                fh.truncate(capacity * frameBytes)
+        index['capacity'] = capacity
+        print(f'Frame cache: {capacity} slots of {shape}, {capacity * np.prod(shape) / 1024**3:.1f} GiB on disk.')
+    with open(f'{indexFile}_temp', 'wb') as f:
+        pickle.dump(index, f)
+    os.replace(f'{indexFile}_temp', indexFile)
+
+    cacheInfo = dict(setup, dir=cacheDir, capacity=index['capacity'])
+    return cacheInfo, slots
+# openFrameCache
+
+
+def openFrames(cacheInfo):
+    """Memory map the frame stack and the filled flags (read and write)"""
+    shape = (cacheInfo['capacity'], ) + tuple(cacheInfo['shape'])
+    frames = np.memmap(os.path.join(cacheInfo['dir'], 'frames.u8'), dtype=np.uint8, mode='r+', shape=shape)
+    filled = np.memmap(os.path.join(cacheInfo['dir'], 'filled.u8'), dtype=np.uint8, mode='r+',
+                       shape=(cacheInfo['capacity'], ))
+    return frames, filled
+# openFrames
+
+
+def getCachedFrame(picPath, cacheInfo, slot):
+    """Frame of picPath from the cache, decode and store it if the slot is empty
+
+    Args:
+        picPath (str): path to the original image
+        cacheInfo (dict): output of openFrameCache()
+        slot (int): slot of this image
+
+    Returns:
+        np.ndarray: view of the memory mapped frame, (height, width) for 'gray' and grey images,
+                    (height, width, 3) for 'rgb'
+    """
+    frames, filled = openFrames(cacheInfo)
+    if not filled[slot]:
+        with Image.open(picPath) as im:
+            x1, y1 = cacheInfo['offset']
+            h, w = cacheInfo['shape'][:2]
+            im = im.crop((x1, y1, x1 + w, y1 + h))
+            if cacheInfo['mode'] == 'gray':
+                gray = imageToGray(im)
+                frames[slot] = np.rint(gray / cacheInfo['grayScale']).clip(0, 255)
+            else:
+                frames[slot] = np.asarray(im.convert('RGB' if len(cacheInfo['shape']) == 3 else 'L'))
+        frames.flush()
+        filled[slot] = 1
+        filled.flush()
+    return frames[slot]
+# getCachedFrame
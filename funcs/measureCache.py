@@ -0,0 +1,114 @@
+'''
+Raw measurements are cached per (image content, position geometry):
+
+The key of one measured value is the content hash of the image that was measured
+plus everything that changes the raw value (crop box, measure type, percentage,
+polygon). Time rebasing, zeroing and normalisation are applied afterwards by
+processMeasurements(), so changing those options never invalidates the cache, and
+changing the geometry of one position only re-measures that position.
+
+Content hashes are remembered together with the file size, modification time and inode,
+files are only hashed again when one of them changes. Metadata changes (hard links, chmod)
+keep the hashes. Sub-images rewritten in place get the time of their scan back, so the
+hashes of re-extracted folders are forgotten with forgetFingerprints().
+'''
+
+
+import os
+import pickle
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+def genCacheFile(path):
+    return os.path.join(path, 'measureCache.pickle')
+
+
+def loadMeasureCache(path):
+    """Load the measurement cache in path, an empty cache is returned if not found
+
+    Args:
+        path (str): root path of the experiment
+
+    Returns:
+        cache: {'fingerprints': {filePath: (size, mtime_ns, inode, sha1)}, 'values': {key: value}}
+    """
+    cacheFile = genCacheFile(path)
+    cache = {'fingerprints': {}, 'values': {}}
+    if os.path.isfile(cacheFile):
+        try:
+            with open(cacheFile, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            print(f'Measurement cache {cacheFile} not readable, start a new one. ({e})')
+    return cache
+# loadMeasureCache
+
+
+def saveMeasureCache(path, cache):
+    cacheFile = genCacheFile(path)
+    with open(f'{cacheFile}_temp', 'wb') as f:
+        pickle.dump(cache, f)
+    os.replace(f'{cacheFile}_temp', cacheFile)
+# saveMeasureCache
+
+
+def fileFingerprint(filePath, cache=None):
+    """sha1 of the file content, reuse the one in cache if size, mtime and inode are not changed
+
+    Args:
+        filePath (str): path to file
+        cache (dict, optional): output of loadMeasureCache(), updated in place. Defaults to None.
+
+    Returns:
+        str: hex digest
+    """
+    st = os.stat(filePath)
+    if cache != None:
+        memo = cache['fingerprints'].get(filePath)
+        if memo != None and memo[:-1] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return memo[-1]
+    sha1 = hashlib.sha1()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    fingerprint = sha1.hexdigest()
+    if cache != None:
+        cache['fingerprints'][filePath] = (st.st_size, st.st_mtime_ns, st.st_ino, fingerprint)
+    return fingerprint
+# fileFingerprint
+
+
+def forgetFingerprints(cache, folder):
+    """Drop the remembered hashes of the files in folder, eg. before its images are extracted again"""
+    folder = os.path.join(folder, '')
+    cache['fingerprints'] = {f: memo for f, memo in cache['fingerprints'].items() if not f.startswith(folder)}
+# forgetFingerprints
+
+
+def fingerprintFiles(filePaths, cache=None, workers=None):
+    """fileFingerprint() of many files, hashed in parallel threads
+
+    Returns:
+        dict: {filePath: sha1}
+    """
+    with ThreadPoolExecutor(max_workers=workers) as threadPool:
+        fingerprints = threadPool.map(lambda f: fileFingerprint(f, cache), filePaths)
+        return dict(zip(filePaths, fingerprints))
+# fingerprintFiles
+
+
+def measureKey(fingerprint, *geometry):
+    """Cache key of one measured value
+
+    Args:
+        fingerprint (str): content hash of the measured image
+        geometry: everything affecting the raw value, made of python numbers, strings,
+                  None and tuples/lists of them (crop box, measureType, percentage, polygon)
+
+    Returns:
+        str: hex digest
+    """
+    geometry = tuple(tuple(g) if isinstance(g, list) else g for g in geometry)
+    return hashlib.sha1(repr((fingerprint, ) + geometry).encode()).hexdigest()
+# measureKey
@@ -1,11 +1,238 @@
 import numpy as np
+import pandas as pd
 import os
 import re
+from functools import lru_cache
 
 from skimage import draw
 from skimage.io import imread
 
-from funcs import determineExtension
+from funcs import determineExtension, perfStats
+from funcs.changeName import naturalKey
+from funcs.misc import runChunked
+from funcs.measureCache import fingerprintFiles, measureKey
+from funcs.roiStats import roiStatistics, statPixels, statKey, statNames
+
+measureTypes = [
+    'centreDisk',  # Measure a circle with diameter is a percentage (percentage) of the image width
+    'square',     # Measure a square with the width is a percentage of the image width
+    'polygon'     # Measure a polygon. percentage will be ignored
+                  # TODO Extract polygon picture (max bonding box)
+]
+# Bytes per pixel of a sub-image held by measureImgFiles(): the float grey image and its copy in the stack
+batchBytesPerPixel = 16
+
+
+def imageToGray(im):
+    """Convert an opened PIL image to the same grey array as skimage.io.imread(as_gray=True)
+
+    Colour images are converted to float in range [0, 1] using the luminance weights of
+    skimage.color.rgb2gray, single channel images are returned with their original values.
+
+    Args:
+        im (PIL.Image.Image): opened image
+
+    Returns:
+        np.ndarray: 2D array
+    """
+    if im.mode in ['L', 'I', 'I;16', 'F']:
+        return np.asarray(im)
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    rgb = np.asarray(im, dtype=np.float64) / 255
+    return rgb @ np.array([0.2125, 0.7154, 0.0721])
+# imageToGray
+
+
+@lru_cache(maxsize=128)
+def getRoiMask(shape, measureType='centreDisk', percentage=1.0, polygon=None):
+    """Boolean mask of the region of interest, the same for every frame of a position
+
+    Masks are cached on (shape, measureType, percentage, polygon), polygon should be a tuple.
+    The returned array is read only.
+
+    Args:
+        shape (tuple): shape of the (sub)image, only the first two dimensions are used
+        measureType (str, optional): one of measureTypes. Defaults to 'centreDisk'.
+        percentage (float, optional): Affects type 'centreDisk' and 'square'. Defaults to 1.
+        polygon (tuple, optional): Affects type 'polygon'. (x1, y1, x2, y2, x3, y3 ...)
+
+    Returns:
+        np.ndarray: bool array of shape[:2]
+    """
+    shape = tuple(shape[:2])
+    mask = np.zeros(shape, dtype=bool)
+    if measureType == 'centreDisk':
+        center = (tuple(a / 2 for a in shape))
+        radius = shape[0] / 2 * percentage
+        rr, cc = draw.disk(center, radius, shape=shape)
+    elif measureType == 'square':
+        start = shape[0] / 2 * (1 - percentage)
+        width = shape[0] * percentage
+        rr, cc = draw.rectangle((start, start), extent=(width, width), shape=shape)
+    else:  # measureType == 'polygon'
+        # rebase the polygon to the bonding box
+        # polygon measured from imageJ MACRO
+        polygon = np.array(polygon)
+        polygon[::2] -= polygon[::2].min()
+        polygon[1::2] -= polygon[1::2].min()
+        rr, cc = draw.polygon(polygon[1::2], polygon[::2], shape=shape)
+    mask[rr, cc] = True
+    mask.setflags(write=False)
+    return mask
+# getRoiMask
+
+
+def measureStack(stack, mask):
+    """Average of the masked region of every frame in a stack, in one call
+
+    Args:
+        stack (np.ndarray): shape (T, H, W), frames of the same position
+        mask (np.ndarray): bool array of shape (H, W), output of getRoiMask()
+
+    Returns:
+        np.ndarray: shape (T,)
+    """
+    weights = mask.ravel().astype(np.float64)
+    return stack.reshape(len(stack), -1) @ weights / weights.sum()
+# measureStack
+
+
+def measureRoi(im, measureType='centreDisk', percentage=1.0, polygon=None):
+    """Average value of the region of interest of one (sub)image
+
+    Args:
+        im (np.ndarray): 2D grey image
+        measureType (str, optional): one of measureTypes. Defaults to 'centreDisk'.
+        percentage (float, optional): Affects type 'centreDisk' and 'square'. Defaults to 1.
+        polygon (tuple, optional): Affects type 'polygon'. (x1, y1, x2, y2, x3, y3 ...)
+
+    Returns:
+        float: measured value
+    """
+    if polygon is not None:
+        polygon = tuple(int(p) for p in polygon)
+    mask = getRoiMask(im.shape, measureType, percentage, polygon)
+    return measureStack(im[np.newaxis], mask)[0]
+# measureRoi
+
+
+def getImageTimes(fileNames, dictOldScanTime=None, forceUseFileNumber=False, fileNumberTimeInterval=1):
+    """Timing (hours) of the original images
+
+    Same rule as measureImgs(): if the first interval is less than 3 seconds, the times
+    stored in the log are not reliable and the numbering in the file names is used.
+
+    Args:
+        fileNames (list): new names of the original images (keys of dictOldScanTime), sorted
+        dictOldScanTime (dict, optional): {'new name': timestamp}
+        forceUseFileNumber (bool, optional): Ignore the stored times. Defaults to False.
+        fileNumberTimeInterval (float, optional): Hours between images. Defaults to 1.
+
+    Returns:
+        np.ndarray: times in hours, same order as fileNames
+    """
+    useFileTime = not (forceUseFileNumber or dictOldScanTime == None)
+    if useFileTime and len(fileNames) > 1:
+        firstInterval = dictOldScanTime[fileNames[1]] - dictOldScanTime[fileNames[0]]
+        if firstInterval < 3:
+            useFileTime = False
+    if useFileTime:
+        return np.array([dictOldScanTime[f] for f in fileNames]) / 3600  # convert to hours
+    fileBaseNames = [os.path.splitext(f)[0] for f in fileNames]
+    return np.array([int(re.findall(r'[0-9]+', f)[-1]) * fileNumberTimeInterval
+                     for f in fileBaseNames], dtype=float)
+# getImageTimes
+
+
+def measureDeviation(measured, reference):
+    """Deviation of measurements (eg. from reduced resolution images) from reference values
+
+    Args:
+        measured (dict): {file: {posName: value}}
+        reference (dict): {file: {posName: value}}, same files and positions
+
+    Returns:
+        pd.DataFrame: per position, mean and max absolute deviation, and the max relative to the
+                      value range of the reference
+    """
+    files = list(reference.keys())
+    deviation = pd.DataFrame(columns=['mean_abs_dev', 'max_abs_dev', 'max_dev_of_range'], dtype=float)
+    for posName in reference[files[0]]:
+        ref = np.array([reference[f][posName] for f in files])
+        diff = np.abs(np.array([measured[f][posName] for f in files]) - ref)
+        valueRange = ref.max() - ref.min()
+        deviation.loc[posName] = (diff.mean(), diff.max(), diff.max() / valueRange if valueRange > 0 else np.nan)
+    return deviation
+# measureDeviation
+
+
+def processMeasurements(measuredData, startImageTiming=0., zeroing=True, normType='Combined'):
+    """Rebase time, zero and normalise raw measurements
+
+    Args:
+        measuredData (dict): {posName: np.ndarray shape [len, 2]}, output of measureImgs()
+        startImageTiming (float, optional): Time of the first image, hours. Defaults to 0.
+        zeroing (bool, optional): Subtract the average of the first 3 images. Defaults to True.
+        normType (str, optional): 'None', 'Each' or 'Combined'. Defaults to 'Combined'.
+
+    Returns:
+        pd.DataFrame: index is time (hours), one column for each position
+    """
+    allPicsData = pd.DataFrame()
+    for posName, data in measuredData.items():
+        data = data.copy()
+        # rebase time to the first picture (if 3 (hours), then the data will start with 3)
+        # Now the data should be actual hours (after the experimental time zero)
+        data[:, 0] -= (data[:, 0].min() - startImageTiming)
+        # sort on time
+        timeSort = np.argsort(data[:, 0])
+        data = data[timeSort, :]
+        # Normalization
+        values = data[:, 1]
+        if zeroing:
+            # use first 3 hours data as zero point
+            zeroPoint = data[:3, 1].mean()
+            values = data[:, 1] - zeroPoint
+        if normType == 'Each':
+            data[:, 1] = values/values.max()
+        else:
+            data[:, 1] = values
+
+        # Put into data frame
+        toDf = pd.DataFrame(data[:, 1], index=data[:, 0], columns=[posName])
+        allPicsData = pd.concat((allPicsData, toDf), axis=1)
+
+    if normType == 'Combined':
+        min = allPicsData.iloc[:3].values.mean()  # will convert to nparray and calculate mean of everything
+        values = allPicsData.values - min
+        newData = values/values.max()
+        # put data back
+        allPicsData = pd.DataFrame(newData, index=allPicsData.index, columns=allPicsData.columns)
+    return allPicsData
+# processMeasurements
+
+
+def processStatistics(measuredData, measuredStats, statNames, startImageTiming=0.):
+    """Statistics of every position with the time rebased as processMeasurements(), not zeroed or normalised
+
+    Args:
+        measuredData (dict): {posName: np.ndarray shape [len, 2]}, times of the rows of measuredStats
+        measuredStats (dict): {posName: np.ndarray shape [len, len(statNames)]}, see splitStatistics()
+        statNames (list): output of roiStats.statNames()
+        startImageTiming (float, optional): Time of the first image, hours. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: index is time (hours), columns "posName.statistic"
+    """
+    tables = []
+    for posName, data in measuredData.items():
+        times = data[:, 0] - (data[:, 0].min() - startImageTiming)
+        timeSort = np.argsort(times)
+        tables.append(pd.DataFrame(measuredStats[posName][timeSort], index=times[timeSort],
+                                   columns=[f'{posName}.{name}' for name in statNames]))
+    return pd.concat(tables, axis=1)
+# processStatistics
 
 
 def measureImgs(
@@ -15,7 +242,11 @@ def measureImgs(
     polygons=[(0, 0, 1, 0, 0, 1), ],
     percentage=1.0,
     forceUseFileNumber=False,
-    fileNumberTimeInterval=1
+    fileNumberTimeInterval=1,
+    batchSize=64,
+    cache=None,
+    scanNames=None,
+    statSpec=None
 ) -> tuple[str, np.ndarray]:
     """
     Measure all images in path\n
@@ -46,13 +277,57 @@ def measureImgs(
                                   Defaults to True.\n
         time0 (int, optional): Time of the first image, in hours. Defaults to 0.\n
         forceUseFileNumber (bool, optional): If True, the file creation time will be ignored. Defaults to False.\n
+        batchSize (int, optional): Number of images read and measured together. Defaults to 64.\n
+        cache (dict, optional): Output of loadMeasureCache(). Images with cached values are not read,\n
+                                new values are added to it. Defaults to None.\n
+        scanNames (list, optional): Only measure the sub-images of these scans (new names). Defaults to None, all.\n
+        statSpec (tuple, optional): Output of roiStats.statSpec(), more statistics measured from the same\n
+                                    decoded images. Defaults to None, only the greyness.\n
 
     Returns:\n
         np.array: shape = [len, 2], timings stored in the first column (hours), measured values stored in the second column.\n
+                  With statSpec, the statistics follow in the next columns, see splitStatistics().\n
+    """
+    filePaths, polygons, data, keys, toMeasure = prepareMeasurement(
+        path, dictOldScanTime, measureType, polygons, percentage,
+        forceUseFileNumber, fileNumberTimeInterval, cache, scanNames, statSpec)
+    data[toMeasure, 1:] = measureImgFiles([filePaths[i] for i in toMeasure], measureType, [polygons[i] for i in toMeasure],
+                                          percentage, batchSize, statSpec).reshape(len(toMeasure), -1)
+    if cache != None:
+        for i in toMeasure:
+            cache['values'][keys[i]] = data[i, 1] if statSpec == None else data[i, 1:].copy()
+
+    return path, data  # path is needed as the sequence of multiprocessing is not preserved
+
+
+def prepareMeasurement(
+    path,
+    dictOldScanTime=None,
+    measureType='centreDisk',
+    polygons=[(0, 0, 1, 0, 0, 1), ],
+    percentage=1.0,
+    forceUseFileNumber=False,
+    fileNumberTimeInterval=1,
+    cache=None,
+    scanNames=None,
+    statSpec=None,
+    workers=None
+):
+    """Everything before reading the images of one subImages folder: file list, timing, polygon of
+    each image and values found in the cache. Arguments are the same as measureImgs(), workers is the
+    number of threads hashing the images for the cache (default of fingerprintFiles()).
+
+    Returns:
+        filePaths, polygons, data, keys, toMeasure:
+            filePaths - sorted sub-image paths
+            polygons - one polygon (tuple) per image, None if measureType is not 'polygon'
+            data - np.ndarray [len, 2 + number of statistics], times filled, values filled if cached
+            keys - cache key of each image, None if no cache
+            toMeasure - indexes of the images still to measure
     """
     extension = determineExtension(path)
     filePaths = sorted([os.path.join(path, file)
-                        for file in os.listdir(path) if file.endswith(extension)])
+                        for file in os.listdir(path) if file.endswith(extension)], key=naturalKey)
 
     def getOriName(f):
         # pass in file names from subImages folder
@@ -62,27 +337,32 @@ def measureImgs(
         o = o.split('_cropped')[0]  # when use cropped is true
         return o
 
+    # sub-images of .png/.tif scans are .bmp, scan times are looked up without the extension
+    baseScanTime = {} if dictOldScanTime == None else {os.path.splitext(n)[0]: t for n, t in dictOldScanTime.items()}
+
     def getTime(f):
-        return dictOldScanTime[f'{getOriName(f)}{extension}']
-
-    measureTypes = [
-        'centreDisk',  # Measure a circle with diameter is a percentage (percentage) of the image width
-        'square',     # Measure a square with the width is a percentage of the image width
-        'polygon'     # Measure a polygon. percentage will be ignored
-                      # TODO Extract polygon picture (max bonding box)
-    ]
+        return baseScanTime[getOriName(f)]
+
     assert measureType in measureTypes, f'{measureType} not accepted. ({", ".join(measureTypes)})'
     assert 0 < percentage <= 1.0, 'percentage should be in range (0, 1]'
+    if measureType == 'polygon' and isinstance(polygons, dict):  # {scan name without extension: polygon}
+        polygons = [polygons[getOriName(f)] for f in filePaths]
+    if scanNames != None:  # only the sub-images of these scans
+        scanBaseNames = {os.path.splitext(n)[0] for n in scanNames}
+        keep = [i for i, f in enumerate(filePaths) if getOriName(f) in scanBaseNames]
+        filePaths = [filePaths[i] for i in keep]
+        if measureType == 'polygon':
+            polygons = [polygons[min(i, len(polygons) - 1)] for i in keep]
     if measureType == 'polygon':
         for polygon in polygons:
             assert len(polygon) >= 6 and len(
                 polygon) % 2 == 0, f'polygon setup error (x1, y1, x2, y2, x3, y3 ...). At least 6, even number\n{polygon}'
-        if len(polygons) == 1:  # expend
-            polygons = polygons * len(filePaths)
-        elif len(polygons) < len(filePaths):  # fill in with the last polygon tuple
-            n = len(filePaths) - len(polygons)
-            polygons += polygons[-1] * n
-        assert len(polygons) == len(filePaths)
+        polygons = [tuple(int(p) for p in polygon) for polygon in polygons]
+        if len(polygons) < len(filePaths):  # fill in with the last polygon tuple
+            polygons += [polygons[-1]] * (len(filePaths) - len(polygons))
+        polygons = polygons[:len(filePaths)]
+    else:
+        polygons = [None] * len(filePaths)
 
     # Determine if use file time or use 1 h as interval
     useFileTime = True
@@ -94,8 +374,8 @@ def measureImgs(
         if firstInterval < 3:
             useFileTime = False
 
-    # Measurement: produce an array of times and an array of measured values
-    data = np.zeros((len(filePaths), 2))
+    # Produce an array of times, values will be filled by measurement
+    data = np.zeros((len(filePaths), 2 + len(statNames(statSpec))))
     for i, filePath in enumerate(filePaths):
         if useFileTime:
             time = getTime(filePath)/3600  # convert to hours
@@ -104,26 +384,142 @@ def measureImgs(
             fileBaseName = '_'.join(file.split('_')[:-1])
             n = int(re.findall(r'[0-9]+', fileBaseName)[-1])
             time = n * fileNumberTimeInterval
-        im = imread(filePath, as_gray=True)
-        if measureType == 'centreDisk':
-            center = (tuple(a / 2 for a in im.shape))
-            radius = im.shape[0] / 2 * percentage
-            rr, cc = draw.disk(center, radius)
-            roi = im[rr, cc]
-        elif measureType == 'square':
-            start = im.shape[0] / 2 * (1 - percentage)
-            width = im.shape[0] * percentage
-            rr, cc = draw.rectangle((start, start), extent=(width, width))
-            roi = im[rr, cc]
-        else:  # measureType == 'polygon'
-            # rebase the polygon to the bonding box
-            # polygon measured from imageJ MACRO
-            polygon = np.array(polygons[i])
-            polygon[::2] -= polygon[::2].min()
-            polygon[1::2] -= polygon[1::2].min()
-            rr, cc = draw.polygon(polygon[1::2], polygon[::2])
-            roi = im[rr, cc]
-        res = np.average(roi)
-        data[i] = (time, res)
+        data[i, 0] = time
 
-    return path, data  # path is needed as the sequence of multiprocessing is not preserved
+    # Values found in the cache are not measured again
+    keys = [None] * len(filePaths)
+    toMeasure = list(range(len(filePaths)))
+    if cache != None:
+        toMeasure = []
+        fingerprints = fingerprintFiles(filePaths, cache, workers)
+        for i, filePath in enumerate(filePaths):
+            keys[i] = measureKey(fingerprints[filePath], 'subImage', measureType, percentage, polygons[i],
+                                 *statKey(statSpec))
+            if keys[i] in cache['values']:
+                data[i, 1:] = cache['values'][keys[i]]
+            else:
+                toMeasure.append(i)
+    return filePaths, polygons, data, keys, toMeasure
+# prepareMeasurement
+
+
+def measureImgFiles(filePaths, measureType='centreDisk', polygons=None, percentage=1.0, batchSize=64, statSpec=None):
+    """Measure a list of sub-images, can run in a worker process
+
+    Args:
+        filePaths (list): paths of sub-images
+        measureType (str, optional): one of measureTypes. Defaults to 'centreDisk'.
+        polygons (list, optional): one polygon per image, for measureType 'polygon'. Defaults to None.
+        percentage (float, optional): Affects type 'centreDisk' and 'square'. Defaults to 1.
+        batchSize (int, optional): Number of images read and measured together. Defaults to 64.
+        statSpec (tuple, optional): Output of roiStats.statSpec(), the statistics are computed from
+                                    the same decoded images. Defaults to None.
+
+    Returns:
+        np.ndarray: measured values, same order as filePaths. With statSpec, shape (len(filePaths),
+                    1 + number of statistics), the greyness in the first column.
+    """
+    if polygons == None:
+        polygons = [None] * len(filePaths)
+    values = np.zeros((len(filePaths), 1 + len(statNames(statSpec))))
+    # Frames are read in batches, frames sharing the same mask are reduced together
+    for start in range(0, len(filePaths), batchSize):
+        batchStart = perfStats.clock()
+        idxs = range(start, min(start + batchSize, len(filePaths)))
+        pixels = {}  # {index: (pixels, mode)} for the statistics
+        with perfStats.timer('measure.decode'):
+            if statSpec == None:
+                ims = {i: imread(filePaths[i], as_gray=True) for i in idxs}
+            else:
+                from PIL import Image
+                ims = {}
+                for i in idxs:
+                    with Image.open(filePaths[i]) as im:
+                        ims[i] = imageToGray(im)
+                        pixels[i] = statPixels(im)
+        groups = {}  # {(shape, polygon, mode): [index, ...]}
+        for i in idxs:
+            groups.setdefault((ims[i].shape, polygons[i], pixels[i][1] if statSpec != None else None), []).append(i)
+        for (shape, polygon, mode), groupIdxs in groups.items():
+            mask = getRoiMask(shape, measureType, percentage, polygon)
+            stack = np.stack([ims[i] for i in groupIdxs])
+            with perfStats.timer('measure.reduce'):
+                values[groupIdxs, 0] = measureStack(stack, mask)
+            if statSpec != None:
+                with perfStats.timer('measure.statistics'):
+                    values[groupIdxs, 1:] = roiStatistics(np.stack([pixels[i][0][mask] for i in groupIdxs]), mode, statSpec)
+        perfStats.count('measure.frames', len(idxs))
+        perfStats.addSample('measure.frame', (perfStats.clock() - batchStart) / len(idxs), len(idxs))
+    return values[:, 0] if statSpec == None else values
+# measureImgFiles
+
+
+def measureFolders(
+    executor,
+    folderJobs,
+    dictOldScanTime=None,
+    percentage=1.0,
+    forceUseFileNumber=False,
+    fileNumberTimeInterval=1,
+    cache=None,
+    framesPerJob=256,
+    chunkSize=1,
+    scanNames=None,
+    batchSize=64,
+    statSpec=None,
+    workers=None
+):
+    """Measure many subImages folders in parallel, split both by position and by chunks of frames
+
+    Args:
+        executor (concurrent.futures.Executor): process pool shared by the run
+        folderJobs (dict): {posName: (path, measureType, polygons)}, polygons can be a list (one per
+                           image, the last one fills up) or {scan name without extension: polygon}
+        framesPerJob (int, optional): Number of images measured in one job. Defaults to 256.
+        chunkSize (int, optional): Number of jobs sent to a worker together. Defaults to 1.
+        batchSize (int, optional): Number of images a job reads and measures together, see
+                                   batchBytesPerPixel for the memory. Defaults to 64.
+        workers (int, optional): Number of threads hashing the images for the cache. Defaults to None.
+        Other arguments are the same as measureImgs().
+
+    Returns:
+        measuredData: {posName: np.ndarray [len, 2]}, rows in the order of the file names.
+                      With statSpec, (measuredData, measuredStats), see splitStatistics().
+    """
+    measuredData = {}
+    jobs = []  # [(args, kwargs), ...]
+    jobTargets = []  # [(posName, keys, indexes), ...] same order as jobs
+    for posName, (path, measureType, polygons) in folderJobs.items():
+        filePaths, polygons, data, keys, toMeasure = prepareMeasurement(
+            path, dictOldScanTime, measureType, polygons, percentage,
+            forceUseFileNumber, fileNumberTimeInterval, cache, scanNames, statSpec, workers)
+        measuredData[posName] = data
+        for start in range(0, len(toMeasure), framesPerJob):
+            idxs = toMeasure[start:start + framesPerJob]
+            jobs.append((([filePaths[i] for i in idxs], measureType, [polygons[i] for i in idxs], percentage),
+                         dict(batchSize=batchSize, statSpec=statSpec)))
+            jobTargets.append((posName, keys, idxs))
+        print(f'{posName}: {len(toMeasure)}/{len(filePaths)} images to measure.')
+    results = runChunked(executor, measureImgFiles, jobs, chunkSize)
+    # Results come back in job order, put them back in place
+    for (posName, keys, idxs), values in zip(jobTargets, results):
+        measuredData[posName][idxs, 1:] = values.reshape(len(idxs), -1)
+        if cache != None:
+            for i, value in zip(idxs, values):
+                cache['values'][keys[i]] = value
+    if statSpec != None:
+        return splitStatistics(measuredData)
+    return measuredData
+# measureFolders
+
+
+def splitStatistics(measuredData):
+    """Rows of (time, value, statistics...) to measuredData and measuredStats
+
+    Returns:
+        measuredData, measuredStats: {posName: np.ndarray [len, 2]} and {posName: np.ndarray [len, number of
+                                     statistics]}, same rows
+    """
+    return ({posName: data[:, :2] for posName, data in measuredData.items()},
+            {posName: data[:, 2:] for posName, data in measuredData.items()})
+# splitStatistics
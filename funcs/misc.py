@@ -1,5 +1,14 @@
 import os
+import re
+import queue
 import shutil
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, wait
+
+from funcs import perfStats
 
 def createFolders(targetPath, folders, reset=False):
     targetPaths = {}
@@ -18,3 +27,174 @@ def createFolders(targetPath, folders, reset=False):
         targetPaths[folder] = newPath
     return targetPaths
 # createFolders
+
+
+def ignoreInterrupt():
+    """Process pool initializer, Ctrl-C is handled by the main process only"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+# ignoreInterrupt
+
+
+def runChunk(func, jobs, collectStats=False):
+    """Run func(*args, **kwargs) for every (args, kwargs) in jobs, in one worker
+
+    With collectStats, return (results, perfStats.collect()) of this chunk.
+    """
+    if collectStats:
+        perfStats.enable()
+    results = [func(*args, **kwargs) for args, kwargs in jobs]
+    if collectStats:
+        return results, perfStats.collect()
+    return results
+# runChunk
+
+
+def runChunked(executor, func, jobs, chunkSize=1):
+    """Submit all jobs to an executor in chunks, return results in the order of jobs
+
+    All chunks are submitted at once, the first failure is reported as soon as it
+    happens and the chunks not yet started are cancelled. When perfStats is enabled,
+    the statistics of the workers are merged into this process.
+
+    Args:
+        executor (concurrent.futures.Executor): thread or process pool, shared by the whole run
+        func (callable): function to run, must be picklable for process pools
+        jobs (list): [(args, kwargs), ...]
+        chunkSize (int, optional): Number of jobs sent to a worker together. Defaults to 1.
+
+    Returns:
+        list: results of func, same order as jobs
+    """
+    chunkSize = max(1, int(chunkSize))
+    chunks = [jobs[i:i + chunkSize] for i in range(0, len(jobs), chunkSize)]
+    collectStats = perfStats.isEnabled()
+    futures = [executor.submit(runChunk, func, chunk, collectStats) for chunk in chunks]
+    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+    for n, future in enumerate(futures):
+        if future in done and future.exception() != None:
+            exception = future.exception()
+            print(f'There is exception in job chunk {n} (jobs {n * chunkSize}-{n * chunkSize + len(chunks[n]) - 1}):')
+            traceback.print_exception(type(exception), exception, exception.__traceback__)
+            for f in futures:
+                f.cancel()
+            raise exception
+    results = []
+    for future in futures:
+        if collectStats:
+            chunkResults, stats = future.result()
+            perfStats.merge(stats)
+            results.extend(chunkResults)
+        else:
+            results.extend(future.result())
+    return results
+# runChunked
+
+
+def parseMemorySize(value):
+    """'8G', '512M', '1.5GiB', '2000000' (bytes) to bytes"""
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?)(i?B)?\s*', str(value), re.IGNORECASE)
+    if match == None:
+        raise ValueError(f'Memory size {value} not understood, eg. 8G or 512M')
+    number, unit = float(match.group(1)), match.group(2).upper()
+    return int(number * 1024 ** ' KMGT'.index(unit or ' '))
+# parseMemorySize
+
+
+def framesInBudget(memoryBudget, frameBytes, parallel=1, maximum=None):
+    """Number of frames of frameBytes each one of parallel jobs can hold, so that all of them stay
+    within memoryBudget. At least 1, at most maximum."""
+    frames = max(1, int(memoryBudget // (max(1, frameBytes) * max(1, parallel))))
+    return frames if maximum == None else min(frames, maximum)
+# framesInBudget
+
+
+def prefetchFiles(filePaths, readyQueue, stop, readStats, blockSize=1 << 20):
+    """Reader thread of runBounded(): read every file once, so its job finds it in the page cache of
+    the system, then put it in readyQueue. Blocks while the queue is full. The time and bytes read are
+    added to readStats (perfStats.newStats()), merged by the main thread when done."""
+    buffer = bytearray(blockSize)
+    timer = readStats['timers'].setdefault('read.prefetch', [0., 0])
+    for filePath in filePaths:
+        start = time.perf_counter()
+        try:
+            with open(filePath, 'rb', buffering=0) as f:
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    readStats['counters']['read.bytesPrefetched'] = readStats['counters'].get('read.bytesPrefetched', 0) + n
+        except OSError:
+            pass  # the job reports it
+        timer[0] += time.perf_counter() - start
+        timer[1] += 1
+        while not stop.is_set():
+            try:
+                readyQueue.put(filePath, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if stop.is_set():
+            return
+# prefetchFiles
+
+
+def runBounded(executor, func, jobs, chunkSize=1, maxChunks=None, prefetchPaths=None):
+    """Same as runChunked(), streamed: at most maxChunks chunks are submitted and not finished at a time,
+    a worker runs the jobs of a chunk one by one, so at most maxChunks jobs hold their images together.
+    The next chunk is submitted when one finishes.
+
+    With prefetchPaths (one file per job), a reader thread reads the file of every job before the job is
+    submitted, at most maxChunks chunks ahead, so disk reads overlap the work of the pool.
+
+    Args:
+        maxChunks (int, optional): Defaults to None, twice the number of workers of the executor (or 8).
+        prefetchPaths (list, optional): file read by each job. Defaults to None, no reading ahead.
+        Other arguments are the same as runChunked().
+
+    Returns:
+        list: results of func, same order as jobs
+    """
+    chunkSize = max(1, int(chunkSize))
+    if maxChunks == None:
+        maxChunks = 2 * getattr(executor, '_max_workers', 4)
+    maxChunks = max(1, int(maxChunks))
+    chunks = [jobs[i:i + chunkSize] for i in range(0, len(jobs), chunkSize)]
+    collectStats = perfStats.isEnabled()
+    readyQueue, stop, readStats, reader = (None, threading.Event(), perfStats.newStats(), None)
+    if prefetchPaths != None:
+        readyQueue = queue.Queue(maxsize=maxChunks * chunkSize)
+        reader = threading.Thread(target=prefetchFiles, args=(prefetchPaths, readyQueue, stop, readStats), daemon=True)
+        reader.start()
+    chunkResults = [None] * len(chunks)
+    pending = {}  # {future: chunk index}
+    nextChunk = 0
+    try:
+        while nextChunk < len(chunks) or len(pending) > 0:
+            while nextChunk < len(chunks) and len(pending) < maxChunks:
+                if readyQueue != None:
+                    for _ in chunks[nextChunk]:
+                        readyQueue.get()
+                pending[executor.submit(runChunk, func, chunks[nextChunk], collectStats)] = nextChunk
+                nextChunk += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                n = pending.pop(future)
+                if future.exception() != None:
+                    exception = future.exception()
+                    print(f'There is exception in job chunk {n} (jobs {n * chunkSize}-{n * chunkSize + len(chunks[n]) - 1}):')
+                    traceback.print_exception(type(exception), exception, exception.__traceback__)
+                    for f in pending:
+                        f.cancel()
+                    raise exception
+                if collectStats:
+                    chunkResults[n], stats = future.result()
+                    perfStats.merge(stats)
+                else:
+                    chunkResults[n] = future.result()
+    finally:
+        stop.set()
+        if reader != None:
+            reader.join()
+            perfStats.merge(readStats)
+    return [result for results in chunkResults for result in results]
+# runBounded
@@ -114,14 +114,13 @@ def getPositions(positionTsvPath):
                 raise ValueError(f'Error, no type string found, check file.\nAcceptable: {", ".join(positionTypes)}')
             posName = elements[0]
             if locType == 'Polygon': # imageJ marco: makePolygon(852,588,660,1184,1288,1216);
-                polygon = (int(i) for i in elements[1][12:-2].split(','))
-                polygon = np.array(polygon)
+                polygon = np.array([int(i) for i in elements[1][12:-2].split(',')])
                 xmax = polygon[::2].max()
                 xmin = polygon[::2].min()
                 ymax = polygon[1::2].max()
                 ymin = polygon[1::2].min()
-                posDict['Polygon_square'][posName] = (xmin, ymin, xmax, ymax)
-                posDict['Polygon_poly'][posName] = polygon
+                posDict.setdefault('Polygon_square', {})[posName] = (xmin, ymin, xmax, ymax)
+                posDict.setdefault('Polygon_poly', {})[posName] = polygon
             else:
                 position = [int(elem) for elem in elements[1:]]
                 if locType == 'CornerSize':
@@ -137,11 +136,51 @@ def getPositions(positionTsvPath):
                 posDict[locType][posName] = position
     # Put None for removePadding if not found in the file
     if 'removePadding' not in posDict:
-        posDict['removePadding']['paddingPos'] = None
+        posDict['removePadding'] = {'paddingPos': None}
     return posDict
 # getPositions
 
 
+def shiftPositionFile(positionTsvPath, outPath, shift):
+    """Copy of a position file with every position moved by shift, eg. for the scans after the plate moved.
+    removePadding, comments and the sample information are copied as they are.
+
+    Args:
+        positionTsvPath (str): position file, see getPositions()
+        outPath (str): the moved position file
+        shift (tuple): (dx, dy) in pixels
+    """
+    dx, dy = shift
+    positionTypes = ['CornerSize', 'WidthHeight', 'CentreSize', 'TwoPositions', 'Polygon', 'removePadding']
+    shiftedValues = {'CornerSize': 2, 'WidthHeight': 2, 'CentreSize': 2, 'TwoPositions': 4}  # x, y, (x2, y2)
+    lines = []
+    locType = ''
+    ended = False
+    with open(positionTsvPath, 'r') as posFile:
+        for line in posFile.readlines():
+            elements = line.rstrip('\r\n').split('\t')
+            name = elements[0].strip().strip('"')
+            if ended or line.startswith('#') or line.startswith('"#') or name == '':
+                lines.append(line)
+                continue
+            if name.startswith('END_POSITION'):
+                ended = True
+            elif name in positionTypes:
+                locType = name
+            elif locType == 'Polygon':  # imageJ marco: makePolygon(852,588,660,1184,1288,1216);
+                polygon = [int(i) for i in elements[1].strip().strip('"')[12:-2].split(',')]
+                elements[1] = f'makePolygon({",".join(str(v + (dx if i % 2 == 0 else dy)) for i, v in enumerate(polygon))});'
+            elif locType in shiftedValues:
+                valueIdx = [i for i, e in enumerate(elements) if i > 0 and e.strip().strip('"') != '' and
+                            not e.strip().startswith('#')][:shiftedValues[locType]]
+                for n, i in enumerate(valueIdx):
+                    elements[i] = str(int(elements[i].strip().strip('"')) + (dx if n % 2 == 0 else dy))
+            lines.append('\t'.join(elements) + '\n')
+    with open(outPath, 'w') as posFile:
+        posFile.writelines(lines)
+# shiftPositionFile
+
+
 def getPosToCrop(posDict, useCroppedImg=False, locFromCropped=False):
     posToCrop = {}
     for posType in posDict:
@@ -155,4 +194,25 @@ def getPosToCrop(posDict, useCroppedImg=False, locFromCropped=False):
                 paddingPos = posDict['removePadding']['paddingPos']
                 position = [x[0]-x[1] for x in zip(position[:4], paddingPos[:2] * 2)]
             posToCrop[posName] = position
-    return posToCrop
\ No newline at end of file
+    return posToCrop
+
+def getMeasureInfo(sampleInfo, posDict, percentage=1.0):
+    """Measurement setup of every position, for measuring sub-images in memory
+
+    Args:
+        sampleInfo (dict): output of getInfo()
+        posDict (dict): output of getPositions(), of the same position file group
+        percentage (float, optional): Affects type 'centreDisk' and 'square'. Defaults to 1.
+
+    Returns:
+        measureInfo: {posName: (measureType, percentage, polygon)}
+    """
+    measureInfo = {}
+    for posName in sampleInfo:
+        measureType = sampleInfo[posName]['measure']
+        polygon = None
+        if measureType == 'polygon':
+            polygon = tuple(int(p) for p in posDict['Polygon_poly'][posName])
+        measureInfo[posName] = (measureType, percentage, polygon)
+    return measureInfo
+# getMeasureInfo
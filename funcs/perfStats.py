@@ -0,0 +1,175 @@
+'''
+Run performance statistics:
+
+Timers, counters and per frame latency samples, collected only after enable().
+While disabled every call returns right away, clock() returns 0 and timer() is a
+no-op context, so the instrumentation stays in the hot paths for free.
+
+Worker processes collect their own statistics per job chunk, runChunked() sends
+them back with the results and merges them into the main process. The report
+holds total seconds and calls of every timer, the counters, latency percentiles
+and the peak memory of the main and the worker processes.
+'''
+
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+_stats = None  # None when disabled
+
+
+def newStats():
+    return {'timers': {}, 'counters': {}, 'samples': {}, 'peakRssWorkersMiB': 0}
+
+
+def enable():
+    global _stats
+    _stats = newStats()
+# enable
+
+
+def isEnabled():
+    return _stats is not None
+
+
+def clock():
+    """Start time for addTime(), 0 when disabled"""
+    return time.perf_counter() if _stats is not None else 0
+# clock
+
+
+def addTime(name, start, calls=1):
+    """Add the time since start (from clock()) to timer name"""
+    if _stats is None:
+        return
+    timer = _stats['timers'].setdefault(name, [0., 0])
+    timer[0] += time.perf_counter() - start
+    timer[1] += calls
+# addTime
+
+
+@contextmanager
+def timer(name):
+    """with timer(name): ... adds the time of the block to timer name"""
+    if _stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        addTime(name, start)
+# timer
+
+
+def count(name, n=1):
+    if _stats is None:
+        return
+    _stats['counters'][name] = _stats['counters'].get(name, 0) + n
+# count
+
+
+def countFile(name, filePath):
+    """Add the size of a written file to counter name"""
+    if _stats is None:
+        return
+    count(name, os.path.getsize(filePath))
+# countFile
+
+
+def addSample(name, value, n=1):
+    """Add value n times to the samples of name, eg. per frame latency of a batch"""
+    if _stats is None:
+        return
+    _stats['samples'].setdefault(name, []).extend([value] * n)
+# addSample
+
+
+def peakRss():
+    """Peak resident memory (MiB) of this process and of the finished children, None on Windows"""
+    if resource == None:
+        return None, None
+    unit = 1 if sys.platform == 'darwin' else 1024  # bytes on macOS, KiB on Linux
+    return tuple(resource.getrusage(who).ru_maxrss * unit / 1024**2
+                 for who in [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN])
+# peakRss
+
+
+def collect():
+    """Statistics collected so far in this process, and start again (used by worker processes)"""
+    global _stats
+    stats = _stats
+    if stats is not None:
+        stats['peakRssWorkersMiB'] = peakRss()[0] or 0
+        _stats = newStats()
+    return stats
+# collect
+
+
+def merge(stats):
+    """Add the output of collect() of a worker process"""
+    if _stats is None or stats is None:
+        return
+    for name, (seconds, calls) in stats['timers'].items():
+        timer = _stats['timers'].setdefault(name, [0., 0])
+        timer[0] += seconds
+        timer[1] += calls
+    for name, n in stats['counters'].items():
+        count(name, n)
+    for name, values in stats['samples'].items():
+        _stats['samples'].setdefault(name, []).extend(values)
+    _stats['peakRssWorkersMiB'] = max(_stats['peakRssWorkersMiB'], stats['peakRssWorkersMiB'])
+# merge
+
+
+def report():
+    """Summary of the statistics, JSON serialisable"""
+    if _stats is None:
+        return None
+    import numpy as np  # only needed here, importing perfStats stays cheap
+    peakSelf, peakChildren = peakRss()
+    summary = {
+        'timers': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in _stats['timers'].items()},
+        'counters': dict(_stats['counters']),
+        'latencyMs': {},
+        'peakRssMiB': peakSelf,
+        'peakRssWorkersMiB': max(_stats['peakRssWorkersMiB'], peakChildren or 0),
+    }
+    for name, values in _stats['samples'].items():
+        values = np.array(values) * 1000
+        summary['latencyMs'][name] = {'n': len(values), 'mean': float(values.mean()),
+                                      'p50': float(np.percentile(values, 50)),
+                                      'p95': float(np.percentile(values, 95)),
+                                      'max': float(values.max())}
+    return summary
+# report
+
+
+def finish(reportFile):
+    """Print the report and save it as JSON, nothing happens when disabled"""
+    summary = report()
+    if summary == None:
+        return
+    print('Performance report:')
+    for name, t in summary['timers'].items():
+        print(f'    {name:<28}{t["seconds"]:10.3f} s  {t["calls"]:>8} calls')
+    for name, n in summary['counters'].items():
+        value = f'{n / 1024**2:.1f} MiB' if name.split('.')[-1].startswith('bytes') else n
+        print(f'    {name:<28}{value:>12}')
+    for name, l in summary['latencyMs'].items():
+        print(f'    {name:<28}p50 {l["p50"]:.1f} ms, p95 {l["p95"]:.1f} ms, max {l["max"]:.1f} ms ({l["n"]} frames)')
+    if summary['peakRssMiB'] != None:
+        print(f'    peak memory: main {summary["peakRssMiB"]:.0f} MiB, workers {summary["peakRssWorkersMiB"]:.0f} MiB')
+    with open(reportFile, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f'Performance report saved to {reportFile}')
+# finish
@@ -0,0 +1,1027 @@
+'''
+Processing of one experiment, stage by stage:
+
+    rename -> extract -> measure -> aggregate -> plot / save
+
+Every stage is a method of Pipeline, called in this order, each one can be
+followed by your own code. extractPicAndMeasure.py and the batch runner are built
+on it.
+
+    from funcs.pipeline import Pipeline
+    pipeline = Pipeline('/data/exp1', '/data/exp1/positions.tsv', workers=8)
+    pipeline.rename()
+    pipeline.extract()
+    pipeline.measure()
+    allPicsData = pipeline.aggregate()
+    fig, plotData = pipeline.plot('strain', timeRange=(0, 72))
+    pipeline.save(fig=fig, plotData=plotData)
+    pipeline.close()
+
+Heavy libraries (PIL, scikit-image, pandas, matplotlib) are imported by the stages
+using them, importing this module and renaming stay fast.
+'''
+
+
+import os
+import sys
+import time
+import json
+import pickle
+import hashlib
+from bisect import bisect_right
+from datetime import datetime
+from shutil import copy2, copytree, rmtree
+
+from funcs import perfStats
+from funcs.changeName import changeFileName, appendNewFiles, resumeRename, naturalKey
+from funcs.scanCatalog import ScanCatalog, catalogExists, fillScanDetails
+from funcs.misc import createFolders, runChunked, runBounded, framesInBudget, ignoreInterrupt
+
+
+defaultOptions = {
+    'normType': 'Combined',
+    'noZeroing': False,
+    'percentage': 1.0,
+    'resizeFactor': 0.35,
+    'resizeProfile': 'fast',
+    'noTimeFromFile': False,
+    'timeSource': 'auto',
+    'locationFromCropped': False,
+    'imageInterval': 1.0,
+    'startImageTiming': 0.,
+    'endTiming': None,
+    'timeWindow': None,
+    'frameStride': 1,
+    'noDriftDetection': False,
+    'reExtract': False,
+    'reMeasure': False,
+    'fusedMeasure': False,
+    'saveSubImages': False,
+    'subImageStore': 'files',
+    'workers': os.cpu_count(),
+    'chunkSize': 4,
+    'framesPerJob': 256,
+    'frameCache': None,
+    'memoryBudget': None,
+    'lowResMeasure': None,
+    'lowResCheck': 5,
+    'statistics': None,
+    'channels': None,
+    'histBins': 8,
+    'append': False,
+    'forceNoFillBetween': False,
+}
+
+
+def preloadWorkerModules():
+    """Import the modules of the jobs before a process pool is made, workers forked afterwards
+    start with them loaded instead of each importing them again"""
+    import funcs.crop
+    import funcs.measureImages
+    import funcs.plotting
+    import funcs.resultStore
+# preloadWorkerModules
+
+
+class WorkerError(Exception):
+    """A job failed in a worker process, its traceback is printed by runChunked()"""
+
+
+class Pipeline:
+    """Rename, extract, measure, aggregate and plot one experiment
+
+    Args:
+        rootPath (str): path to process, with original_images dir
+        sampleInfoTsvPath (str): sample information table, the first one when the plate moved
+        diffPos (list, optional): [start file, positionTsvPath, ...] when the plate moved. Defaults to None.
+        executor (concurrent.futures.Executor, optional): process pool shared with other work, one is
+                                                          created when needed if not given. Defaults to None.
+        Other keyword arguments are the command line arguments of extractPicAndMeasure.py, see defaultOptions.
+    """
+
+    def __init__(self, rootPath, sampleInfoTsvPath, diffPos=None, executor=None, **options):
+        unknown = set(options) - set(defaultOptions)
+        assert len(unknown) == 0, f'Unknown options {unknown}, options are {list(defaultOptions)}'
+        self.options = dict(defaultOptions, **options)
+        opts = self.options
+        if opts['lowResMeasure'] != None:
+            assert opts['fusedMeasure'], 'lowResMeasure requires fusedMeasure'
+            assert 0 < opts['lowResMeasure'] <= 1, 'lowResMeasure should be in range (0, 1]'
+        if diffPos != None and len(diffPos) % 2 != 0:
+            raise ValueError('diffPos requires both number and file')
+        # Statistics measured with the greyness, values of "posName.statistic" columns
+        self.statSpec, self.statNames, self.statKey = (None, [], ())
+        if opts['statistics'] != None:
+            from funcs.roiStats import statSpec, statNames, statKey
+            self.statSpec = statSpec(opts['statistics'], opts['channels'], opts['histBins'])
+            self.statNames, self.statKey = (statNames(self.statSpec), statKey(self.statSpec))
+        # convert to realpath in case of failure in some systems
+        self.rootPath = os.path.realpath(rootPath.strip())
+        assert os.path.isdir(self.rootPath), f'rootPath {self.rootPath} does not exist.'
+        self.sampleInfoTsvPath = sampleInfoTsvPath.strip()
+        self.diffPos = diffPos
+        self.executor = executor
+        self.ownExecutor = False
+        self.timeSource = None  # 'header' or 'file', decided by readRenameLog()
+        # Values measured at reduced resolution are cached separately
+        self.draftKey = () if opts['lowResMeasure'] == None else (('draft', opts['lowResMeasure']), )
+        # and so are the values measured from the uint8 grey frames of a 'gray' frame cache
+        self.frameKey = () if opts['frameCache'] != 'gray' else (('frameCache', 'gray'), )
+        self.dataDir = os.path.join(self.rootPath, 'measuredData')  # 'raw' and 'processed' tables
+        self.allPicsData = None
+        self.measureCache = None
+        self.resultDir = None
+
+    def getExecutor(self):
+        """The process pool of this pipeline, created on first use"""
+        if self.executor == None:
+            from concurrent.futures import ProcessPoolExecutor
+            preloadWorkerModules()
+            self.executor = ProcessPoolExecutor(max_workers=self.options['workers'], initializer=ignoreInterrupt)
+            self.ownExecutor = True
+        return self.executor
+
+    def runJobs(self, func, jobs, chunkSize=1, filePaths=None):
+        """runChunked() in the pool, a failed job raises WorkerError. With filePaths (the scan of every job),
+        the jobs are streamed with runBounded(): only as many scans are decoded at the same time as
+        memoryBudget allows, and with a memoryBudget the scans are read ahead."""
+        try:
+            if filePaths != None:
+                # the reader warms the page cache for the few jobs in flight under a memoryBudget, without one
+                # the workers keep the disk busy and every scan would be read twice
+                prefetchPaths = filePaths if self.options['memoryBudget'] != None else None
+                return runBounded(self.getExecutor(), func, jobs, chunkSize, self.scansInFlight(filePaths),
+                                  prefetchPaths)
+            return runChunked(self.getExecutor(), func, jobs, chunkSize)
+        except Exception as e:
+            raise self.workerFailed(func.__name__, e) from e
+
+    def scansInFlight(self, filePaths):
+        """Crop jobs submitted at a time: two per worker keep them busy, fewer if their decoded scans
+        would not fit in memoryBudget"""
+        inFlight = 2 * self.options['workers']
+        if self.options['memoryBudget'] != None and len(filePaths) > 0:
+            from PIL import Image
+            from funcs.crop import cropMemory
+            with Image.open(filePaths[0]) as im:
+                scanBytes = cropMemory(im.size, im.mode)
+            if scanBytes > self.options['memoryBudget']:
+                print(f'A scan needs {scanBytes / 1024**2:.0f} MiB, more than memoryBudget, scans are processed one at a time.')
+            inFlight = framesInBudget(self.options['memoryBudget'], scanBytes, maximum=inFlight)
+        return inFlight
+
+    def framesPerBatch(self, bytesPerPixel, maximum):
+        """Sub-images a measuring job holds together, at most maximum, fewer if the jobs of all workers
+        would not fit in memoryBudget"""
+        if self.options['memoryBudget'] == None:
+            return maximum
+        from funcs.parseMetadata import getPositions, getPosToCrop
+        pixels = max((x2 - x1) * (y2 - y1) for f in self.diffPosFiles
+                     for x1, y1, x2, y2 in getPosToCrop(getPositions(f)).values())
+        return framesInBudget(self.options['memoryBudget'], pixels * bytesPerPixel, self.options['workers'], maximum)
+
+    def statBytesPerPixel(self):
+        """Memory of the statistics per pixel of a frame being measured, 0 without statistics"""
+        if self.statSpec == None:
+            return 0
+        from funcs.roiStats import statBytesPerPixel
+        return statBytesPerPixel
+
+    def workerFailed(self, name, exception):
+        """Stop the pool (if owned) after a failed job, return the WorkerError to raise"""
+        if self.ownExecutor:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        return WorkerError(f'{name} failed, {type(exception).__name__}: {exception}')
+
+    def close(self):
+        """Stop the process pool if it was created by this pipeline"""
+        if self.ownExecutor and self.executor != None:
+            self.executor.shutdown()
+        self.executor = None
+        self.ownExecutor = False
+
+    def rename(self, inWorker=False):
+        """Rename the scans (and the newly arrived ones with the append option), read the rename log
+
+        Args:
+            inWorker (bool, optional): rename in a worker process, where a question (input()) about the
+                                       file extension fails instead of waiting. Defaults to False.
+        """
+        stageStart = perfStats.clock()
+        rootPath = self.rootPath
+        resumeRename(rootPath)  # a renaming interrupted in an earlier run
+        if not catalogExists(rootPath):
+            if inWorker:
+                self.getExecutor().submit(changeFileName, rootPath, False).result()
+            else:
+                changeFileName(rootPath, reverse=False)
+        elif self.options['append']:
+            appendNewFiles(rootPath)
+        self.readScanDetails()
+        self.readRenameLog()
+
+        # If the targets moved during time lapse experiment, different metadata files are used
+        # for the moved location
+        self.diffPosNums = [0, ]
+        self.diffPosFiles = [self.sampleInfoTsvPath, ]
+        self.detectsDrift = self.diffPos == None and not self.options['noDriftDetection']
+        if self.diffPos != None:
+            with ScanCatalog(rootPath) as catalog:
+                for imgfile, posFile in zip(self.diffPos[0::2], self.diffPos[1::2]):
+                    idx = catalog.index(imgfile)  # old or new name
+                    if idx == None:
+                        raise ValueError(f'File {imgfile} missing from the original file names ({self.oldFiles[:5]}...) ({self.newFiles[:5]}...)')
+                    self.diffPosNums.append(idx)
+                    self.diffPosFiles.append(posFile)
+        elif self.detectsDrift:
+            self.detectDrift()
+        self.hashPositionFiles()
+        perfStats.addTime('stage.rename', stageStart)
+    # rename
+
+    def hashPositionFiles(self):
+        """Real paths and sha1 of the position files of every group"""
+        # convert to realpath in case of failure in some systems
+        self.diffPosFiles = [os.path.realpath(f) for f in self.diffPosFiles]
+        self.diffPosFileHashes = []
+        for f in self.diffPosFiles:
+            assert os.path.isfile(f), f'sample information table {f} does not exist.'
+            sha1 = hashlib.sha1()
+            with open(f, 'rb') as f:
+                sha1.update(f.read())
+                self.diffPosFileHashes.append(sha1.hexdigest())
+
+    def detectDrift(self, reportFrom=0):
+        """Find where the plate moved by registering thumbnails of consecutive scans (see funcs.driftDetection).
+        For each group of scans after the first, a position file moved by the offset is written in
+        "driftPositions" and used as if given with diffPos. Groups starting before scan reportFrom
+        are not reported again."""
+        from PIL import Image
+        from funcs.parseMetadata import getPositions, getPosToCrop, shiftPositionFile
+        from funcs.driftDetection import driftRegion, frameShifts, driftGroups, defaultMinShift
+        imgPath = os.path.join(self.rootPath, 'original_images')
+        fileNames = self.newFiles
+        useCroppedImg = not os.path.isdir(imgPath)
+        if useCroppedImg:
+            imgPath = os.path.join(self.rootPath, 'cropped_ori')
+            fileNames = [f'{n}_cropped{e}' for n, e in map(os.path.splitext, fileNames)]
+        if len(fileNames) < 2 or not os.path.isdir(imgPath):
+            return
+        missing = set(fileNames) - set(os.listdir(imgPath))
+        if len(missing) > 0:
+            print(f'Plate movement not detected, {len(missing)} scans not found in {imgPath}.')
+            return
+        filePaths = [os.path.join(imgPath, f) for f in fileNames]
+        posToCrop = getPosToCrop(getPositions(self.sampleInfoTsvPath), useCroppedImg, self.options['locationFromCropped'])
+        with Image.open(filePaths[0]) as im:
+            region = driftRegion(posToCrop, im.size)
+        with perfStats.timer('rename.driftDetection'):
+            executor = self.getExecutor() if len(filePaths) > 64 else None
+            shifts = frameShifts(self.rootPath, filePaths, region, executor=executor)
+        groups = driftGroups(shifts, defaultMinShift(region))
+        if len(groups) == 1:
+            return
+        driftDir = os.path.join(self.rootPath, 'driftPositions')
+        os.makedirs(driftDir, exist_ok=True)
+        self.diffPos = []
+        for i, offset in groups[1:]:
+            posFile = os.path.join(driftDir, f'positions_{os.path.splitext(self.scanFiles[i])[0]}.tsv')
+            shiftPositionFile(self.sampleInfoTsvPath, posFile, offset)
+            self.diffPosNums.append(i)
+            self.diffPosFiles.append(posFile)
+            self.diffPos.extend([self.scanFiles[i], posFile])
+            if i >= reportFrom:
+                print(f'Plate moved by {offset} pixels from the first scan at {self.scanFiles[i]} ({self.oldFiles[i]}), '
+                      f'positions in {posFile}')
+    # detectDrift
+
+    def updateDrift(self, firstNew):
+        """Detect plate movement again after new scans arrived, only their thumbnails are read
+
+        Args:
+            firstNew (int): index of the first new scan in scanFiles
+
+        Returns:
+            bool: True if a new group started
+        """
+        groupCount = len(self.diffPosNums)
+        self.diffPosNums, self.diffPosFiles, self.diffPos = ([0, ], [self.sampleInfoTsvPath, ], None)
+        self.detectDrift(reportFrom=firstNew)
+        self.hashPositionFiles()
+        if len(self.diffPosNums) == groupCount:
+            return False
+        # the stored results and the extracted scans are of the new grouping
+        self.measureArgsStatic[:2] = [self.diffPosNums, self.diffPosFileHashes]
+        self.saveExtractArgs()
+        return True
+
+    def readScanDetails(self):
+        """Dimensions and capture times from the headers of the scans missing them, many are read in the process pool"""
+        with ScanCatalog(self.rootPath) as catalog:
+            missingDetails = len(catalog.missingDetails())
+        if missingDetails > 0:
+            with perfStats.timer('rename.readHeaders'):
+                executor = self.getExecutor() if missingDetails >= 1000 or self.executor != None else None
+                fillScanDetails(self.rootPath, workers=self.options['workers'], executor=executor)
+
+    def readRenameLog(self):
+        """Old and new names of the scans, sorted by the new names, and the scan times from the catalog.
+        A timeSource 'auto' is decided on the first reading, scans arriving later use the same source."""
+        firstReading = self.timeSource == None
+        with ScanCatalog(self.rootPath) as catalog:
+            pairs = catalog.names()
+            self.dictOldScanTime, self.timeSource = catalog.scanTimes(self.timeSource or self.options['timeSource'])
+            sourceCounts = catalog.timeSourceCounts()
+        if self.timeSource == 'header' and firstReading:
+            print(f'Scan times from the image headers ({", ".join(f"{k}: {n}" for k, n in sourceCounts.items())}).')
+        self.oldFiles = [o for o, _ in pairs]
+        self.newFiles = [n for _, n in pairs]
+        self.scanFiles = self.newFiles.copy()  # names in the rename log, used for getting scan time
+        self.selectScans()
+
+    def selectScans(self):
+        """Scans to process: in timeWindow (hours, same as the figure) and every frameStride-th scan.
+        The first 3 scans are always kept, they are the zero point and the time origin of the measurements."""
+        opts = self.options
+        self.selectedIdx = list(range(len(self.scanFiles)))  # indexes in scanFiles, fileList
+        if (opts['timeWindow'] != None or opts['frameStride'] > 1) and len(self.scanFiles) > 0:
+            from funcs.measureImages import getImageTimes
+            hours = getImageTimes(self.scanFiles, self.dictOldScanTime, forceUseFileNumber=opts['noTimeFromFile'],
+                                  fileNumberTimeInterval=opts['imageInterval'])
+            hours = hours - hours.min() + opts['startImageTiming']  # as rebased by processMeasurements()
+            start, end = opts['timeWindow'] or (None, None)
+            self.selectedIdx = [i for i, h in enumerate(hours) if i < 3 or (
+                i % opts['frameStride'] == 0 and (start == None or h >= start) and (end == None or h <= end))]
+            print(f'{len(self.selectedIdx)} of {len(self.scanFiles)} scans selected (time window {opts["timeWindow"]}, '
+                  f'every {opts["frameStride"]} scans).')
+        self.selectedFiles = [self.scanFiles[i] for i in self.selectedIdx]
+
+    def loadExtracted(self):
+        """New names of the scans extracted with the current position files and settings,
+        None if not recorded (extracted by an earlier version, all of them)"""
+        extractedFile = os.path.join(self.rootPath, 'extractedScans.json')
+        if not os.path.isfile(extractedFile):
+            return None
+        with open(extractedFile, 'r') as f:
+            return set(json.load(f))
+
+    def saveExtracted(self, extracted):
+        """Record the extracted scans, see loadExtracted()"""
+        extractedFile = os.path.join(self.rootPath, 'extractedScans.json')
+        with open(f'{extractedFile}_temp', 'w') as f:
+            json.dump(sorted(extracted, key=naturalKey), f)
+        os.replace(f'{extractedFile}_temp', extractedFile)
+
+    def genExtractArgsFile(self):
+        return os.path.join(self.rootPath, 'Hashes for last measurement metadata files.pickle'.replace(' ', '_'))
+
+    def extractArgs(self):
+        """Arguments the extracted images depend on, extract() again if they are not the ones of the last extraction"""
+        opts = self.options
+        return [self.diffPosFileHashes, self.useCroppedImg, opts['locationFromCropped'], self.diffPos, opts['fusedMeasure'],
+                opts['saveSubImages'], opts['subImageStore']]
+
+    def saveExtractArgs(self):
+        with open(self.genExtractArgsFile(), 'wb') as f:
+            pickle.dump(self.extractArgs(), f)
+
+    def extract(self):
+        """Crop the sub-images, resized and padding removed images, unless done before with the same
+        position files and settings. With fusedMeasure, the positions are measured at the same time.
+        """
+        from funcs.parseMetadata import getInfo, getPositions, getPosToCrop, getMeasureInfo
+        from funcs.measureCache import loadMeasureCache, fingerprintFiles, measureKey, forgetFingerprints
+        from funcs.subImageStack import allocateStack, genIndexFile
+        from funcs.preview import saveResizedProfile
+        from funcs.frameCache import openFrameCache
+        from funcs.crop import crop
+        opts = self.options
+        rootPath = self.rootPath
+        fusedMeasure = opts['fusedMeasure']
+        subImageStore = opts['subImageStore']
+        locFromCropped = opts['locationFromCropped']
+
+        # correct names can be found in the scan catalog)
+        self.useCroppedImg = False
+        self.imgPath = os.path.join(rootPath, 'original_images')
+        if not os.path.isdir(self.imgPath):
+            self.imgPath = os.path.join(rootPath, 'cropped_ori')
+            print(f'original_images folder not found, use cropped_ori folder for source images')
+            assert os.path.isdir(self.imgPath), f'cropped_ori folder not found in {rootPath}.'
+            self.useCroppedImg = True
+        useCroppedImg = self.useCroppedImg
+
+        # Compare hashes with previously runs, extract pictures again if not the same
+        # Also consider reExtract argument
+        posFileHashesFile = self.genExtractArgsFile()
+        self.doExtractPics = True
+        self.reMeasure = opts['reMeasure']
+        if (os.path.isdir(os.path.join(rootPath, 'subImages')) or fusedMeasure) and os.path.isfile(posFileHashesFile) and not opts['reExtract']:
+            with open(posFileHashesFile, 'rb') as f:
+                try:
+                    extractArgsStatic_old = pickle.load(f)
+                    if extractArgsStatic_old == self.extractArgs():
+                        self.doExtractPics = False
+                except:
+                    pass
+        if self.doExtractPics:
+            self.saveExtractArgs()
+            self.reMeasure = True
+
+        # Generate file paths to process
+        newFiles = self.newFiles
+        if useCroppedImg:
+            fns_exts = [os.path.splitext(f) for f in newFiles]
+            newFiles = [f'{n[0]}_cropped{n[1]}' for n in fns_exts]
+        self.fileList = [os.path.join(self.imgPath, f) for f in newFiles]
+        fileList = self.fileList
+
+        # Get positions from the first metadata file
+        posDict = getPositions(self.diffPosFiles[0])
+        posToCrop = getPosToCrop(posDict, useCroppedImg, locFromCropped)
+        paddingPos = posDict['removePadding']['paddingPos']  # Should equal to None when remove padding is not specified
+        self.paddingPos = paddingPos
+        # Create folder for each sample (posName)
+        targetPaths = {}
+        folders = []
+        if opts['saveSubImages'] or not fusedMeasure:
+            folders = [os.path.join('subImages', f) for f in list(posToCrop.keys())]
+
+        # Add additional folder for cropped and resized pictures
+        # Resized folder will store resized cropped images
+        if paddingPos != None and not useCroppedImg:
+            folders.append('cropped_ori')
+        folders.append('resized')
+        self.folders = folders
+
+        assert len(set(folders)) == len(folders), f'There are duplications in the sample IDs:\n{[i for i in folders if folders.count(i) > 1]}'
+
+        # See if the previous picture extraction has resulted any file (avoid empty measurment)
+        firstSubFolder = os.path.join(rootPath, folders[0])
+        if subImageStore == 'stack' and folders[0].startswith('subImages'):
+            if not os.path.isfile(genIndexFile(rootPath, os.path.basename(folders[0]))):
+                self.doExtractPics = True
+                self.reMeasure = True
+        elif os.path.isdir(firstSubFolder):
+            if not len(os.listdir(firstSubFolder)) > 2:
+                self.doExtractPics = True
+                self.reMeasure = True
+
+        # Scans selected by timeWindow and frameStride, the ones not extracted by earlier runs are added
+        self.extracted = set() if self.doExtractPics else self.loadExtracted()
+        if self.extracted == None:  # extracted by an earlier version, all of them
+            self.extracted = set(self.scanFiles)
+        toExtract = {i for i in self.selectedIdx if self.scanFiles[i] not in self.extracted}
+        if len(toExtract) > 0 and not self.doExtractPics:
+            print(f'{len(toExtract)} selected scans are not extracted yet.')
+            self.reMeasure = True
+
+        self.loadStored()
+        # Raw values of each (image, position geometry), normalisation is not part of the cache
+        self.measureCache = loadMeasureCache(rootPath)
+        if opts['reMeasure']:
+            self.measureCache['values'] = {}
+        elif self.doExtractPics:
+            # values stay keyed by content, the images extracted again are hashed again
+            for d in ['subImages', 'resized_hq', 'cropped_ori', 'resized']:
+                forgetFingerprints(self.measureCache, os.path.join(rootPath, d))
+        measureCache = self.measureCache
+
+        self.sampleInfo = getInfo(self.diffPosFiles[0])  # will be used in both measurement and plotting
+        sampleInfo = self.sampleInfo
+        self.allLevels = [k for k in list(list(sampleInfo.values())[0].keys()) if k not in ['measure', 'colour']]
+        for posName in sampleInfo:
+            measureType = sampleInfo[posName]['measure']
+            assert measureType in ['centreDisk', 'square', 'polygon'], \
+                f'Error found in sample information file, "measure" should be in [\'centreDisk\', \'square\', \'polygon\'], {measureType} found.'
+
+        # In fused mode, every original image is decoded once for both extraction and measurement
+        stageStart = perfStats.clock()
+        self.pictureKeys = {}  # {file path: {posName: cache key}}, filled only in fused mode
+        if self.doExtractPics:
+            print('Clearing existing folders...')
+            removeDirList = ['subImages']
+            dirList = []
+            for _, ds, _ in os.walk(rootPath):
+                dirList = ds
+                break
+            removeDirList.append('resized_hq')
+            if not useCroppedImg:
+                removeDirList.append('cropped_ori')
+            for d in removeDirList:
+                if d in dirList:
+                    rmtree(os.path.join(rootPath, d))
+                else:
+                    print(f'{d} not found in {rootPath}')
+            print('Creating folders...')
+            targetPaths = createFolders(rootPath, folders, reset=True)
+            saveResizedProfile(rootPath, self.imgPath, opts['resizeFactor'],
+                               paddingPos=None if useCroppedImg else paddingPos,
+                               useFileTime=not opts['noTimeFromFile'])
+        elif len(toExtract) > 0:
+            targetPaths = createFolders(rootPath, folders)
+        if self.doExtractPics or len(toExtract) > 0 or (fusedMeasure and self.needMeasure):
+            # Only measure when the images are already extracted
+            saveSubImages = opts['saveSubImages'] or not fusedMeasure
+            selectedFileList = [fileList[i] for i in self.selectedIdx]
+            cropJobs = []  # [(args, kwargs), ...] of all groups, run in the same process pool
+            fileGroups = {}  # {file path: (posToCrop, measureInfo)} of the group the file belongs to
+            if fusedMeasure or opts['frameCache'] != None:
+                fingerprints = fingerprintFiles(selectedFileList, measureCache, opts['workers'])
+                if not useCroppedImg:
+                    with ScanCatalog(rootPath) as catalog:
+                        catalog.setDetails({os.path.basename(f): {'fingerprint': fingerprint}
+                                            for f, fingerprint in fingerprints.items()})
+            frameCache, frameSlots = (None, {})
+            if opts['frameCache'] != None:
+                frameCache, frameSlots = openFrameCache(rootPath, selectedFileList, fingerprints, opts['frameCache'],
+                                                        paddingPos=None if useCroppedImg else paddingPos)
+            for i, sampleInfoTsvPath in enumerate(self.diffPosFiles):
+                try:
+                    nextGroupStart = self.diffPosNums[i + 1]
+                except IndexError:
+                    nextGroupStart = len(fileList)
+
+                if i != 0: # Multiple position files
+                    posDict = getPositions(sampleInfoTsvPath)
+                    posToCrop = getPosToCrop(posDict, useCroppedImg, locFromCropped)
+                measureInfo = None
+                if fusedMeasure:
+                    measureInfo = getMeasureInfo(sampleInfo, posDict, opts['percentage'])
+                # Prepare cropping files, the selected ones in this group
+                groupIdx = [n for n in self.selectedIdx if self.diffPosNums[i] <= n < nextGroupStart]
+                groupToExtract = [n for n in groupIdx if n in toExtract]
+                print(f'Group {i+1}/{len(self.diffPosNums)}: {len(groupIdx)} images')
+                stackSlots = {}  # {posName: (stackInfo, {scan name: slot})}
+                if saveSubImages and subImageStore == 'stack' and len(groupToExtract) > 0:
+                    from PIL import Image
+                    with Image.open(fileList[groupToExtract[0]]) as im:
+                        srcMode = im.mode
+                    for posName in posToCrop:
+                        stackSlots[posName] = allocateStack(rootPath, posName, i, posToCrop[posName],
+                                                            [self.scanFiles[n] for n in groupToExtract], srcMode)
+                for n in groupIdx:
+                    filePath = fileList[n]
+                    writeImages = n in toExtract
+                    filePosToCrop, fileMeasureInfo = (posToCrop, measureInfo)
+                    fileGroups[filePath] = (posToCrop, measureInfo)
+                    if fusedMeasure:
+                        # only measure the positions not found in the cache
+                        self.pictureKeys[filePath] = {
+                            posName: measureKey(fingerprints[filePath], posToCrop[posName], *measureInfo[posName],
+                                                *self.draftKey, *self.frameKey, *self.statKey)
+                            for posName in measureInfo
+                        }
+                        fileMeasureInfo = {posName: measureInfo[posName] for posName, key in self.pictureKeys[filePath].items()
+                                           if key not in measureCache['values']}
+                        if not writeImages:
+                            filePosToCrop = {posName: posToCrop[posName] for posName in fileMeasureInfo}
+                    if not writeImages and not fileMeasureInfo:  # nothing to write or measure
+                        continue
+                    cropJobs.append((
+                        (filePath, filePosToCrop, targetPaths),
+                        dict(paddingPos=paddingPos if writeImages else None,
+                             resizeFactor=opts['resizeFactor'] if writeImages else None,
+                             useFileTime=not opts['noTimeFromFile'],
+                             measureInfo=fileMeasureInfo,
+                             saveSubImages=writeImages and saveSubImages,
+                             frameCache=frameCache,
+                             frameSlot=frameSlots.get(filePath),
+                             draftScale=opts['lowResMeasure'],
+                             resizeProfile=opts['resizeProfile'],
+                             subImageStack={posName: (stackInfo, slots[self.scanFiles[n]])
+                                            for posName, (stackInfo, slots) in stackSlots.items()
+                                            if writeImages} or None,
+                             statSpec=self.statSpec)
+                    ))
+            # RUN. Submit cropping jobs of all groups
+            print(f'Submitted {len(cropJobs)} images for cropping and creating subimages ' +
+                  f'({opts["workers"]} workers, chunk size {opts["chunkSize"]}). Waiting for finish.')
+            if len(cropJobs) > 0:
+                for picPath, measured in self.runJobs(crop, cropJobs, opts['chunkSize'],
+                                                      filePaths=[args[0] for args, _ in cropJobs]):
+                    for posName, value in measured.items():
+                        measureCache['values'][self.pictureKeys[picPath][posName]] = value
+            self.extracted |= {self.scanFiles[n] for n in toExtract}
+            self.saveExtracted(self.extracted)
+            # Report the deviation of reduced resolution measurement from full resolution
+            lowResMeasure, lowResCheck = (opts['lowResMeasure'], opts['lowResCheck'])
+            if lowResMeasure != None and lowResCheck > 0 and len(cropJobs) > 0:
+                import numpy as np
+                from funcs.measureImages import measureDeviation
+                checkFiles = selectedFileList[::max(1, len(selectedFileList) // lowResCheck)][:lowResCheck]
+                checkJobs = [((f, fileGroups[f][0], targetPaths),
+                              dict(useFileTime=False, measureInfo=fileGroups[f][1], saveSubImages=False))
+                             for f in checkFiles]
+                fullRes = dict(self.runJobs(crop, checkJobs, opts['chunkSize'], filePaths=checkFiles))
+                # the greyness only, cached values start with it when there are statistics
+                lowRes = {f: {posName: np.ravel(measureCache['values'][key])[0] for posName, key in self.pictureKeys[f].items()}
+                          for f in checkFiles}
+                deviation = measureDeviation(lowRes, fullRes)
+                print(f'Deviation of --lowResMeasure {lowResMeasure} from full resolution ({len(checkFiles)} images):')
+                print(deviation.to_string())
+                deviation.to_csv(os.path.join(rootPath, 'lowResCheck.tsv'), sep='\t')
+            print('Finished!')
+        perfStats.addTime('stage.extract', stageStart)
+    # extract
+
+    def loadStored(self):
+        """Measured data of an earlier run, reused if the arguments affecting the measurement are the same.
+        The processed data is reused if the zeroing and normalisation arguments are the same as well, processed
+        again from the raw data otherwise."""
+        from funcs.resultStore import loadResults, tableToMeasured, tableToStats
+        opts = self.options
+        self.measureArgsStatic = [self.diffPosNums, self.diffPosFileHashes, opts['noTimeFromFile'], self.timeSource,
+                                  opts['imageInterval'], opts['percentage'], opts['lowResMeasure']]
+        self.processArgs = [opts['startImageTiming'], opts['normType'], opts['noZeroing']]  # see aggregate()
+        if opts['timeWindow'] != None or opts['frameStride'] != 1:  # stored data of all scans stays valid otherwise
+            self.measureArgsStatic += [list(opts['timeWindow'] or []), opts['frameStride']]
+        if self.statSpec != None:
+            channels, statistics, histBins = self.statSpec
+            self.measureArgsStatic.append([list(channels), list(statistics), histBins])
+        self.measuredData = {}  # {posName: np.ndarray of shape [len, 2]}, raw measurements before processing
+        self.measuredStats = {}  # {posName: np.ndarray of shape [len, len(statNames)]}, same rows as measuredData
+        self.measuredFiles = []  # scan files (new names) measured in measuredData
+        self.needMeasure = True
+        dataPickle = os.path.join(self.rootPath, 'data.pickle')  # used before the columnar store
+        storedAllPicsData, storedMeta = loadResults(os.path.join(self.dataDir, 'processed'))
+        if not self.reMeasure and storedAllPicsData is not None:
+            storedRaw, rawMeta = loadResults(os.path.join(self.dataDir, 'raw'))
+            if storedMeta['measureArgsStatic'] == self.measureArgsStatic:  # arguments affect measured data
+                if storedMeta.get('processArgs') == self.processArgs:
+                    self.needMeasure = False
+                    self.allPicsData = storedAllPicsData
+                elif storedRaw is not None:  # processed again by aggregate()
+                    self.needMeasure = False
+            if storedRaw is not None:
+                storedStatNames = (rawMeta or {}).get('statNames', [])
+                self.measuredData = tableToMeasured(storedRaw, storedStatNames)
+                self.measuredFiles = storedMeta['measuredFiles']
+                if storedStatNames == self.statNames:
+                    self.measuredStats = tableToStats(storedRaw, self.statNames)
+            elif opts['append']:
+                self.needMeasure = True
+        elif not self.reMeasure and os.path.isfile(dataPickle):
+            if os.stat(dataPickle).st_size > 0:
+                with open(dataPickle, 'rb') as resultData:
+                    storedData = pickle.load(resultData)
+                    oldAllPicsData, measureArgsStatic_old = storedData[:2]
+                    if measureArgsStatic_old == self.measureArgsStatic:  # arguments affect measured data
+                        self.needMeasure = False
+                        self.allPicsData = oldAllPicsData
+                    if len(storedData) == 4:  # raw data stored since append mode is available
+                        self.measuredData, self.measuredFiles = storedData[2:]
+                    elif opts['append']:
+                        self.needMeasure = True
+    # loadStored
+
+    def measure(self):
+        """Measure the greyness of every position in every scan, skipped if the stored data can be used
+
+        Returns:
+            measuredData: {posName: np.ndarray [len, 2]}, raw (time, value) before aggregate(). The statistics
+                          are in measuredStats.
+        """
+        from funcs.parseMetadata import getPositions, getMeasureInfo
+        from funcs.measureImages import getImageTimes, measureFolders, batchBytesPerPixel
+        from funcs.measureCache import saveMeasureCache
+        stageStart = perfStats.clock()
+        opts = self.options
+        sampleInfo = self.sampleInfo
+        if self.needMeasure:
+            timeArgs = dict(forceUseFileNumber=opts['noTimeFromFile'], fileNumberTimeInterval=opts['imageInterval'])
+            measuredData, measuredStats = ({}, {})
+            statSpec = self.statSpec
+            # Only the scans selected by timeWindow and frameStride, all of them by default
+            scanNames = None if len(self.selectedIdx) == len(self.scanFiles) else self.selectedFiles
+            if opts['fusedMeasure']:
+                import numpy as np
+                times = getImageTimes(self.scanFiles, self.dictOldScanTime, **timeArgs)[self.selectedIdx]
+                for posName in sampleInfo:
+                    values = np.array([np.ravel(self.measureCache['values'][self.pictureKeys[self.fileList[n]][posName]])
+                                       for n in self.selectedIdx]).reshape(len(self.selectedIdx), -1)
+                    measuredData[posName] = np.column_stack((times, values[:, 0]))
+                    measuredStats[posName] = values[:, 1:]
+            elif opts['subImageStore'] == 'stack':
+                from funcs.subImageStack import measureStacks, stackBytesPerPixel
+                # Measure conditions of each position file, applied to the stack of that group
+                groupMeasureInfo = [getMeasureInfo(sampleInfo, getPositions(f), opts['percentage']) for f in self.diffPosFiles]
+                framesPerJob = self.framesPerBatch(stackBytesPerPixel + self.statBytesPerPixel(), opts['framesPerJob'])
+                print(f'Measuring greyness of {len(sampleInfo)} position stacks ({opts["workers"]} workers, {framesPerJob} frames per job).')
+                try:
+                    measuredData = measureStacks(self.getExecutor(), self.rootPath, groupMeasureInfo, self.dictOldScanTime,
+                                                 framesPerJob=framesPerJob, scanNames=scanNames, statSpec=statSpec,
+                                                 **timeArgs)
+                    if statSpec != None:
+                        measuredData, measuredStats = measuredData
+                except Exception as e:
+                    raise self.workerFailed('measureStacks', e) from e
+            else:
+                folderJobs = {}  # {posName: (path, measureType, polygons)}
+                for folder in sampleInfo:
+                    measureType = sampleInfo[folder]['measure']
+
+                    polygons = [(0, 0, 1, 0, 0, 1), ]  # polygon initiation for non-polygon measurments
+                    if measureType == 'polygon':  # needs to go back to posDict to find location
+
+                        # Polygon of every scan, from the position file of its group
+                        polygons = {}
+                        for i, (num, sampleInfoTsvPath) in enumerate(zip(self.diffPosNums, self.diffPosFiles)):
+                            try:
+                                nextGroupStart = self.diffPosNums[i + 1]
+                            except IndexError:  # reach the end
+                                nextGroupStart = len(self.scanFiles)
+                            polygon = getPositions(sampleInfoTsvPath)['Polygon_poly'][folder]
+                            polygons.update({os.path.splitext(f)[0]: polygon for f in self.scanFiles[num:nextGroupStart]})
+                    folderJobs[folder] = (os.path.join(self.rootPath, 'subImages', folder), measureType, polygons)
+
+                # Positions and chunks of frames are measured in parallel, results come back in order
+                print(f'Measuring greyness of {len(folderJobs)} positions ({opts["workers"]} workers, {opts["framesPerJob"]} frames per job).')
+                try:
+                    measuredData = measureFolders(self.getExecutor(), folderJobs, self.dictOldScanTime,
+                                                  percentage=opts['percentage'], cache=self.measureCache,
+                                                  framesPerJob=opts['framesPerJob'], scanNames=scanNames, statSpec=statSpec,
+                                                  workers=opts['workers'],
+                                                  batchSize=self.framesPerBatch(batchBytesPerPixel + self.statBytesPerPixel(), 64),
+                                                  **timeArgs)
+                    if statSpec != None:
+                        measuredData, measuredStats = measuredData
+                except Exception as e:
+                    raise self.workerFailed('measureFolders', e) from e
+            self.measuredData = measuredData
+            self.measuredStats = measuredStats if statSpec != None else {}
+            self.measuredFiles = self.selectedFiles.copy()
+            self.saveRaw()
+            saveMeasureCache(self.rootPath, self.measureCache)
+        perfStats.addTime('stage.measure', stageStart)
+        return self.measuredData
+    # measure
+
+    def saveRaw(self):
+        """Store measuredData and measuredStats as the raw table, the statistics next to their position"""
+        from funcs.resultStore import saveResults, measuredToTable
+        saveResults(os.path.join(self.dataDir, 'raw'),
+                    measuredToTable(self.measuredData, self.measuredStats if self.statSpec != None else None, self.statNames),
+                    meta={'statNames': self.statNames})
+    # saveRaw
+
+    def aggregate(self):
+        """Zeroing and normalisation of the measured data, the stored result is reused if nothing was measured
+
+        Returns:
+            allPicsData: pd.DataFrame, one column per position, time (h) as index
+        """
+        if self.needMeasure or self.allPicsData is None:
+            stageStart = perfStats.clock()
+            from funcs.measureImages import processMeasurements
+            from funcs.resultStore import saveResults
+            opts = self.options
+            # data processing according to arguments
+            self.allPicsData = processMeasurements(self.measuredData, opts['startImageTiming'],
+                                                   zeroing=not opts['noZeroing'], normType=opts['normType'])
+            saveResults(os.path.join(self.dataDir, 'processed'), self.allPicsData,
+                        meta={'measureArgsStatic': self.measureArgsStatic, 'processArgs': self.processArgs,
+                              'measuredFiles': self.measuredFiles})
+            self.needMeasure = False
+            perfStats.addTime('stage.aggregate', stageStart)
+        return self.allPicsData
+    # aggregate
+
+    def append(self, watchInterval=None):
+        """Extract, measure and aggregate the scans arrived after the last measurement, in memory as with
+        fusedMeasure, and refresh "live_figure.svg" in rootPath. They belong to the last position file.
+
+        Args:
+            watchInterval (float, optional): keep checking for new scans every watchInterval minutes until
+                                             Ctrl-C. Defaults to None, only the scans already there.
+        """
+        import numpy as np
+        import matplotlib.pyplot as plt
+        from PIL import Image
+        from funcs.parseMetadata import getPositions, getPosToCrop, getMeasureInfo
+        from funcs.measureCache import saveMeasureCache, fingerprintFiles, measureKey
+        from funcs.measureImages import getImageTimes, processMeasurements
+        from funcs.subImageStack import allocateStack
+        from funcs.resultStore import saveResults
+        from funcs.plotting import plotMeasured
+        from funcs.crop import crop
+        opts = self.options
+        rootPath = self.rootPath
+        assert not self.useCroppedImg, '--append needs the "original_images" folder.'
+
+        def groupPositions(group):
+            # (posToCrop, measureInfo) of the position file of a diffPos group
+            posDict = getPositions(self.diffPosFiles[group])
+            return (getPosToCrop(posDict, self.useCroppedImg, opts['locationFromCropped']),
+                    getMeasureInfo(self.sampleInfo, posDict, opts['percentage']))
+
+        targetPaths = createFolders(rootPath, self.folders)
+        saveSubImages = opts['saveSubImages'] or not opts['fusedMeasure']
+        try:
+            while True:
+                measured = set(self.measuredFiles)
+                pending = [f for f in self.selectedFiles if f not in measured]
+                if len(pending) > 0:
+                    stageStart = perfStats.clock()
+                    # every scan with the positions of its group, the group of a new scan can be a new one
+                    scanIdx = {f: i for i, f in enumerate(self.scanFiles)}
+                    scanGroup = {f: bisect_right(self.diffPosNums, scanIdx[f]) - 1 for f in pending}
+                    positions = {group: groupPositions(group) for group in sorted(set(scanGroup.values()))}
+                    stackSlots = {}  # {group: {posName: (stackInfo, slots)}}, new frames are added to the stacks
+                    if saveSubImages and opts['subImageStore'] == 'stack':
+                        with Image.open(os.path.join(self.imgPath, pending[0])) as im:
+                            srcMode = im.mode
+                        for group, (posToCrop, _) in positions.items():
+                            groupScans = [f for f in pending if scanGroup[f] == group]
+                            stackSlots[group] = {posName: allocateStack(rootPath, posName, group, posToCrop[posName],
+                                                                        groupScans, srcMode)
+                                                 for posName in posToCrop}
+                    appendJobs = [(
+                        (os.path.join(self.imgPath, f), positions[scanGroup[f]][0], targetPaths),
+                        dict(paddingPos=self.paddingPos, resizeFactor=opts['resizeFactor'],
+                             useFileTime=not opts['noTimeFromFile'], measureInfo=positions[scanGroup[f]][1],
+                             saveSubImages=saveSubImages, draftScale=opts['lowResMeasure'],
+                             resizeProfile=opts['resizeProfile'],
+                             subImageStack={posName: (stackInfo, slots[f])
+                                            for posName, (stackInfo, slots) in stackSlots.get(scanGroup[f], {}).items()} or None,
+                             statSpec=self.statSpec)
+                    ) for f in pending]
+                    measuredPics = dict(self.runJobs(crop, appendJobs, opts['chunkSize'],
+                                                     filePaths=[args[0] for args, _ in appendJobs]))
+                    fingerprints = fingerprintFiles([os.path.join(self.imgPath, f) for f in pending], self.measureCache,
+                                                    opts['workers'])
+                    for f in pending:
+                        picPath = os.path.join(self.imgPath, f)
+                        posToCrop, measureInfo = positions[scanGroup[f]]
+                        for posName, value in measuredPics[picPath].items():
+                            key = measureKey(fingerprints[picPath], posToCrop[posName], *measureInfo[posName],
+                                             *self.draftKey, *self.statKey)
+                            self.measureCache['values'][key] = value
+                    saveMeasureCache(rootPath, self.measureCache)
+                    extracted = self.loadExtracted()
+                    if extracted != None:
+                        self.saveExtracted(extracted | set(pending))
+                    times = dict(zip(self.scanFiles, getImageTimes(self.scanFiles, self.dictOldScanTime,
+                                                                   forceUseFileNumber=opts['noTimeFromFile'],
+                                                                   fileNumberTimeInterval=opts['imageInterval'])))
+                    for posName in self.sampleInfo:
+                        # greyness, followed by the statistics if any
+                        values = np.array([np.ravel(measuredPics[os.path.join(self.imgPath, f)][posName])
+                                           for f in pending])
+                        newRows = np.column_stack(([times[f] for f in pending], values[:, 0]))
+                        self.measuredData[posName] = np.vstack((self.measuredData[posName], newRows))
+                        if self.statSpec != None:
+                            self.measuredStats[posName] = np.vstack((self.measuredStats[posName], values[:, 1:]))
+                    self.measuredFiles.extend(pending)
+                    self.allPicsData = processMeasurements(self.measuredData, opts['startImageTiming'],
+                                                           zeroing=not opts['noZeroing'], normType=opts['normType'])
+                    self.saveRaw()
+                    saveResults(os.path.join(self.dataDir, 'processed'), self.allPicsData,
+                                meta={'measureArgsStatic': self.measureArgsStatic, 'processArgs': self.processArgs,
+                              'measuredFiles': self.measuredFiles})
+                    perfStats.addTime('stage.append', stageStart)
+                    print(f'{len(pending)} new scans added, {len(self.measuredFiles)} scans in total.')
+                    fig, _ = plotMeasured(self.allPicsData, self.sampleInfo, self.allLevels[0], opts['forceNoFillBetween'],
+                                          vlines=[], vlineColours=[], timeRange=self.defaultTimeRange(),
+                                          show=False)
+                    fig.savefig(os.path.join(rootPath, 'live_figure.svg'))
+                    plt.close(fig)
+                if watchInterval == None:
+                    break
+                time.sleep(watchInterval * 60)
+                newScans = appendNewFiles(rootPath)
+                if len(newScans) > 0:
+                    self.readScanDetails()
+                    self.readRenameLog()
+                    if self.detectsDrift:
+                        self.updateDrift(len(self.scanFiles) - len(newScans))
+        except KeyboardInterrupt:
+            print('Stopped watching.')
+    # append
+
+    def plot(self, level=None, vlines=[], vlineColours=[], lowerVlines=[24, ], timeRange=None, show=False):
+        """Figure of the aggregated data, see plotMeasured()
+
+        Returns:
+            fig, plotData
+        """
+        from funcs.plotting import plotMeasured
+        timeRange = timeRange or self.defaultTimeRange()
+        return plotMeasured(self.aggregate(), self.sampleInfo, level or self.allLevels[0],
+                            self.options['forceNoFillBetween'], vlines=vlines, vlineColours=vlineColours,
+                            lowerVlines=lowerVlines, timeRange=timeRange, show=show)
+    # plot
+
+    def defaultTimeRange(self):
+        """Time range of the figures if not given, the time window if there is one"""
+        if self.options['timeWindow'] != None:
+            return tuple(self.options['timeWindow'])
+        return (self.options['startImageTiming'], self.options['endTiming'])
+    # defaultTimeRange
+
+    def plotVariants(self, levels, timeRanges, vlines=[], vlineColours=[], lowerVlines=[24, ]):
+        """One figure for every (level, time range) drawn in the pool, saved in the result folder
+
+        Returns:
+            list: paths of the figures
+        """
+        from funcs.batchPlot import variantName, plotVariant
+        resultDir = self.makeResultDir()
+        plotJobs = [((self.aggregate(), self.sampleInfo, l, os.path.join(resultDir, f'figure_{variantName(l, t)}')),
+                     dict(forceNoFillBetween=self.options['forceNoFillBetween'], vlines=vlines,
+                          vlineColours=vlineColours, lowerVlines=lowerVlines, timeRange=t))
+                    for l in levels for t in timeRanges]
+        print(f'Plotting {len(plotJobs)} figures ({len(levels)} levels, {len(timeRanges)} time ranges).')
+        with perfStats.timer('stage.plot'):
+            return self.runJobs(plotVariant, plotJobs)
+    # plotVariants
+
+    def makeResultDir(self):
+        """result_<time> folder of this run in rootPath, made on first use"""
+        if self.resultDir == None:
+            self.resultDir = os.path.join(self.rootPath, f'result_{datetime.now().strftime("%Y.%m.%d-%H.%M.%S")}')
+            os.mkdir(self.resultDir)
+        return self.resultDir
+
+    def save(self, fig=None, plotData=None, plotSettings=None, exportFormats=None, exportSubImages=False,
+             commandLine=None, copySource=False):
+        """Tables, figure, settings and sub-image manifest in the result folder
+
+        Args:
+            fig (matplotlib.figure.Figure, optional): figure to save as svg. Defaults to None.
+            plotData (pd.DataFrame, optional): data of the figure. Defaults to None.
+            plotSettings (dict, optional): {'vlines', 'vlineColours', 'lowerVlines', 'timeRange', 'level'},
+                                           written to arguments.txt for --plotArguments. Defaults to None.
+            exportFormats (list, optional): also write the tables as 'tsv' and/or 'xlsx'. Defaults to None.
+            exportSubImages (bool, optional): also copy the sub-images that cannot be hard linked into the result
+                                              folder (stacks, other file system). Defaults to False.
+            commandLine (str, optional): first lines of arguments.txt. Defaults to the options.
+            copySource (bool, optional): copy the script and funcs to the result folder. Defaults to False.
+
+        Returns:
+            str: the result folder
+        """
+        from funcs.measureCache import saveMeasureCache
+        from funcs.resultStore import saveResults, exportTables
+        from funcs.snapshot import writeManifest, exportSubImages as exportSubImageFiles
+        resultDir = self.makeResultDir()
+        allPicsData = self.aggregate().copy()
+        # the statistics of each position next to its greyness, time rebased the same way
+        statNames = self.statNames if len(self.measuredStats) > 0 else []
+        if len(statNames) > 0:
+            import pandas as pd
+            from funcs.measureImages import processStatistics
+            statData = processStatistics(self.measuredData, self.measuredStats, statNames, self.options['startImageTiming'])
+            allPicsData = pd.concat((allPicsData, statData), axis=1)
+            allPicsData = allPicsData[[c for k in self.sampleInfo for c in [k] + [f'{k}.{n}' for n in statNames]]]
+        allPicsData.columns = [f'{self.sampleInfo[k]["strain"]}_{c}' for k in self.sampleInfo
+                               for c in [k] + [f'{k}.{n}' for n in statNames]]
+        with perfStats.timer('stage.saveTables'):
+            saveResults(os.path.join(resultDir, 'allData'), allPicsData)
+            if plotData is not None:
+                saveResults(os.path.join(resultDir, 'plotData'), plotData)
+        if exportFormats != None:
+            with perfStats.timer('stage.exportTables'):
+                for table in os.listdir(resultDir):
+                    if table == 'allData' or table.endswith('plotData'):
+                        exportTables(os.path.join(resultDir, table), formats=exportFormats)
+        if fig != None:
+            fig.savefig(os.path.join(resultDir, f'figure_{datetime.now().strftime("%Y.%m.%d-%H.%M.%S")}.svg'))
+        with open(os.path.join(resultDir, 'arguments.txt'), 'w') as f:
+            f.write(commandLine or str(self.options))
+            if plotSettings != None:
+                timeRange = plotSettings['timeRange']
+                f.write(f'\n{" ".join([str(i) for i in plotSettings["vlines"]])}\t# Vertical lines')
+                f.write(f'\n{" ".join(plotSettings["vlineColours"])}\t# Vertical line colours')
+                f.write(f'\n{" ".join([str(i) for i in plotSettings["lowerVlines"]])}\t# Lower vertical lines')
+                f.write(f'\n{" ".join([str(i) for i in timeRange])}\t# Time range')
+                f.write(f'\n{plotSettings["level"]}\t# Level')
+        for f in self.diffPosFiles:
+            copy2(f, resultDir)
+        # Sub-images are listed by content hash and hard linked, extracting them again does not change the result
+        stageStart = perfStats.clock()
+        listed = writeManifest(self.rootPath, resultDir, self.measureCache, self.options['workers'])
+        if listed == 0:
+            print('subImages dir not found.')
+        else:
+            exported = exportSubImageFiles(self.rootPath, resultDir, verify=False, linkOnly=not exportSubImages)
+            if exported < listed:
+                print(f'{listed - exported} of {listed} sub-images only listed in the manifest (stacks or another file '
+                      f'system), copy them with "python -m funcs.snapshot {resultDir}".')
+        saveMeasureCache(self.rootPath, self.measureCache)
+        if copySource:
+            pathThisScript = os.path.realpath(sys.argv[0])
+            pathFuncs = os.path.dirname(os.path.realpath(__file__))
+            try:
+                copy2(pathThisScript, resultDir)
+            except FileNotFoundError:
+                print(f'Plain python script file {pathThisScript} not found.')
+            try:
+                copytree(pathFuncs, os.path.join(resultDir, 'funcs'))
+            except FileNotFoundError:
+                print(f'Sub-modules folder {pathFuncs} not found.')
+        perfStats.addTime('stage.snapshot', stageStart)
+        return resultDir
+    # save
+# Pipeline
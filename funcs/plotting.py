@@ -2,13 +2,17 @@ from collections import OrderedDict
 from itertools import cycle
 
 import matplotlib.pyplot as plt
+from matplotlib.patches import Rectangle
+from matplotlib.transforms import blended_transform_factory
 import pandas as pd
 import numpy as np
 
 
 def drawVLines(ax, li, cl, lowerVlines=[24,]):
     '''draw virtical lines on the position in li
-    color in list cl'''
+    color in list cl
+    return the artists drawn'''
+    artists = []
     yl, yh = ax.get_ylim()
     yspan = yh - yl
     for i, l in enumerate(li):
@@ -22,54 +26,75 @@ def drawVLines(ax, li, cl, lowerVlines=[24,]):
             ltop = 0.99
             tbot = yh + yspan * 0.01
             tali = 'center'
-        ax.axvline(l, color=cl[i], ymin=llow, ymax=ltop)
-        ax.text(l, tbot, f'{l}h', color=cl[i],
-                horizontalalignment=tali, fontsize=7)
+        artists.append(ax.axvline(l, color=cl[i], ymin=llow, ymax=ltop))
+        artists.append(ax.text(l, tbot, f'{l}h', color=cl[i],
+                               horizontalalignment=tali, fontsize=7))
+    return artists
 
 
-def plotMeasured(
-    allPicsData,
-    sampleInfo, # ordered dict of ordered dict
-    level, # which key word to use (usually 'strain')
-    forceNoFillBetween=False,
-    vlines=[24, 48, 96],
-    vlineColours=['k', 'b', 'r'],
-    lowerVlines=[24,],
-    timeRange=None, # eg. (0, 96)
-    defaultColours=[f'C{i}' for i in range(10)]
-):
+class MeasuredFigure:
+    """Figure of the measured data, kept alive between the rounds of the interactive loop
+
+    Group means and SEMs are computed once per level and cached. update() only redraws
+    what changed: the lines over the whole time range when the level changes, the vertical
+    lines, and the axis limits and ticks of the time range. If the window was closed, a
+    new figure is made.
+    """
 
-    fig, ax = plt.subplots(1, 1)
+    def __init__(
+        self,
+        allPicsData,
+        sampleInfo, # ordered dict of ordered dict
+        forceNoFillBetween=False,
+        defaultColours=[f'C{i}' for i in range(10)],
+    ):
+        self.allPicsData = allPicsData
+        self.sampleInfo = sampleInfo
+        self.forceNoFillBetween = forceNoFillBetween
+        self.defaultColours = defaultColours
+        self.aggregates = {}  # {level: (values, sems, labels, colours)}
+        self.newFigure()
 
-    groups = [sampleInfo[posName][level] for posName in sampleInfo]
-    uniqueGroups = []
-    plotData = allPicsData.copy(deep=True)
+    def newFigure(self):
+        """Empty figure with the parts that never change"""
+        self.fig, self.ax = plt.subplots(1, 1)
+        self.ax.spines['top'].set_visible(False)
+        self.ax.spines['right'].set_visible(False)
+        self.ax.xaxis.set_ticks_position('bottom')
+        self.ax.yaxis.set_ticks_position('left')
+        self.ax.set_xlabel('time (h)')
+        self.ax.set_ylabel('brightness')
+        self.ax.set_title('Growth pattern', y=1.04)
+        self.drawn = {}  # settings currently drawn
+        self.dataArtists = []
+        # the lines are drawn over the whole time range and clipped to the time range shown
+        self.rangeClip = Rectangle((0, 0), 1, 1, transform=blended_transform_factory(self.ax.transData, self.ax.transAxes))
+        self.vlineArtists = []
 
-    # Discard data out of time range
-    if timeRange[0] != plotData.index[0] or timeRange[1] != None:
-        timesFilter = (timeRange[0] <= plotData.index) & (plotData.index <= timeRange[1])
-        plotData = plotData.loc[timesFilter, :]
+    def aggregate(self, level):
+        """Lines of a level, over the whole time range
 
-    defaultColours = cycle(defaultColours)
+        Returns:
+            values, sems, labels, colours: values is one column per line (group means, or positions
+                                           with forceNoFillBetween), sems is None without fill
+        """
+        if level in self.aggregates:
+            return self.aggregates[level]
+        sampleInfo = self.sampleInfo
+        groups = [sampleInfo[posName][level] for posName in sampleInfo]
+        defaultColours = cycle(self.defaultColours)
+        if self.forceNoFillBetween:
+            locs = list(sampleInfo.keys())
+            values = self.allPicsData[locs].copy()
+            values.columns = [f'{g}_{locs[i]}' for i, g in enumerate(groups)]
+            self.aggregates[level] = (values, None, groups, [next(defaultColours) for _ in groups])
+            return self.aggregates[level]
 
-    if forceNoFillBetween:
-        locs = list(sampleInfo.keys())
-        for i, g in enumerate(groups):
-            ax.plot(plotData[locs[i]], label=g, c=next(defaultColours))
-        plotData.columns = [f'{g}_{locs[i]}' for i, g in enumerate(groups)]
-    else:
         # Deduplicate group keys under this level, keep order
-        groupPoses = OrderedDict()
-        for g in groups:
-            if g in uniqueGroups:
-                continue
-            uniqueGroups.append(g)
+        uniqueGroups = list(OrderedDict.fromkeys(groups))
         # Generate dictionary of group name -> position names, corresponding to the allPicsData columns to use
-        for g in uniqueGroups:
-            groupPoses[g] = []
-            for n in sampleInfo:
-                if sampleInfo[n][level] == g: groupPoses[g].append(n)
-        
+        groupPoses = OrderedDict((g, [n for n in sampleInfo if sampleInfo[n][level] == g]) for g in uniqueGroups)
+
         # Prepare colour
         colourDict = {}
         for g in groups:
@@ -80,37 +105,99 @@ def plotMeasured(
                     colourDict[g] = c
                     break
 
-        # prepare data AND plot
-        allMeans = pd.DataFrame()  # for use of output
-        allSems = pd.DataFrame()  # for use of output
-        for g in uniqueGroups:
-            means = plotData[groupPoses[g]].mean(axis=1)
-            sems = plotData[groupPoses[g]].sem(axis=1)
-            allMeans[g] = means
-            allSems[g] = sems
-            # Plot
-            ax.plot(means, label=g, c=colourDict[g])
-            if not all(pd.isna(sems)):
-                ax.fill_between(means.index, means + sems,
-                                means - sems, alpha=0.3)
-        # output
-        allMeans.columns = [f'{c}_mean' for c in allMeans.columns]
-        allSems.columns = [f'{c}_sem' for c in allSems.columns]
-        plotData = pd.concat((allMeans, allSems), axis=1)
-
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.xaxis.set_ticks_position('bottom')
-    ax.yaxis.set_ticks_position('left')
-    timeSpan = plotData.index[-1] - plotData.index[0]
-    xtickInter = timeSpan//8
-    ax.set_xticks(np.arange(int(plotData.index[0]), int(plotData.index[-1]), xtickInter))
-    ax.set_xlim([plotData.index[0] - timeSpan * 0.05, plotData.index[-1] + timeSpan * 0.05])
-    drawVLines(ax, vlines, vlineColours, lowerVlines=lowerVlines)
-    plt.xlabel('time (h)')
-    plt.ylabel('brightness')
-    plt.title('Growth pattern', y=1.04)
-    plt.legend(ncol=2, fontsize=8, framealpha=0.3)
-    plt.tight_layout()
-    plt.show()
-    return fig, plotData
+        means = pd.DataFrame({g: self.allPicsData[groupPoses[g]].mean(axis=1) for g in uniqueGroups})
+        sems = pd.DataFrame({g: self.allPicsData[groupPoses[g]].sem(axis=1) for g in uniqueGroups})
+        self.aggregates[level] = (means, sems, uniqueGroups, [colourDict[g] for g in uniqueGroups])
+        return self.aggregates[level]
+
+    def update(self, level, vlines=[], vlineColours=[], lowerVlines=[24,], timeRange=None):
+        """Draw the figure with these settings, only the parts that changed
+
+        Returns:
+            plotData: the data drawn, same as the output of plotMeasured()
+        """
+        if not plt.fignum_exists(self.fig.number):
+            self.newFigure()
+        ax = self.ax
+        if timeRange != None:
+            timeRange = tuple(timeRange)  # ranges typed in the loop are lists
+        values, sems, labels, colours = self.aggregate(level)
+
+        redrawData = self.drawn.get('level') != level
+        if redrawData:
+            for artist in self.dataArtists:
+                artist.remove()
+            self.dataArtists = []
+            for i, c in enumerate(values.columns):
+                self.dataArtists.extend(ax.plot(values[c], label=labels[i], c=colours[i]))
+                if sems is not None and not all(pd.isna(sems[c])):
+                    self.dataArtists.append(ax.fill_between(values.index, values[c] + sems[c],
+                                                            values[c] - sems[c], alpha=0.3))
+
+        # Data in the time range, for the limits and the exported plotData
+        timesFilter = np.full(len(values.index), True)
+        if timeRange != None and (timeRange[0] != values.index[0] or timeRange[1] != None):
+            timesFilter = timeRange[0] <= values.index
+            if timeRange[1] != None:
+                timesFilter &= values.index <= timeRange[1]
+        values = values.loc[timesFilter, :]
+        if sems is not None:
+            sems = sems.loc[timesFilter, :]
+
+        rescale = redrawData or self.drawn.get('timeRange') != timeRange
+        if rescale:
+            timeSpan = values.index[-1] - values.index[0]
+            self.rangeClip.set_bounds(values.index[0], 0, timeSpan, 1)
+            for artist in self.dataArtists:  # the clip path is made from the bounds when set
+                artist.set_clip_path(self.rangeClip)
+            xtickInter = max(1, timeSpan//8)
+            ax.set_xticks(np.arange(int(values.index[0]), int(values.index[-1]), xtickInter))
+            ax.set_xlim([values.index[0] - timeSpan * 0.05, values.index[-1] + timeSpan * 0.05])
+            # y limits of the lines and the filled areas, same margin as autoscale
+            low, high = values.min().min(), values.max().max()
+            if sems is not None:
+                low = min(low, (values - sems.fillna(0)).min().min())
+                high = max(high, (values + sems.fillna(0)).max().max())
+            margin = (high - low) * ax.margins()[1]
+            ax.set_ylim(low - margin, high + margin)
+
+        vlineSetup = (list(vlines), list(vlineColours), list(lowerVlines))
+        if rescale or self.drawn.get('vlines') != vlineSetup:  # placed by the y limits
+            for artist in self.vlineArtists:
+                artist.remove()
+            self.vlineArtists = drawVLines(ax, vlines, vlineColours, lowerVlines=lowerVlines)
+
+        if self.drawn.get('level') != level:
+            ax.legend(ncol=2, fontsize=8, framealpha=0.3)
+            self.fig.tight_layout()
+        self.drawn = {'level': level, 'timeRange': timeRange, 'vlines': vlineSetup}
+        self.fig.canvas.draw_idle()
+
+        if sems is None:
+            return values.copy()
+        return pd.concat((values.add_suffix('_mean'), sems.add_suffix('_sem')), axis=1)
+
+    def show(self):
+        """Show the figure without blocking, the loop can ask for the next settings"""
+        plt.show(block=False)
+        plt.pause(0.1)
+# MeasuredFigure
+
+
+def plotMeasured(
+    allPicsData,
+    sampleInfo, # ordered dict of ordered dict
+    level, # which key word to use (usually 'strain')
+    forceNoFillBetween=False,
+    vlines=[24, 48, 96],
+    vlineColours=['k', 'b', 'r'],
+    lowerVlines=[24,],
+    timeRange=None, # eg. (0, 96)
+    defaultColours=[f'C{i}' for i in range(10)],
+    show=True, # False to only return the figure, eg. for saving without display
+):
+    figure = MeasuredFigure(allPicsData, sampleInfo, forceNoFillBetween, defaultColours)
+    plotData = figure.update(level, vlines, vlineColours, lowerVlines, timeRange)
+    if show:
+        plt.show()
+    return figure.fig, plotData
@@ -0,0 +1,138 @@
+'''
+Resized images:
+
+Extraction writes the resized images in "resized" with a fast encoding profile
+(baseline JPEG, no Huffman optimisation), good enough for browsing. High quality
+versions (full decode, LANCZOS, progressive and optimised) are only made for the
+images somebody opens or exports, either on request with getHqResized() or by
+makeHqResized() in a low priority background process, into "resized_hq".
+
+The settings used for extraction are stored in resized/profile.json, so the high
+quality images can be made later without the original command line.
+'''
+
+
+import os
+import json
+
+from PIL import Image
+
+from funcs.changeName import getScanTime, naturalKey
+from funcs.crop import saveResized
+
+
+def genProfileFile(path):
+    return os.path.join(path, 'resized', 'profile.json')
+
+
+def saveResizedProfile(path, sourceDir, resizeFactor, paddingPos=None, useFileTime=True):
+    """Store the settings of the resized images in path/resized, read by makeHqResized()
+
+    Args:
+        path (str): root path of the experiment
+        sourceDir (str): folder of the images being resized (original_images or cropped_ori)
+        resizeFactor (float): factor of original size
+        paddingPos (list, optional): (x1, y1, x2, y2) cropped before resizing. Defaults to None.
+        useFileTime (bool, optional): copy the time of the original to new files. Defaults to True.
+    """
+    with open(genProfileFile(path), 'w') as f:
+        json.dump({'sourceDir': os.path.relpath(sourceDir, path), 'resizeFactor': resizeFactor,
+                   'paddingPos': paddingPos, 'useFileTime': useFileTime}, f)
+# saveResizedProfile
+
+
+def loadResizedProfile(path):
+    with open(genProfileFile(path), 'r') as f:
+        profile = json.load(f)
+    profile['sourceDir'] = os.path.join(path, profile['sourceDir'])
+    return profile
+# loadResizedProfile
+
+
+def listSources(sourceDir):
+    """{picName: path} of the images in sourceDir, listed once for all the resized images"""
+    return {os.path.splitext(file)[0]: os.path.join(sourceDir, file) for file in os.listdir(sourceDir)}
+# listSources
+
+
+def sourceOfResized(resizedName, sources):
+    """Original image of a resized image name (picName_resized.jpg), None if not found
+
+    Args:
+        resizedName (str): file name in "resized"
+        sources (dict): output of listSources()
+    """
+    return sources.get(resizedName[:-len('_resized.jpg')])
+# sourceOfResized
+
+
+def getHqResized(path, resizedName, profile=None, sources=None):
+    """Path of the high quality version of one resized image, made now if not exist
+
+    Args:
+        path (str): root path of the experiment
+        resizedName (str): file name in "resized", eg. img_001_resized.jpg
+        profile (dict, optional): output of loadResizedProfile(), read from path if None. Defaults to None.
+        sources (dict, optional): output of listSources() of the source folder, listed if None. Defaults to None.
+
+    Returns:
+        str: path to the image in "resized_hq"
+    """
+    hqFilePath = os.path.join(path, 'resized_hq', resizedName)
+    if os.path.isfile(hqFilePath):
+        return hqFilePath
+    if profile == None:
+        profile = loadResizedProfile(path)
+    if sources == None:
+        sources = listSources(profile['sourceDir'])
+    picPath = sourceOfResized(resizedName, sources)
+    assert picPath != None, f'Original image of {resizedName} not found in {profile["sourceDir"]}'
+    os.makedirs(os.path.dirname(hqFilePath), exist_ok=True)
+    with Image.open(picPath) as im:
+        iccProfile = im.info.get('icc_profile')
+        paddingPos = profile['paddingPos']
+        if paddingPos != None and not 'cropped_ori' in picPath:
+            im = im.crop(paddingPos)
+        fileTime = getScanTime(picPath) if profile['useFileTime'] else None
+        # write to a temporary name, a half written image is never taken as done
+        saveResized(im, f'{hqFilePath}_temp', profile['resizeFactor'], 'hq', iccProfile)
+    os.replace(f'{hqFilePath}_temp', hqFilePath)
+    if fileTime != None:
+        os.utime(hqFilePath, (fileTime, fileTime))
+    return hqFilePath
+# getHqResized
+
+
+def makeHqResized(path, resizedNames=None, lowPriority=True):
+    """getHqResized() of many images, skip the ones already made
+
+    Args:
+        path (str): root path of the experiment
+        resizedNames (list, optional): file names in "resized", all of them if None. Defaults to None.
+        lowPriority (bool, optional): lower the priority of this process (os.nice), meant to run
+                                      in the background while the rest is done. Defaults to True.
+
+    Returns:
+        list: paths of the high quality images
+    """
+    if lowPriority and hasattr(os, 'nice'):
+        os.nice(10)
+    profile = loadResizedProfile(path)
+    if resizedNames == None:
+        resizedNames = sorted([f for f in os.listdir(os.path.join(path, 'resized')) if f.endswith('_resized.jpg')],
+                              key=naturalKey)
+    sources = listSources(profile['sourceDir'])
+    return [getHqResized(path, name, profile, sources) for name in resizedNames]
+# makeHqResized
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Make high quality versions of the resized images in "resized_hq"')
+    parser.add_argument('rootPath', help='Path processed by extractPicAndMeasure.py')
+    parser.add_argument('resizedNames', nargs='*', help='File names in "resized", all if not given')
+    parser.add_argument('--normalPriority', action='store_true', help='Do not lower the process priority')
+    args = parser.parse_args()
+    hqFiles = makeHqResized(os.path.realpath(args.rootPath), args.resizedNames or None,
+                            lowPriority=not args.normalPriority)
+    print(f'{len(hqFiles)} high quality resized images in {os.path.join(args.rootPath, "resized_hq")}')
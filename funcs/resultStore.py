@@ -0,0 +1,138 @@
+'''
+Columnar binary storage of measurement results.
+
+A table (pandas DataFrame with a time index) is stored in its own directory:
+    time.npy    float64 time index, shape (T,)
+    values.npy  float32 values, shape (T, n columns)
+    meta.json   column names and any extra information of the run
+meta.json is written last, a table without it is incomplete and treated as missing.
+The .npy files are read with memory mapping, spreadsheets are only written by
+exportTables() when asked.
+'''
+
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def saveResults(tableDir, data, meta=None):
+    """Store a DataFrame in tableDir
+
+    Args:
+        tableDir (str): directory of the table, created if not exist
+        data (pd.DataFrame): index is time (hours), columns are positions or groups
+        meta (dict, optional): extra JSON serialisable information. Defaults to None.
+    """
+    os.makedirs(tableDir, exist_ok=True)
+    metaFile = os.path.join(tableDir, 'meta.json')
+    if os.path.isfile(metaFile):
+        os.remove(metaFile)
+    np.save(os.path.join(tableDir, 'time.npy'), np.asarray(data.index, dtype=np.float64))
+    np.save(os.path.join(tableDir, 'values.npy'), np.asarray(data.values, dtype=np.float32))
+    with open(metaFile, 'w') as f:
+        json.dump({'columns': [str(c) for c in data.columns], 'meta': meta}, f)
+# saveResults
+
+
+def loadResults(tableDir, mmap=True):
+    """Read a table stored by saveResults()
+
+    Args:
+        tableDir (str): directory of the table
+        mmap (bool, optional): memory map the arrays instead of reading them. Defaults to True.
+
+    Returns:
+        data, meta: DataFrame (None if not found) and the extra information
+    """
+    metaFile = os.path.join(tableDir, 'meta.json')
+    if not os.path.isfile(metaFile):
+        return None, None
+    mmapMode = 'r' if mmap else None
+    with open(metaFile, 'r') as f:
+        meta = json.load(f)
+    time = np.load(os.path.join(tableDir, 'time.npy'), mmap_mode=mmapMode)
+    values = np.load(os.path.join(tableDir, 'values.npy'), mmap_mode=mmapMode)
+    data = pd.DataFrame(values, index=pd.Index(time), columns=meta['columns'], copy=False)
+    return data, meta['meta']
+# loadResults
+
+
+def exportTables(tableDir, outPrefix=None, formats=('tsv', 'xlsx')):
+    """Write a stored table as spreadsheets, on demand
+
+    Args:
+        tableDir (str): directory of the table
+        outPrefix (str, optional): output path without extension. Defaults to tableDir.
+        formats (tuple, optional): any of 'tsv', 'xlsx'. Defaults to ('tsv', 'xlsx').
+
+    Returns:
+        list: paths written
+    """
+    data, _ = loadResults(tableDir)
+    assert data is not None, f'No result table found in {tableDir}'
+    if outPrefix == None:
+        outPrefix = os.path.normpath(tableDir)
+    written = []
+    if 'tsv' in formats:
+        data.to_csv(f'{outPrefix}.tsv', sep='\t')
+        written.append(f'{outPrefix}.tsv')
+    if 'xlsx' in formats:
+        data.to_excel(f'{outPrefix}.xlsx')
+        written.append(f'{outPrefix}.xlsx')
+    return written
+# exportTables
+
+
+def measuredToTable(measuredData, measuredStats=None, statNames=()):
+    """{posName: np.ndarray [len, 2]} (output of measureImgs()) to one DataFrame with a shared time index
+
+    Args:
+        measuredData (dict): {posName: np.ndarray [len, 2]}
+        measuredStats (dict, optional): {posName: np.ndarray [len, len(statNames)]}, same rows as measuredData,
+                                        columns "posName.statistic" after the one of the position. Defaults to None.
+        statNames (list, optional): output of roiStats.statNames(). Defaults to ().
+    """
+    tables = []
+    for posName, data in measuredData.items():
+        columns = [posName] + [f'{posName}.{name}' for name in statNames]
+        values = data[:, 1:] if measuredStats == None else np.column_stack((data[:, 1], measuredStats[posName]))
+        tables.append(pd.DataFrame(values, index=data[:, 0], columns=columns))
+    return pd.concat(tables, axis=1)
+# measuredToTable
+
+
+def tableToMeasured(data, statNames=()):
+    """Reverse of measuredToTable(), the positions only"""
+    statColumns = {f'{posName}.{name}' for posName in data.columns for name in statNames}
+    measuredData = {}
+    for posName in data.columns:
+        if posName in statColumns:
+            continue
+        column = data[posName].dropna()
+        measuredData[posName] = np.column_stack((column.index.values, column.values.astype(np.float64)))
+    return measuredData
+# tableToMeasured
+
+
+def tableToStats(data, statNames):
+    """Statistics of measuredToTable(), {posName: np.ndarray [len, len(statNames)]}, same rows as tableToMeasured()"""
+    measuredStats = {}
+    for posName in tableToMeasured(data, statNames):
+        rows = data[posName].notna().values
+        measuredStats[posName] = data[[f'{posName}.{name}' for name in statNames]].values[rows].astype(np.float64)
+    return measuredStats
+# tableToStats
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Export stored result tables as spreadsheets')
+    parser.add_argument('tableDirs', nargs='+', help='Directories written by saveResults(), eg. result_*/allData')
+    parser.add_argument('--formats', nargs='+', choices=['tsv', 'xlsx'], default=['tsv', 'xlsx'])
+    args = parser.parse_args()
+    for tableDir in args.tableDirs:
+        for path in exportTables(tableDir, formats=args.formats):
+            print(f'Written {path}')
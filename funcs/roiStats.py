@@ -0,0 +1,164 @@
+'''
+Statistics of the region of interest measured besides the greyness.
+
+Channels and statistics are given by name:
+
+    channels      gray, rgb (R G B), hsv (H S V), lab (L a b)
+    statistics    mean, median, std, pNN (NN-th percentile, eg. p10 p90),
+                  hist (fraction of the pixels in each of histBins equal bins of the channel range)
+
+Every (channel, statistic) is one value per frame named "channel.statistic", eg. "R.mean",
+"H.p90", "L.hist0" ... "L.hist7". They are computed from the same decoded image as the
+greyness, on the pixels in the mask of the position, for a batch of frames at once.
+
+Values are in range [0, 1] for gray, RGB and HSV, whatever the bit depth of the images (so
+"gray.mean" of an 8 bit grey image is its greyness / 255), and in the CIE Lab range for Lab
+(L 0 to 100, a and b -128 to 127, D65 white point).
+'''
+
+
+import re
+
+import numpy as np
+
+
+channelSets = {'gray': ['gray'], 'rgb': ['R', 'G', 'B'], 'hsv': ['H', 'S', 'V'], 'lab': ['L', 'a', 'b']}
+channelRanges = {'gray': (0, 1), 'R': (0, 1), 'G': (0, 1), 'B': (0, 1), 'H': (0, 1), 'S': (0, 1), 'V': (0, 1),
+                 'L': (0, 100), 'a': (-128, 128), 'b': (-128, 128)}
+# PIL modes the statistics are computed in, other images are converted to RGB
+statModes = ['L', 'RGB', 'I;16', 'I', 'F']
+# Bytes per masked pixel held by roiStatistics() with all channel sets, on top of the greyness measurement
+statBytesPerPixel = 100
+
+
+def parseStatistic(name):
+    """Check one statistic name, 'mean', 'median', 'std', 'hist' or 'pNN' with NN in [0, 100]"""
+    match = re.fullmatch(r'p([0-9]+(\.[0-9]+)?)', name)
+    if name not in ['mean', 'median', 'std', 'hist'] and (match == None or float(match.group(1)) > 100):
+        raise ValueError(f'Statistic {name} not understood, one of mean, median, std, hist or pNN (percentile)')
+    return name
+# parseStatistic
+
+
+def statSpec(statistics, channels=None, histBins=8):
+    """The statistics to measure as one hashable value, passed to the workers and part of the cache keys
+
+    Args:
+        statistics (list): statistic names, see parseStatistic()
+        channels (list, optional): keys of channelSets. Defaults to None, ['gray'].
+        histBins (int, optional): bins of 'hist'. Defaults to 8.
+
+    Returns:
+        tuple: (channels, statistics, histBins), None if there is no statistic
+    """
+    if statistics == None or len(statistics) == 0:
+        return None
+    channels = channels or ['gray']
+    unknown = [c for c in channels if c not in channelSets]
+    if len(unknown) > 0:
+        raise ValueError(f'Channels {unknown} not understood, one of {", ".join(channelSets)}')
+    if histBins < 1:
+        raise ValueError('histBins should be at least 1')
+    return (tuple(dict.fromkeys(channels)), tuple(dict.fromkeys(parseStatistic(s) for s in statistics)), int(histBins))
+# statSpec
+
+
+def statKey(spec):
+    """Extra geometry of measureKey(), nothing without statistics so cached greyness values stay valid"""
+    return () if spec == None else (('statistics', spec), )
+# statKey
+
+
+def statNames(spec):
+    """Names of the values measured with spec, in the order of roiStatistics()"""
+    if spec == None:
+        return []
+    channels, statistics, histBins = spec
+    names = []
+    for channel in [c for channelSet in channels for c in channelSets[channelSet]]:
+        for statistic in statistics:
+            if statistic == 'hist':
+                names.extend(f'{channel}.hist{i}' for i in range(histBins))
+            else:
+                names.append(f'{channel}.{statistic}')
+    return names
+# statNames
+
+
+def statPixels(im):
+    """Pixels of an opened PIL image in one of statModes
+
+    Returns:
+        pixels, mode: np.ndarray (H, W) or (H, W, 3) and its PIL mode
+    """
+    if im.mode not in statModes:
+        im = im.convert('RGB')
+    return np.asarray(im), im.mode
+# statPixels
+
+
+def rgbToHsv(rgb):
+    """Same values as skimage.color.rgb2hsv() of float RGB in [0, 1], in float32"""
+    r, g, b = np.moveaxis(rgb, -1, 0)
+    value = rgb.max(axis=-1)
+    delta = value - rgb.min(axis=-1)
+    safeDelta = np.where(delta == 0, 1, delta)
+    hue = np.where(value == r, (g - b) / safeDelta, np.where(value == g, 2 + (b - r) / safeDelta, 4 + (r - g) / safeDelta))
+    hue = np.where(delta == 0, 0, (hue / 6) % 1)
+    saturation = np.where(value == 0, 0, delta / np.where(value == 0, 1, value))
+    return np.stack((hue, saturation, value), axis=-1).astype(np.float32)
+# rgbToHsv
+
+
+def roiStatistics(pixels, mode, spec):
+    """Statistics of the pixels in the region of interest of a batch of frames, see statNames()
+
+    Args:
+        pixels (np.ndarray): (T, N) or (T, N, 3), the N pixels in the mask of T frames, eg. frames[:, mask]
+        mode (str): PIL mode of the frames, one of statModes
+        spec (tuple): output of statSpec()
+
+    Returns:
+        np.ndarray: shape (T, len(statNames(spec)))
+    """
+    channels, statistics, histBins = spec
+    scale = 65535 if mode in ['I;16', 'I'] else 1 if mode == 'F' else 255
+    unit = pixels.astype(np.float32) / scale
+    rgb = unit if unit.ndim == 3 else np.repeat(unit[..., np.newaxis], 3, axis=-1)
+    values = []  # (T, N) of every channel
+    for channelSet in channels:
+        if channelSet == 'gray':
+            values.append(unit if unit.ndim == 2 else unit @ np.array([0.2125, 0.7154, 0.0721], dtype=np.float32))
+            continue
+        if channelSet == 'rgb':
+            converted = rgb
+        elif channelSet == 'hsv':
+            converted = rgbToHsv(np.clip(rgb, 0, 1))
+        else:  # lab
+            from skimage.color import rgb2lab
+            converted = rgb2lab(np.clip(rgb, 0, 1))
+        values.extend(np.moveaxis(converted, -1, 0))
+    channelNames = [c for channelSet in channels for c in channelSets[channelSet]]
+    values = np.stack(values, axis=-1)  # (T, N, C)
+    n, pixelCount, channelCount = values.shape
+
+    # every statistic of all channels at once, {statistic: (T, C, k)}
+    reduced = {}
+    if 'mean' in statistics:
+        reduced['mean'] = values.mean(axis=1, dtype=np.float64)[..., np.newaxis]
+    if 'std' in statistics:
+        reduced['std'] = values.std(axis=1, dtype=np.float64)[..., np.newaxis]
+    percentiles = [s for s in statistics if s == 'median' or s.startswith('p')]
+    if len(percentiles) > 0:
+        q = [50 if s == 'median' else float(s[1:]) for s in percentiles]
+        quantiles = np.percentile(values, q, axis=1)  # (Q, T, C)
+        reduced.update({s: quantiles[i][..., np.newaxis] for i, s in enumerate(percentiles)})
+    if 'hist' in statistics:
+        low, high = np.array([channelRanges[c] for c in channelNames], dtype=np.float32).T
+        bins = np.clip(((values - low) / (high - low) * histBins).astype(np.int64), 0, histBins - 1)
+        # one bincount over (frame, channel, bin)
+        offsets = np.arange(n * channelCount).reshape(n, 1, channelCount) * histBins
+        counts = np.bincount((bins + offsets).ravel(), minlength=n * channelCount * histBins)
+        reduced['hist'] = counts.reshape(n, channelCount, histBins) / max(1, pixelCount)
+    return np.concatenate([reduced[s][:, c] for c in range(channelCount) for s in statistics], axis=1)
+# roiStatistics
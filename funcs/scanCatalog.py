@@ -0,0 +1,349 @@
+'''
+Catalog of the scans of an experiment, an SQLite database in the root path.
+
+One row per scan:
+    newName      name in original_images (primary key)
+    oldName      name given by the scanner (unique)
+    number       numbering of the new name, the order of the scans
+    scanTime     timestamp of the scan
+    width, height, size, mtimeNs, fingerprint
+                 image dimensions, file size and modification time, sha1 of the
+                 content, NULL until filled by fillScanDetails()
+    headerTime   capture time in the image header, NULL if there is none
+    timeSource   where headerTime comes from: 'exif' (DateTimeOriginal), 'tiff'
+                 (DateTime tag) or 'mtime' (none in the header), filled by
+                 fillScanDetails() together with the dimensions
+The state table holds isNew, True when the files carry their new names.
+
+Names and time ranges are indexed, scans are added as they arrive. A catalog is
+made from the nameTimeLog.pickle of experiments renamed before, when first opened.
+
+    python -m funcs.scanCatalog path/to/experiment --start "2021-03-01 12:00" --end "2021-03-02"
+'''
+
+
+import os
+import re
+import pickle
+import pathlib
+import sqlite3
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+schema = '''
+CREATE TABLE IF NOT EXISTS scans (
+    newName TEXT PRIMARY KEY,
+    oldName TEXT NOT NULL UNIQUE,
+    number INTEGER NOT NULL,
+    scanTime REAL NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER,
+    mtimeNs INTEGER,
+    fingerprint TEXT,
+    headerTime REAL,
+    timeSource TEXT
+);
+CREATE INDEX IF NOT EXISTS scansNumber ON scans (number);
+CREATE INDEX IF NOT EXISTS scansTime ON scans (scanTime);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+'''
+scanColumns = ['newName', 'oldName', 'number', 'scanTime', 'width', 'height', 'size', 'mtimeNs', 'fingerprint',
+               'headerTime', 'timeSource']
+timeSources = ['auto', 'header', 'file']
+
+
+def genCatalogFile(path):
+    return os.path.join(path, 'scanCatalog.sqlite')
+
+
+def genLegacyLogFile(path):
+    return os.path.join(path, 'nameTimeLog.pickle')
+
+
+def catalogExists(path):
+    """True if the scans in path are renamed before (a catalog with scans or the log of earlier versions).
+    The catalog is opened read only, a failed first renaming leaves an empty one behind."""
+    if os.path.isfile(genLegacyLogFile(path)):
+        return True
+    catalogFile = genCatalogFile(path)
+    if not os.path.isfile(catalogFile):
+        return False
+    connection = sqlite3.connect(f'{pathlib.Path(os.path.abspath(catalogFile)).as_uri()}?mode=ro', uri=True)
+    try:
+        return connection.execute('SELECT COUNT(*) FROM scans').fetchone()[0] > 0
+    except sqlite3.OperationalError:  # no scans table
+        return False
+    finally:
+        connection.close()
+
+
+def scanNumber(newName):
+    """Numbering at the end of a new name, eg. 12 of img_012.jpg"""
+    return int(re.findall(r'[0-9]+$', os.path.splitext(newName)[0])[-1])
+
+
+class ScanCatalog:
+    """Connection to the catalog of the scans in path, created if not exist
+
+    Use one per thread or process, eg. with ScanCatalog(path) as catalog: ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(genCatalogFile(path))
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.executescript(schema)
+            # catalogs made before the header times
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(scans)')]
+            for column, columnType in [('headerTime', 'REAL'), ('timeSource', 'TEXT')]:
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE scans ADD COLUMN {column} {columnType}')
+        if len(self) == 0 and os.path.isfile(genLegacyLogFile(path)):
+            self.importLegacyLog()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM scans').fetchone()[0]
+
+    def importLegacyLog(self):
+        """Scans in nameTimeLog.pickle, the rename log of earlier versions"""
+        with open(genLegacyLogFile(self.path), 'rb') as f:
+            dictOld2New, dictOldScanTime, isNew = pickle.load(f)
+        self.addScans([(oldName, newName, dictOldScanTime[newName], None) for oldName, newName in dictOld2New.items()],
+                      isNew)
+        print(f'Scan catalog made from {genLegacyLogFile(self.path)} ({len(dictOld2New)} scans).')
+
+    @property
+    def isNew(self):
+        row = self.connection.execute("SELECT value FROM state WHERE key = 'isNew'").fetchone()
+        return row != None and row[0] == '1'
+
+    def addScans(self, scans, isNew=None):
+        """Add scans, the ones already in the catalog are left as they are. One transaction.
+
+        Args:
+            scans (list): [(old name, new name, scan time, file size or None), ...]
+            isNew (bool, optional): set the state of the names as well. Defaults to None, not changed.
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO scans (oldName, newName, number, scanTime, size) VALUES (?, ?, ?, ?, ?)',
+                [(oldName, newName, scanNumber(newName), scanTime, size) for oldName, newName, scanTime, size in scans])
+            if isNew != None:
+                self.connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('isNew', ?)",
+                                        ('1' if isNew else '0', ))
+
+    def names(self):
+        """[(old name, new name), ...] in the order of the scans"""
+        return [tuple(row) for row in self.connection.execute('SELECT oldName, newName FROM scans ORDER BY number')]
+
+    def dictOldScanTime(self):
+        """{new name: scan time}, the file modification times recorded when renamed"""
+        return dict(self.connection.execute('SELECT newName, scanTime FROM scans').fetchall())
+
+    def scanTimes(self, timeSource='auto'):
+        """Timestamps of the scans
+
+        Args:
+            timeSource (str, optional): 'file' - modification times recorded when renamed,
+                                        'header' - capture times in the image headers, the file time
+                                                   of the scans without one,
+                                        'auto' - header times if every scan has one, file times otherwise.
+                                        Defaults to 'auto'.
+
+        Returns:
+            times, source: {new name: timestamp}, 'header' or 'file' (mixed 'header' times count as 'header')
+        """
+        assert timeSource in timeSources, f'timeSource should be one of {timeSources}, {timeSource} found.'
+        if timeSource == 'auto':
+            withoutHeader = self.connection.execute('SELECT COUNT(*) FROM scans WHERE headerTime IS NULL').fetchone()[0]
+            timeSource = 'header' if withoutHeader == 0 and len(self) > 0 else 'file'
+        if timeSource == 'file':
+            return self.dictOldScanTime(), 'file'
+        query = 'SELECT newName, COALESCE(headerTime, scanTime) FROM scans'
+        return dict(self.connection.execute(query).fetchall()), 'header'
+
+    def timeSourceCounts(self):
+        """{'exif': n, 'tiff': n, 'mtime': n}, scans not read yet are left out"""
+        query = 'SELECT timeSource, COUNT(*) FROM scans WHERE timeSource IS NOT NULL GROUP BY timeSource'
+        return dict(self.connection.execute(query).fetchall())
+
+    def lastScan(self):
+        row = self.connection.execute('SELECT * FROM scans ORDER BY number DESC LIMIT 1').fetchone()
+        return None if row == None else dict(row)
+
+    def lookup(self, name):
+        """Scan with this old or new name
+
+        Returns:
+            dict: {column: value}, None if not found
+        """
+        row = self.connection.execute('SELECT * FROM scans WHERE oldName = ? UNION ALL '
+                                      'SELECT * FROM scans WHERE newName = ? LIMIT 1', (name, name)).fetchone()
+        return None if row == None else dict(row)
+
+    def index(self, name):
+        """Position of the scan with this old or new name in the order of the scans, None if not found"""
+        scan = self.lookup(name)
+        if scan == None:
+            return None
+        return self.connection.execute('SELECT COUNT(*) FROM scans WHERE number < ?', (scan['number'], )).fetchone()[0]
+
+    def scans(self, start=None, end=None):
+        """Scans taken between start and end (timestamps, both included, None for no limit), by time
+
+        Returns:
+            list: [{column: value}, ...]
+        """
+        query = 'SELECT * FROM scans WHERE scanTime >= ? AND scanTime <= ? ORDER BY scanTime'
+        limits = (float('-inf') if start == None else start, float('inf') if end == None else end)
+        return [dict(row) for row in self.connection.execute(query, limits)]
+
+    def missingDetails(self, fingerprints=False):
+        """New names of the scans without dimensions and header time (or fingerprint)"""
+        condition = 'width IS NULL OR timeSource IS NULL'
+        if fingerprints:
+            condition += ' OR fingerprint IS NULL'
+        return [row[0] for row in self.connection.execute(f'SELECT newName FROM scans WHERE {condition} ORDER BY number')]
+
+    def setDetails(self, details):
+        """Store details of scans
+
+        Args:
+            details (dict): {new name: {column: value}}, any of width, height, size, mtimeNs, fingerprint,
+                            headerTime, timeSource
+        """
+        with self.connection:
+            for newName, values in details.items():
+                columns = [c for c in values if c in scanColumns[4:]]
+                if len(columns) == 0:
+                    continue
+                self.connection.execute(f'UPDATE scans SET {", ".join(f"{c} = ?" for c in columns)} WHERE newName = ?',
+                                        [values[c] for c in columns] + [newName])
+# ScanCatalog
+
+
+def parseHeaderTime(dateTime, subSec=None, offset=None):
+    """Timestamp of an EXIF/TIFF date "YYYY:MM:DD HH:MM:SS", local time unless offset ("+02:00") is given"""
+    dateTime = str(dateTime).strip('\x00 ')
+    if offset != None and re.fullmatch(r'[+-][0-9]{2}:[0-9]{2}', str(offset).strip('\x00 ')):
+        timestamp = datetime.strptime(dateTime + str(offset).strip('\x00 '), '%Y:%m:%d %H:%M:%S%z').timestamp()
+    else:
+        timestamp = datetime.strptime(dateTime, '%Y:%m:%d %H:%M:%S').timestamp()
+    subSec = str(subSec).strip('\x00 ') if subSec != None else ''
+    if subSec.isdigit():
+        timestamp += float(f'0.{subSec}')
+    return timestamp
+# parseHeaderTime
+
+
+def readHeaderTime(im):
+    """Capture time in the header of an opened image, the pixels are not decoded
+
+    Returns:
+        headerTime, timeSource: timestamp (None if not found) and 'exif', 'tiff' or 'mtime'
+    """
+    exif = im.getexif()
+    exifIfd = exif.get_ifd(0x8769)
+    # DateTimeOriginal with SubsecTimeOriginal and OffsetTimeOriginal, then DateTime with SubsecTime and OffsetTime
+    for ifd, (dateTag, subSecTag, offsetTag), source in [(exifIfd, (36867, 37521, 36881), 'exif'),
+                                                         (exif, (306, 37520, 36880), 'tiff')]:
+        if ifd.get(dateTag) == None:
+            continue
+        try:
+            return parseHeaderTime(ifd[dateTag], exifIfd.get(subSecTag), exifIfd.get(offsetTag)), source
+        except ValueError:
+            pass  # empty or malformed date
+    return None, 'mtime'
+# readHeaderTime
+
+
+def readScanDetails(filePath, fingerprint=False):
+    """Dimensions and capture time from the image header (not decoded), size and modification time,
+    sha1 if asked"""
+    from PIL import Image
+    st = os.stat(filePath)
+    details = {'size': st.st_size, 'mtimeNs': st.st_mtime_ns, 'headerTime': None, 'timeSource': 'mtime'}
+    try:
+        with Image.open(filePath) as im:
+            details['width'], details['height'] = im.size
+            details['headerTime'], details['timeSource'] = readHeaderTime(im)
+    except Exception as e:
+        print(f'Header of {filePath} not readable ({e})')
+    if fingerprint:
+        from funcs.measureCache import fileFingerprint
+        details['fingerprint'] = fileFingerprint(filePath)
+    return details
+# readScanDetails
+
+
+def fillScanDetails(path, imgDir=None, fingerprints=False, workers=None, executor=None, chunkSize=64):
+    """Read the details of the scans missing them, in parallel threads, or in a process pool if given
+
+    Args:
+        path (str): root path of the experiment
+        imgDir (str, optional): folder of the scans. Defaults to original_images in path.
+        fingerprints (bool, optional): hash the content as well. Defaults to False.
+        workers (int, optional): number of threads. Defaults to None.
+        executor (concurrent.futures.Executor, optional): pool to read the headers in,
+                                                          see runChunked(). Defaults to None.
+        chunkSize (int, optional): scans sent to a worker of the executor together. Defaults to 64.
+
+    Returns:
+        int: number of scans filled
+    """
+    if imgDir == None:
+        imgDir = os.path.join(path, 'original_images')
+    with ScanCatalog(path) as catalog:
+        newNames = [n for n in catalog.missingDetails(fingerprints) if os.path.isfile(os.path.join(imgDir, n))]
+        if len(newNames) == 0:
+            return 0
+        if executor != None:
+            from funcs.misc import runChunked
+            details = runChunked(executor, readScanDetails,
+                                 [((os.path.join(imgDir, n), fingerprints), {}) for n in newNames], chunkSize)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as threadPool:
+                details = list(threadPool.map(lambda n: readScanDetails(os.path.join(imgDir, n), fingerprints), newNames))
+        catalog.setDetails(dict(zip(newNames, details)))
+    return len(newNames)
+# fillScanDetails
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=__doc__)
+    parser.add_argument('path', help='Path to the experiment')
+    parser.add_argument('--name', help='Show the scan with this old or new name')
+    parser.add_argument('--start', help='Scans taken from this time, eg. "2021-03-01 12:00"')
+    parser.add_argument('--end', help='Scans taken until this time')
+    parser.add_argument('--fill', action='store_true',
+                        help='Read the dimensions, header times and fingerprints of the scans missing them')
+    args = parser.parse_args()
+
+    if args.fill:
+        print(f'{fillScanDetails(args.path, fingerprints=True)} scans filled.')
+    with ScanCatalog(args.path) as catalog:
+        if args.name != None:
+            found = catalog.lookup(args.name)
+            scans = [] if found == None else [found]
+        else:
+            scans = catalog.scans(*[None if t == None else datetime.fromisoformat(t).timestamp() for t in (args.start, args.end)])
+    print('\t'.join(scanColumns))
+    for scan in scans:
+        for c in ['scanTime', 'headerTime']:
+            if scan[c] != None:
+                scan[c] = datetime.fromtimestamp(scan[c]).isoformat(sep=' ', timespec='seconds')
+        print('\t'.join(str(scan[c]) for c in scanColumns))
+    print(f'{len(scans)} scans')
@@ -0,0 +1,135 @@
+'''
+Result snapshots of sub-images:
+
+A result_* folder does not copy the "subImages" folder. Instead it gets
+subImages_manifest.tsv, the relative path, size and content hash (sha1) of every
+sub-image at the time the result was saved. Hashes are remembered in the
+measurement cache, so only new or changed files are read.
+
+The sub-image files are hard linked into the result folder when the file system
+allows, so a result keeps its sub-images after they are extracted again (the
+"subImages" folder is removed, the linked files are not). Stacks (.u8) grow in place
+in append mode, they are never linked. Copies of stacks and of files on another file
+system are only made when asked for, by exportSubImages() (--exportSubImages, or
+"python -m funcs.snapshot result_*").
+'''
+
+
+import os
+from shutil import copy2
+
+from funcs.changeName import naturalKey
+from funcs.measureCache import fingerprintFiles
+
+
+def genManifestFile(resultDir):
+    return os.path.join(resultDir, 'subImages_manifest.tsv')
+
+
+def writeManifest(path, resultDir, cache=None, workers=None):
+    """List every file in path/subImages with its content hash in resultDir
+
+    Args:
+        path (str): root path of the experiment
+        resultDir (str): result folder
+        cache (dict, optional): output of loadMeasureCache(), hashes are reused and added. Defaults to None.
+        workers (int, optional): number of threads hashing files. Defaults to None.
+
+    Returns:
+        int: number of files listed, 0 if there is no subImages folder
+    """
+    subImagesDir = os.path.join(path, 'subImages')
+    filePaths = []
+    for root, _, files in os.walk(subImagesDir):
+        filePaths.extend(os.path.join(root, f) for f in files)
+    if len(filePaths) == 0:
+        return 0
+    filePaths.sort(key=naturalKey)
+    fingerprints = fingerprintFiles(filePaths, cache, workers)
+    with open(genManifestFile(resultDir), 'w') as f:
+        f.write('file\tsize\tsha1\n')
+        for filePath in filePaths:
+            f.write(f'{os.path.relpath(filePath, path)}\t{os.path.getsize(filePath)}\t{fingerprints[filePath]}\n')
+    return len(filePaths)
+# writeManifest
+
+
+def readManifest(resultDir):
+    """[(relative path, size, sha1), ...] of a result folder"""
+    entries = []
+    with open(genManifestFile(resultDir), 'r') as f:
+        next(f)
+        for line in f:
+            relPath, size, sha1 = line.rstrip('\n').split('\t')
+            entries.append((relPath, int(size), sha1))
+    return entries
+# readManifest
+
+
+def linkOrCopy(src, dst, copy=True):
+    """Hard link src to dst, copy if linking is not possible (other file system, FAT, ...)
+
+    Returns:
+        bool: False if not linked and copy is False
+    """
+    if not src.endswith('.u8'):
+        try:
+            os.link(src, dst)
+            return True
+        except OSError:
+            pass
+    if not copy:
+        return False
+    copy2(src, dst)
+    return True
+# linkOrCopy
+
+
+def exportSubImages(path, resultDir, verify=True, cache=None, linkOnly=False):
+    """Put the sub-images listed in the manifest of resultDir into resultDir/subImages
+
+    Args:
+        path (str): root path of the experiment, holding the current "subImages"
+        resultDir (str): result folder with subImages_manifest.tsv
+        verify (bool, optional): skip files that changed since the result was saved. Defaults to True.
+        cache (dict, optional): output of loadMeasureCache() for the hashes. Defaults to None.
+        linkOnly (bool, optional): only the files that can be hard linked, nothing is copied. Defaults to False.
+
+    Returns:
+        int: number of files exported
+    """
+    entries = readManifest(resultDir)
+    if verify:
+        fingerprints = fingerprintFiles([os.path.join(path, e[0]) for e in entries
+                                         if os.path.isfile(os.path.join(path, e[0]))], cache)
+    exported = 0
+    for relPath, _, sha1 in entries:
+        src = os.path.join(path, relPath)
+        dst = os.path.join(resultDir, relPath)
+        if not os.path.isfile(src):
+            print(f'{relPath} not found, skipped.')
+            continue
+        if verify and fingerprints[src] != sha1:
+            print(f'{relPath} changed since the result was saved, skipped.')
+            continue
+        if os.path.isfile(dst):
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        exported += linkOrCopy(src, dst, copy=not linkOnly)
+    return exported
+# exportSubImages
+
+
+if __name__ == '__main__':
+    import argparse
+    from funcs.measureCache import loadMeasureCache, saveMeasureCache
+    parser = argparse.ArgumentParser(description='Export the sub-images of saved results into their result folders')
+    parser.add_argument('resultDirs', nargs='+', help='result_* folders with subImages_manifest.tsv')
+    parser.add_argument('--noVerify', action='store_true', help='Do not check the content hashes')
+    args = parser.parse_args()
+    for resultDir in args.resultDirs:
+        path = os.path.dirname(os.path.realpath(resultDir))
+        cache = loadMeasureCache(path)
+        n = exportSubImages(path, resultDir, verify=not args.noVerify, cache=cache)
+        saveMeasureCache(path, cache)
+        print(f'{n} sub-images exported to {os.path.join(resultDir, "subImages")}')
@@ -0,0 +1,208 @@
+'''
+Sub-images stored as stacks:
+
+Instead of one image file per (scan, position), all sub-images of a position are
+stored in one raw uint8 file per position file (diffPos group), frames in the
+order of the scans:
+
+    subImages/posName/group0.u8    frames of shape (height, width[, 3])
+    subImages/posName/index.json   shape, mode and the scan name of every frame
+
+Slots are assigned in the main process, the file is grown before the worker
+processes write the frame of the image they crop. Writing and measuring are then
+a few large sequential reads and writes instead of an open/stat/utime per image.
+Frames keep the pixels of the original (no re-encoding), only 8 bit images are
+supported.
+'''
+
+
+import os
+import json
+
+import numpy as np
+
+from funcs import perfStats
+from funcs.changeName import naturalKey
+from funcs.misc import runChunked
+from funcs.measureImages import getRoiMask, measureStack, getImageTimes, splitStatistics
+from funcs.roiStats import roiStatistics, statNames
+
+
+# Bytes per pixel of a frame held by measureStackFrames(): raw RGB, its float copy and the grey frame
+stackBytesPerPixel = 35
+
+
+def genIndexFile(path, posName):
+    return os.path.join(path, 'subImages', posName, 'index.json')
+
+
+def loadStackIndex(path, posName):
+    """Index of the stacks of one position, {'groups': {}} if nothing stored"""
+    indexFile = genIndexFile(path, posName)
+    if not os.path.isfile(indexFile):
+        return {'groups': {}}
+    with open(indexFile, 'r') as f:
+        return json.load(f)
+# loadStackIndex
+
+
+def allocateStack(path, posName, group, box, names, mode):
+    """Reserve a frame for each scan in names in the stack of (posName, group)
+
+    Args:
+        path (str): root path of the experiment
+        posName (str): position name
+        group (int): index of the position file (diffPos group)
+        box (tuple): (x1, y1, x2, y2) crop box of this position in this group
+        names (list): scan names (new names) of the frames, already stored ones keep their slot
+        mode (str): PIL mode of the original images, 'L' is stored as one channel, others as RGB
+
+    Returns:
+        stackInfo, slots: stackInfo is passed to writeStackFrame(), slots is {name: slot}
+    """
+    assert mode in ['L', 'RGB', 'RGBA', 'P', 'CMYK'], f'Sub-image stacks only support 8 bit images, {mode} found.'
+    mode = 'L' if mode == 'L' else 'RGB'
+    shape = [int(box[3] - box[1]), int(box[2] - box[0])] + ([] if mode == 'L' else [3])
+    index = loadStackIndex(path, posName)
+    stackDir = os.path.dirname(genIndexFile(path, posName))
+    os.makedirs(stackDir, exist_ok=True)
+    entry = index['groups'].get(str(group))
+    if entry == None or entry['shape'] != shape or entry['mode'] != mode:
+        entry = {'file': f'group{group}.u8', 'shape': shape, 'mode': mode, 'names': []}
+        framesFile = os.path.join(stackDir, entry['file'])
+        if os.path.isfile(framesFile):
+            os.remove(framesFile)
+    stored = set(entry['names'])
+    entry['names'].extend(name for name in names if name not in stored)
+    index['groups'][str(group)] = entry
+    stackInfo = {'file': os.path.join(stackDir, entry['file']), 'shape': tuple(shape), 'mode': mode,
+                 'length': len(entry['names'])}
+    with open(stackInfo['file'], 'ab') as f:
+        f.truncate(stackInfo['length'] * int(np.prod(shape)))
+    indexFile = genIndexFile(path, posName)
+    with open(f'{indexFile}_temp', 'w') as f:
+        json.dump(index, f)
+    os.replace(f'{indexFile}_temp', indexFile)
+    slotOf = {name: slot for slot, name in enumerate(entry['names'])}
+    return stackInfo, {name: slotOf[name] for name in names}
+# allocateStack
+
+
+def openStack(stackInfo, mode='r'):
+    """Memory map all frames of a stack, shape (length, height, width[, 3])"""
+    return np.memmap(stackInfo['file'], dtype=np.uint8, mode=mode,
+                     shape=(stackInfo['length'], ) + tuple(stackInfo['shape']))
+# openStack
+
+
+def writeStackFrame(stackInfo, slot, im):
+    """Store one cropped PIL image in its slot, can run in a worker process"""
+    if im.mode != stackInfo['mode']:
+        im = im.convert(stackInfo['mode'])
+    frames = openStack(stackInfo, 'r+')
+    frames[slot] = np.asarray(im)
+    frames.flush()
+# writeStackFrame
+
+
+def stackToGray(frames, mode):
+    """Same grey values as imageToGray() of each frame, (T, H, W)"""
+    if mode == 'L':
+        return frames
+    return frames @ (np.array([0.2125, 0.7154, 0.0721]) / 255)
+# stackToGray
+
+
+def measureStackFrames(stackInfo, start, stop, measureType='centreDisk', percentage=1.0, polygon=None, statSpec=None):
+    """Measure frames [start, stop) of a stack, can run in a worker process
+
+    Returns:
+        np.ndarray: measured values. With statSpec (roiStats.statSpec()), shape (stop - start,
+                    1 + number of statistics), the greyness in the first column.
+    """
+    batchStart = perfStats.clock()
+    with perfStats.timer('measure.readStack'):
+        frames = np.array(openStack(stackInfo)[start:stop])
+    mask = getRoiMask(stackInfo['shape'], measureType, percentage, polygon)
+    with perfStats.timer('measure.reduce'):
+        values = measureStack(stackToGray(frames, stackInfo['mode']), mask)
+    if statSpec != None:
+        with perfStats.timer('measure.statistics'):
+            values = np.column_stack((values, roiStatistics(frames[:, mask], stackInfo['mode'], statSpec)))
+    perfStats.count('measure.frames', len(frames))
+    perfStats.addSample('measure.frame', (perfStats.clock() - batchStart) / max(1, len(frames)), len(frames))
+    return values
+# measureStackFrames
+
+
+def measureStacks(
+    executor,
+    path,
+    groupMeasureInfo,
+    dictOldScanTime=None,
+    forceUseFileNumber=False,
+    fileNumberTimeInterval=1,
+    framesPerJob=256,
+    chunkSize=1,
+    scanNames=None,
+    statSpec=None
+):
+    """Measure the sub-image stacks of every position, in parallel by position and chunks of frames
+
+    Args:
+        executor (concurrent.futures.Executor): process pool shared by the run
+        path (str): root path of the experiment
+        groupMeasureInfo (list): output of getMeasureInfo() for each position file (diffPos group)
+        framesPerJob (int, optional): Number of frames measured in one job. Defaults to 256.
+        chunkSize (int, optional): Number of jobs sent to a worker together. Defaults to 1.
+        scanNames (list, optional): Only measure the frames of these scans. Defaults to None, all.
+        Other arguments are the same as measureImgs().
+
+    Returns:
+        measuredData: {posName: np.ndarray [len, 2]}, rows in the order of the scans.
+                      With statSpec, (measuredData, measuredStats), see splitStatistics().
+    """
+    if scanNames != None:
+        scanNames = set(scanNames)
+    jobs = []  # [(args, kwargs), ...]
+    jobTargets = []  # [posName, ...] same order as jobs
+    names = {}  # {posName: [scan name, ...]}
+    for posName in groupMeasureInfo[0]:
+        index = loadStackIndex(path, posName)
+        names[posName] = []
+        for group in sorted(index['groups'], key=int):
+            entry = index['groups'][group]
+            measureType, percentage, polygon = groupMeasureInfo[int(group)][posName]
+            stackInfo = {'file': os.path.join(os.path.dirname(genIndexFile(path, posName)), entry['file']),
+                         'shape': tuple(entry['shape']), 'mode': entry['mode'], 'length': len(entry['names'])}
+            slots = range(stackInfo['length'])
+            if scanNames != None:
+                slots = [slot for slot, name in enumerate(entry['names']) if name in scanNames]
+            # runs of consecutive frames, at most framesPerJob long
+            runStart = 0
+            for i in range(1, len(slots) + 1):
+                if i == len(slots) or slots[i] != slots[i - 1] + 1 or i - runStart == framesPerJob:
+                    jobs.append(((stackInfo, slots[runStart], slots[i - 1] + 1, measureType, percentage, polygon),
+                                 dict(statSpec=statSpec)))
+                    jobTargets.append(posName)
+                    runStart = i
+            names[posName].extend(entry['names'][slot] for slot in slots)
+        print(f'{posName}: {len(names[posName])} frames to measure.')
+    results = runChunked(executor, measureStackFrames, jobs, chunkSize)
+    values = {posName: [] for posName in names}
+    for posName, result in zip(jobTargets, results):
+        values[posName].append(result)
+    measuredData = {}
+    for posName in names:
+        order = sorted(range(len(names[posName])), key=lambda i: naturalKey(names[posName][i]))
+        posNames = [names[posName][i] for i in order]
+        posValues = np.concatenate(values[posName])[order] if len(order) > 0 else \
+            np.zeros((0, 1 + len(statNames(statSpec))))
+        times = getImageTimes(posNames, dictOldScanTime,
+                              forceUseFileNumber=forceUseFileNumber,
+                              fileNumberTimeInterval=fileNumberTimeInterval)
+        measuredData[posName] = np.column_stack((times, posValues))
+    if statSpec != None:
+        return splitStatistics(measuredData)
+    return measuredData
+# measureStacks
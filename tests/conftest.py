@@ -0,0 +1,61 @@
+'''
+Shared fixtures of the tests: small synthetic experiments (benchmarks/syntheticScans.py)
+and a pipeline run on them in this process, without figures or questions.
+
+    python -m pytest -q
+'''
+
+
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from benchmarks.syntheticScans import makeDataset
+
+
+@pytest.fixture
+def experiment(tmp_path):
+    """Factory of synthetic experiments in tmp_path, returns (rootPath, first position file, diffPos)"""
+    count = [0]
+
+    def make(frames=6, positions=3, measureTypes=('centreDisk', 'square', 'polygon'), scanSize=(320, 240), **kwargs):
+        count[0] += 1
+        path = str(tmp_path / f'experiment{count[0]}')
+        dataset = makeDataset(path, scanSize=scanSize, frames=frames, positions=positions,
+                              measureTypes=measureTypes, **kwargs)
+        return path, dataset['sampleInfo'], dataset['diffPos']
+    return make
+
+
+@pytest.fixture
+def runPipeline():
+    """Rename, extract, measure and aggregate an experiment with one worker, returns the Pipeline"""
+    from funcs.pipeline import Pipeline
+
+    def run(path, sampleInfo, diffPos=None, **options):
+        options.setdefault('workers', 1)
+        pipeline = Pipeline(path, sampleInfo, diffPos or None, **options)
+        try:
+            pipeline.rename()
+            pipeline.extract()
+            pipeline.measure()
+            pipeline.aggregate()
+        finally:
+            pipeline.close()
+        return pipeline
+    return run
+
+
+def rawValues(path):
+    """{posName: np.ndarray [len, 2]} of the raw table of a measured experiment, without the statistics"""
+    from funcs.resultStore import loadResults, tableToMeasured
+    data, meta = loadResults(os.path.join(path, 'measuredData', 'raw'), mmap=False)
+    return tableToMeasured(data, meta.get('statNames', []))
+
+
+@pytest.fixture
+def readRaw():
+    return rawValues
@@ -0,0 +1,181 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+from funcs.changeName import changeFileName, appendNewFiles, checkRenamePlan, loadJournal, resumeRename, rollbackRename
+from funcs.scanCatalog import ScanCatalog, catalogExists
+
+t0 = 1.6e9
+repoPath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def writeScans(path, numbers, prefix='Image_'):
+    """Small scans named as by the scanner, an hour apart, {name: modification time}"""
+    os.makedirs(path, exist_ok=True)
+    times = {}
+    for n in numbers:
+        fileName = f'{prefix}{n}.jpg'
+        Image.new('RGB', (8, 8), (n, n, n)).save(os.path.join(path, fileName))
+        times[fileName] = t0 + n * 3600
+        os.utime(os.path.join(path, fileName), (times[fileName], times[fileName]))
+    return times
+
+
+# numbering starts at 0
+renamed = [os.path.join('original_images', f'Image_{n:02d}.jpg') for n in range(11)]
+
+
+def listFiles(path):
+    return sorted(os.path.relpath(os.path.join(folder, f), path) for folder, _, files in os.walk(path) for f in files
+                  if f.endswith('.jpg'))
+
+
+def interruptAfter(monkeypatch, renames):
+    """os.rename fails after this many renames, as if the run was killed"""
+    rename = os.rename
+    count = [0]
+
+    def interrupted(src, dst):
+        if count[0] == renames:
+            raise OSError('interrupted')
+        count[0] += 1
+        rename(src, dst)
+    monkeypatch.setattr(os, 'rename', interrupted)
+
+
+def test_renameAndRevert(tmp_path):
+    path = str(tmp_path)
+    times = writeScans(path, range(1, 12))
+    changeFileName(path)
+    assert listFiles(path) == renamed
+    with ScanCatalog(path) as catalog:
+        assert catalog.isNew
+        assert catalog.names()[:2] == [('Image_1.jpg', 'Image_00.jpg'), ('Image_2.jpg', 'Image_01.jpg')]
+        assert catalog.dictOldScanTime()['Image_09.jpg'] == times['Image_10.jpg']
+    assert loadJournal(path) == None
+
+    # a second run gives the files their names and times back
+    changeFileName(path)
+    assert listFiles(path) == sorted(times)
+    assert not os.path.isdir(os.path.join(path, 'original_images'))
+    assert all(os.stat(os.path.join(path, f)).st_mtime == t for f, t in times.items())
+    with ScanCatalog(path) as catalog:
+        assert not catalog.isNew
+
+
+def test_resumeInterrupted(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    writeScans(path, range(1, 12))
+    interruptAfter(monkeypatch, 4)
+    with pytest.raises(OSError):
+        changeFileName(path)
+    monkeypatch.undo()
+    assert len(os.listdir(os.path.join(path, 'original_images'))) == 4
+    assert len(loadJournal(path)['plan']) == 11
+    # the catalog is only updated when all files are renamed
+    with ScanCatalog(path) as catalog:
+        assert len(catalog) == 0
+
+    # the next run finishes the renaming instead of reverting it
+    changeFileName(path)
+    assert listFiles(path) == renamed
+    assert loadJournal(path) == None
+    with ScanCatalog(path) as catalog:
+        assert len(catalog) == 11 and catalog.isNew
+    assert not resumeRename(path)
+
+
+def test_rollbackInterrupted(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    times = writeScans(path, range(1, 12))
+    changeFileName(path)
+    interruptAfter(monkeypatch, 5)
+    with pytest.raises(OSError):
+        changeFileName(path)  # back to the scanner names
+    monkeypatch.undo()
+    assert rollbackRename(path)
+    assert listFiles(path) == renamed
+    with ScanCatalog(path) as catalog:
+        assert catalog.isNew
+    assert not rollbackRename(path)
+
+    # a fresh renaming undone from the command line
+    freshPath = str(tmp_path / 'fresh')
+    writeScans(freshPath, range(1, 12))
+    interruptAfter(monkeypatch, 3)
+    with pytest.raises(OSError):
+        changeFileName(freshPath)
+    monkeypatch.undo()
+    subprocess.run([sys.executable, '-m', 'funcs.changeName', freshPath, '--rollback'], cwd=repoPath, check=True,
+                   capture_output=True)
+    assert listFiles(freshPath) == sorted(times)
+    assert loadJournal(freshPath) == None
+    assert not os.path.isdir(os.path.join(freshPath, 'original_images'))
+    with ScanCatalog(freshPath) as catalog:
+        assert len(catalog) == 0
+
+
+def test_checkRenamePlan(tmp_path):
+    path = str(tmp_path)
+    writeScans(path, [1, 2])
+    with pytest.raises(NameError):
+        checkRenamePlan(path, [('Image_1.jpg', 'Image_2.jpg', None)])
+    with pytest.raises(NameError):
+        checkRenamePlan(path, [('Image_1.jpg', 'a.jpg', None), ('Image_2.jpg', 'a.jpg', None)])
+    with pytest.raises(NameError):
+        checkRenamePlan(path, [('Image_3.jpg', 'a.jpg', None)])
+    checkRenamePlan(path, [('Image_1.jpg', 'a.jpg', None)])
+
+
+def test_appendNewFiles(tmp_path):
+    path = str(tmp_path)
+    writeScans(path, range(1, 12))
+    changeFileName(path)
+    writeScans(path, [12, 13])
+    assert appendNewFiles(path) == ['Image_11.jpg', 'Image_12.jpg']
+    assert appendNewFiles(path) == []
+    with ScanCatalog(path) as catalog:
+        assert catalog.lastScan()['oldName'] == 'Image_13.jpg'
+        assert catalog.lookup('Image_13.jpg')['newName'] == 'Image_12.jpg'
+
+
+def test_failedFirstRename(experiment):
+    """A failed first renaming leaves no catalog the next run would take as done"""
+    from funcs.pipeline import Pipeline
+    path, sampleInfo, _ = experiment()
+    scans = sorted(f for f in os.listdir(path) if f.endswith('.jpg'))
+    for i, fileName in enumerate(scans):
+        os.rename(os.path.join(path, fileName), os.path.join(path, f'{chr(ord("a") + i)}.jpg'))
+    pipeline = Pipeline(path, sampleInfo, None, workers=1, noDriftDetection=True)
+    with pytest.raises(ValueError):
+        pipeline.rename()
+    assert not catalogExists(path)
+
+    for i, fileName in enumerate(scans):
+        os.rename(os.path.join(path, f'{chr(ord("a") + i)}.jpg'), os.path.join(path, fileName))
+    pipeline = Pipeline(path, sampleInfo, None, workers=1, noDriftDetection=True)
+    try:
+        pipeline.rename()
+    finally:
+        pipeline.close()
+    assert len(pipeline.scanFiles) == len(scans)
+    assert len(os.listdir(os.path.join(path, 'original_images'))) == len(scans)
+    assert catalogExists(path)
+
+
+def test_scanLogTable(tmp_path):
+    path = str(tmp_path)
+    writeScans(path, range(1, 4))
+    changeFileName(path)
+    firstTable = [f for f in os.listdir(path) if f.startswith('scanLog')]
+    assert len(firstTable) == 1
+    with open(os.path.join(path, 'scanLog_notes.tsv'), 'w') as f:
+        f.write('kept\n')
+    # two days later
+    writeScans(path, [60])
+    appendNewFiles(path)
+    tables = sorted(f for f in os.listdir(path) if f.startswith('scanLog'))
+    assert firstTable[0] not in tables and 'scanLog_notes.tsv' in tables and len(tables) == 2
@@ -0,0 +1,147 @@
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from funcs.driftDetection import (genDriftLogFile, driftRegion, thumbnailShape, defaultMinShift, readThumbnail,
+                                  phaseCorrelate, frameShifts, driftGroups)
+
+size = (480, 360)
+region = (40, 30, 440, 330)
+
+
+def plateTexture(seed=0):
+    """Spectrum of a smooth random texture of size, shifted by a phase ramp"""
+    rng = np.random.default_rng(seed)
+    ky, kx = np.meshgrid(np.fft.fftfreq(size[1]), np.fft.fftfreq(size[0]), indexing='ij')
+    lowPass = np.exp(-(kx ** 2 + ky ** 2) / (2 * 0.02 ** 2)) + 0.5 * np.exp(-(kx ** 2 + ky ** 2) / (2 * 0.15 ** 2))
+    return np.fft.fft2(rng.normal(0, 1, (size[1], size[0]))) * lowPass, kx, ky
+
+
+def writeScans(path, offsets, noise=3, seed=0):
+    """Scans of the texture moved by offsets [(dx, dy), ...] (pixels, sub-pixel), with noise"""
+    os.makedirs(path, exist_ok=True)
+    spectrum, kx, ky = plateTexture(seed)
+    rng = np.random.default_rng(seed + 1)
+    filePaths = []
+    for i, (dx, dy) in enumerate(offsets):
+        plate = np.fft.ifft2(spectrum * np.exp(-2j * np.pi * (kx * dx + ky * dy))).real
+        plate = 180 + 40 * plate / np.abs(plate).max() + rng.normal(0, noise, plate.shape)
+        filePath = os.path.join(path, f'scan_{i}.jpg')
+        Image.fromarray(plate.clip(0, 255).astype(np.uint8)).convert('RGB').save(filePath, quality=90)
+        filePaths.append(filePath)
+    return filePaths
+
+
+def test_regionAndThumbnails():
+    posToCrop = {'P1': (100, 100, 150, 150), 'P2': (300, 200, 350, 250)}
+    assert driftRegion(posToCrop, size) == (75, 85, 375, 265)
+    assert driftRegion(posToCrop, (360, 260)) == (75, 85, 360, 260)
+    assert thumbnailShape((0, 0, 1024, 512)) == (256, 128)
+    assert thumbnailShape((0, 0, 100, 50)) == (100, 50)
+    assert defaultMinShift((0, 0, 1024, 512)) == 6
+
+
+def test_phaseCorrelate(tmp_path):
+    filePaths = writeScans(str(tmp_path), [(0, 0), (6, -4), (9, -1)], noise=0)
+    thumbShape = thumbnailShape(region, 400)
+    thumbs = np.stack([readThumbnail(f, region, thumbShape) for f in filePaths])
+    assert thumbs.shape == (3, 300, 400)
+    shifts = phaseCorrelate(thumbs)
+    np.testing.assert_allclose(shifts[:, :2], [[6, -4], [3, 3]], atol=0.1)
+    assert (shifts[:, 2] > 0.1).all()
+    np.testing.assert_allclose(phaseCorrelate(thumbs, reference=True)[:, :2], [[6, -4], [9, -1]], atol=0.1)
+
+
+@pytest.mark.parametrize('frames, step, groups', [(60, (0, 0), 1), (40, (0.7, 0.3), 10), (30, (2, 0), 15)])
+def test_drift(tmp_path, frames, step, groups):
+    """A still plate stays in one group, a slow drift under a thumbnail pixel per scan adds up"""
+    offsets = [(step[0] * i, step[1] * i) for i in range(frames)]
+    filePaths = writeScans(str(tmp_path), offsets)
+    shifts = frameShifts(str(tmp_path), filePaths, region, framesPerJob=16)
+    np.testing.assert_allclose(shifts[:, :2].sum(axis=0), offsets[-1], atol=0.5)
+    assert shifts[1:, 2].min() > 0.05
+    minShift = defaultMinShift(region)
+    found = driftGroups(shifts, minShift)
+    assert len(found) == groups
+    for (start, offset), (nextStart, _) in zip(found, found[1:] + [(frames, None)]):
+        # the plate is within minShift of where it was at the start of the group
+        assert np.abs(np.array(offsets[start:nextStart]) - offset).max() < minShift + 1
+
+
+def test_suddenMove(tmp_path):
+    offsets = [(0, 0)] * 8 + [(14, -9)] * 8
+    filePaths = writeScans(str(tmp_path), offsets)
+    shifts = frameShifts(str(tmp_path), filePaths, region)
+    assert driftGroups(shifts, defaultMinShift(region)) == [(0, (0, 0)), (8, (14, -9))]
+
+
+def test_driftGroups():
+    shifts = np.array([[0, 0, 1], [0.6, 0, 0.9], [0.6, 0, 0.9], [30, 30, 0.01], [0.6, -0.1, 0.9], [0, 5, 0.9]])
+    # the unrelated scan (low peak) is ignored
+    assert driftGroups(shifts, 1.5) == [(0, (0, 0)), (4, (2, 0)), (5, (2, 5))]
+    assert driftGroups(shifts, 1.5, minPeak=0) == [(0, (0, 0)), (3, (31, 30)), (5, (32, 35))]
+
+
+def test_driftLog(tmp_path, monkeypatch):
+    """Shifts are read once, scans arriving later only need their own thumbnails"""
+    path = str(tmp_path)
+    filePaths = writeScans(path, [(0.5 * i, 0) for i in range(12)])
+    first = frameShifts(path, filePaths[:8], region)
+    assert os.path.isfile(genDriftLogFile(path))
+    read = []
+    import funcs.driftDetection
+    readThumbnailOnce = funcs.driftDetection.readThumbnail
+    monkeypatch.setattr(funcs.driftDetection, 'readThumbnail', lambda f, *args: read.append(f) or readThumbnailOnce(f, *args))
+    np.testing.assert_array_equal(frameShifts(path, filePaths[:8], region), first)
+    assert read == []
+    shifts = frameShifts(path, filePaths, region)
+    np.testing.assert_array_equal(shifts[:8], first)
+    # and the scan before them, the reference of the job
+    assert set(read) == set(filePaths[7:])
+    # another region is registered again
+    frameShifts(path, filePaths, (50, 40, 430, 320))
+    assert len(read) > 5 + 12
+
+
+def test_driftOfWatchedScans(experiment, runPipeline, readRaw, monkeypatch):
+    """The plate moving while watching starts a group, the positions follow it and measure the same
+    values as in a full run"""
+    path, sampleInfo, _ = experiment(frames=10, diffPosSplits=1, measureTypes=('centreDisk', ))
+    fullPath = f'{path}_full'
+    shutil.copytree(path, fullPath)
+    full = runPipeline(fullPath, os.path.join(fullPath, os.path.basename(sampleInfo)), fusedMeasure=True)
+    assert full.diffPosNums == [0, 5]
+
+    heldBack = f'{path}_heldBack'
+    os.makedirs(heldBack)
+    for i in range(6, 11):
+        shutil.move(os.path.join(path, f'scan_{i}.jpg'), heldBack)
+    from funcs.pipeline import Pipeline
+    pipeline = Pipeline(path, sampleInfo, None, append=True, fusedMeasure=True, workers=1)
+    pipeline.rename()
+    pipeline.extract()
+    pipeline.measure()
+    pipeline.aggregate()
+    assert pipeline.diffPosNums == [0]
+    sleeps = []
+
+    def scansArrive(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 1:
+            raise KeyboardInterrupt
+        for fileName in os.listdir(heldBack):
+            shutil.move(os.path.join(heldBack, fileName), path)
+    monkeypatch.setattr(time, 'sleep', scansArrive)
+    try:
+        pipeline.append(0.001)
+    finally:
+        pipeline.close()
+    assert pipeline.diffPosNums == [0, 5]
+    measured, expected = readRaw(path), readRaw(fullPath)
+    assert sorted(measured) == sorted(expected)
+    for posName in expected:
+        np.testing.assert_allclose(measured[posName], expected[posName], rtol=1e-6)
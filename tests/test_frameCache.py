@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from funcs.measureCache import loadMeasureCache
+from funcs.frameCache import genFrameCacheDir
+
+
+def toGrey(path):
+    """Save the scans of a synthetic experiment as grey (L) images, with their times"""
+    for fileName in os.listdir(path):
+        if fileName.endswith('.jpg'):
+            filePath = os.path.join(path, fileName)
+            stat = os.stat(filePath)
+            with Image.open(filePath) as im:
+                grey = im.convert('L')
+            grey.save(filePath, 'jpeg', quality=90)
+            os.utime(filePath, (stat.st_atime, stat.st_mtime))
+
+
+def assertSameValues(measured, expected, **kwargs):
+    assert sorted(measured) == sorted(expected)
+    for posName in expected:
+        np.testing.assert_allclose(measured[posName][:, 1], expected[posName][:, 1], **kwargs)
+
+
+@pytest.mark.parametrize('mode', ['rgb', 'gray'])
+@pytest.mark.parametrize('fusedMeasure', [False, True])
+def test_greyScans(experiment, runPipeline, readRaw, mode, fusedMeasure):
+    """Grey scans measure in 0 - 255 whatever the cache, an rgb cache used to give values / 255"""
+    path, sampleInfo, _ = experiment()
+    toGrey(path)
+    runPipeline(path, sampleInfo, fusedMeasure=fusedMeasure)
+    expected = readRaw(path)
+    runPipeline(path, sampleInfo, fusedMeasure=fusedMeasure, frameCache=mode, reExtract=True, reMeasure=True)
+    assertSameValues(readRaw(path), expected)
+    assert all(values[:, 1].max() > 1 for values in expected.values())
+
+
+def test_colourScans(experiment, runPipeline, readRaw):
+    path, sampleInfo, _ = experiment()
+    runPipeline(path, sampleInfo)
+    expected = readRaw(path)
+    runPipeline(path, sampleInfo, frameCache='rgb', reExtract=True, reMeasure=True)
+    assertSameValues(readRaw(path), expected)
+    # grey frames are rounded to uint8
+    runPipeline(path, sampleInfo, frameCache='gray', reExtract=True, reMeasure=True)
+    assertSameValues(readRaw(path), expected, rtol=1e-2)
+
+
+@pytest.mark.filterwarnings('ignore:invalid value:RuntimeWarning')  # constant values do not normalise
+def test_framesReused(experiment, runPipeline, readRaw):
+    path, sampleInfo, _ = experiment()
+    runPipeline(path, sampleInfo, frameCache='rgb')
+    expected = readRaw(path)
+    cacheDir = genFrameCacheDir(path)
+    assert np.fromfile(os.path.join(cacheDir, 'filled.u8'), dtype=np.uint8).all()
+    runPipeline(path, sampleInfo, frameCache='rgb', reExtract=True, reMeasure=True)
+    assertSameValues(readRaw(path), expected)
+    # cropping again takes the frames from the cache, not from the scans
+    frames = np.memmap(os.path.join(cacheDir, 'frames.u8'), dtype=np.uint8, mode='r+')
+    frames[:] = 128
+    frames.flush()
+    del frames
+    runPipeline(path, sampleInfo, frameCache='rgb', reExtract=True, reMeasure=True)
+    assert all((values[:, 1] == values[0, 1]).all() for values in readRaw(path).values())
+
+
+def test_grayCacheKey(experiment, runPipeline):
+    """Values measured from a 'gray' frame cache are not mixed with full precision values"""
+    path, sampleInfo, _ = experiment()
+    runPipeline(path, sampleInfo, fusedMeasure=True, frameCache='rgb')
+    valuesCached = len(loadMeasureCache(path)['values'])
+    runPipeline(path, sampleInfo, fusedMeasure=True, frameCache='rgb', reExtract=True)
+    assert len(loadMeasureCache(path)['values']) == valuesCached
+    runPipeline(path, sampleInfo, fusedMeasure=True, frameCache='gray', reExtract=True)
+    assert len(loadMeasureCache(path)['values']) == 2 * valuesCached
@@ -0,0 +1,121 @@
+import os
+import re
+
+import numpy as np
+import pytest
+
+from funcs.measureCache import measureKey, fileFingerprint, forgetFingerprints, loadMeasureCache, saveMeasureCache
+
+
+def movePosition(tsvPath, posName, dx, dy):
+    """Move the box of posName in a position file, the size is kept"""
+    with open(tsvPath) as f:
+        text = f.read()
+    match = re.search(rf'^{posName}\t(\d+)\t(\d+)\t', text, flags=re.M)
+    x, y = int(match.group(1)) + dx, int(match.group(2)) + dy
+    with open(tsvPath, 'w') as f:
+        f.write(text[:match.start()] + f'{posName}\t{x}\t{y}\t' + text[match.end():])
+
+
+def test_measureKey():
+    key = measureKey('abc', (1, 2, 3, 4), 'centreDisk', 1.0, None)
+    assert key == measureKey('abc', [1, 2, 3, 4], 'centreDisk', 1.0, None)
+    assert key != measureKey('abc', (1, 2, 3, 4), 'centreDisk', 0.9, None)
+    assert key != measureKey('abd', (1, 2, 3, 4), 'centreDisk', 1.0, None)
+
+
+def test_fingerprintMemo(tmp_path):
+    filePath = str(tmp_path / 'a.bmp')
+    with open(filePath, 'wb') as f:
+        f.write(b'aaaa')
+    cache = {'fingerprints': {}, 'values': {}}
+    first = fileFingerprint(filePath, cache)
+    assert fileFingerprint(filePath) == first
+    # unchanged files are not read again
+    cache['fingerprints'][filePath] = cache['fingerprints'][filePath][:-1] + ('remembered', )
+    assert fileFingerprint(filePath, cache) == 'remembered'
+    # nor after a metadata change
+    os.link(filePath, str(tmp_path / 'b.bmp'))
+    os.chmod(filePath, 0o600)
+    assert fileFingerprint(filePath, cache) == 'remembered'
+
+
+def test_fingerprintOfRewrittenFile(tmp_path):
+    """Sub-images get the time of their scan, a new one of the same size has the old size and mtime
+    and is only hashed again once forgotten"""
+    filePath = str(tmp_path / 'a.bmp')
+    cache = {'fingerprints': {}, 'values': {}}
+    with open(filePath, 'wb') as f:
+        f.write(b'aaaa')
+    first = fileFingerprint(filePath, cache)
+    with open(filePath, 'wb') as f:
+        f.write(b'bbbbb')
+    assert fileFingerprint(filePath, cache) != first
+    second = fileFingerprint(filePath, cache)
+    os.utime(filePath, (1e9, 1e9))
+    assert fileFingerprint(filePath, cache) == second
+    with open(filePath, 'wb') as f:
+        f.write(b'ccccc')
+    os.utime(filePath, (1e9, 1e9))
+    forgetFingerprints(cache, str(tmp_path))
+    assert fileFingerprint(filePath, cache) == fileFingerprint(filePath) != second
+
+
+def test_forgetFingerprints(tmp_path):
+    cache = {'fingerprints': {str(tmp_path / 'subImages' / 'P1' / 'a.bmp'): (), str(tmp_path / 'subImagesOld' / 'a.bmp'): (),
+                              str(tmp_path / 'original_images' / 'a.jpg'): ()}, 'values': {}}
+    forgetFingerprints(cache, str(tmp_path / 'subImages'))
+    assert sorted(cache['fingerprints']) == [str(tmp_path / 'original_images' / 'a.jpg'), str(tmp_path / 'subImagesOld' / 'a.bmp')]
+
+
+def test_movedPositionMeasuredAgain(experiment, runPipeline, readRaw, capsys):
+    path, sampleInfo, _ = experiment(measureTypes=('centreDisk', ))
+    runPipeline(path, sampleInfo)
+    valuesCached = len(loadMeasureCache(path)['values'])
+    movePosition(sampleInfo, 'P1', 3, 2)
+    capsys.readouterr()
+    runPipeline(path, sampleInfo)
+    output = capsys.readouterr().out
+    # only the moved position, the sub-images of the others are the same
+    assert 'P1: 6/6 images to measure.' in output
+    assert 'P2: 0/6 images to measure.' in output
+    assert len(loadMeasureCache(path)['values']) == valuesCached + 6
+
+    # same values as an experiment measured with the moved position from the start
+    freshPath, freshInfo, _ = experiment(measureTypes=('centreDisk', ))
+    movePosition(freshInfo, 'P1', 3, 2)
+    runPipeline(freshPath, freshInfo)
+    measured, fresh = readRaw(path), readRaw(freshPath)
+    for posName in fresh:
+        np.testing.assert_allclose(measured[posName][:, 1], fresh[posName][:, 1])
+
+
+@pytest.mark.filterwarnings('ignore:invalid value:RuntimeWarning')  # constant values do not normalise
+def test_fusedMeasureCache(experiment, runPipeline, readRaw):
+    path, sampleInfo, _ = experiment()
+    runPipeline(path, sampleInfo, fusedMeasure=True)
+    cache = loadMeasureCache(path)
+    assert len(cache['values']) == 3 * 6
+    cache['values'] = {key: -1. for key in cache['values']}
+    saveMeasureCache(path, cache)
+    # extracting again takes the values from the cache
+    runPipeline(path, sampleInfo, fusedMeasure=True, reExtract=True)
+    assert all((values[:, 1] == -1).all() for values in readRaw(path).values())
+    # reMeasure does not
+    runPipeline(path, sampleInfo, fusedMeasure=True, reMeasure=True)
+    assert all((values[:, 1] > 0).all() for values in readRaw(path).values())
+
+
+def test_hashingThreads(experiment, runPipeline, monkeypatch):
+    """The sub-images are hashed with the workers of the run"""
+    import funcs.measureImages
+    threads = []
+    fingerprintFiles = funcs.measureImages.fingerprintFiles
+
+    def spyFingerprintFiles(filePaths, cache=None, workers=None):
+        threads.append(workers)
+        return fingerprintFiles(filePaths, cache, workers)
+    monkeypatch.setattr(funcs.measureImages, 'fingerprintFiles', spyFingerprintFiles)
+    path, sampleInfo, _ = experiment()
+    runPipeline(path, sampleInfo, workers=2)
+    assert threads == [2] * 3
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import funcs.misc
+from funcs.misc import framesInBudget, runBounded
+
+
+class InFlight:
+    """Jobs of runBounded() counting the scans being worked on, the files read ahead when they start"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.maxRunning = 0
+        self.finished = 0
+        self.read = []  # files opened by the reader thread
+        self.readAhead = []  # files read and not finished when a job starts
+
+    def job(self, filePath, seconds=0.005):
+        with self.lock:
+            assert filePath in self.read
+            self.readAhead.append(len(self.read) - self.finished)
+            self.running += 1
+            self.maxRunning = max(self.maxRunning, self.running)
+        time.sleep(seconds)
+        with self.lock:
+            self.running -= 1
+            self.finished += 1
+        return os.path.basename(filePath)
+
+    def spyReading(self, monkeypatch):
+        def spyOpen(filePath, mode='r', *args, **kwargs):
+            with self.lock:
+                self.read.append(filePath)
+            return open(filePath, mode, *args, **kwargs)
+        monkeypatch.setattr(funcs.misc, 'open', spyOpen, raising=False)
+
+
+def test_framesInBudget():
+    assert framesInBudget(100, 10) == 10
+    assert framesInBudget(100, 10, parallel=4) == 2
+    assert framesInBudget(100, 10, maximum=3) == 3
+    # a frame over the budget is still processed
+    assert framesInBudget(5, 10, parallel=4) == 1
+
+
+@pytest.mark.parametrize('maxChunks, chunkSize', [(1, 1), (3, 1), (2, 3)])
+def test_runBounded(tmp_path, monkeypatch, maxChunks, chunkSize):
+    """Only maxChunks chunks are worked on at a time in a larger pool, the files are read ahead of the
+    jobs by at most the chunks in flight and the ones waiting to be submitted"""
+    filePaths = []
+    for i in range(24):
+        filePaths.append(str(tmp_path / f'scan_{i}.jpg'))
+        with open(filePaths[-1], 'wb') as f:
+            f.write(os.urandom(1000))
+    inFlight = InFlight()
+    inFlight.spyReading(monkeypatch)
+    jobs = [((filePath, ), {}) for filePath in filePaths]
+    with ThreadPoolExecutor(8) as executor:
+        results = runBounded(executor, inFlight.job, jobs, chunkSize, maxChunks, prefetchPaths=filePaths)
+    assert results == [os.path.basename(f) for f in filePaths]
+    assert sorted(inFlight.read) == sorted(filePaths)
+    # the jobs of a chunk run one after the other
+    assert inFlight.maxRunning <= maxChunks
+    assert max(inFlight.readAhead) <= 2 * maxChunks * chunkSize + 1
@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('timeWindow, frameStride, selected', [
+    (None, 3, [0, 1, 2, 3, 6, 9]),
+    ((4, 9), 1, [0, 1, 2, 4, 5, 6, 7, 8, 9]),
+    ((4, 9), 3, [0, 1, 2, 6, 9]),
+    # the first 3 scans are kept outside the window
+    ((7.5, 20), 2, [0, 1, 2, 8, 10]),
+])
+def test_selectScans(experiment, runPipeline, readRaw, timeWindow, frameStride, selected):
+    """Scans an hour apart: only the selected ones are extracted and measured"""
+    path, sampleInfo, _ = experiment(frames=12, measureTypes=('centreDisk', ))
+    pipeline = runPipeline(path, sampleInfo, timeWindow=timeWindow, frameStride=frameStride)
+    assert pipeline.selectedIdx == selected
+    assert pipeline.selectedFiles == [pipeline.scanFiles[i] for i in selected]
+    with open(os.path.join(path, 'extractedScans.json')) as f:
+        assert json.load(f) == pipeline.selectedFiles
+    for values in readRaw(path).values():
+        assert list(values[:, 0] - values[0, 0]) == pytest.approx(selected)
+
+
+@pytest.mark.parametrize('memoryBudget, scansInFlight', [(None, 4), (2.5, 2), (0.5, 1)])
+def test_cropInMemoryBudget(experiment, runPipeline, monkeypatch, memoryBudget, scansInFlight):
+    """Two scans per worker are cropped at a time, fewer if their decoded images would not fit in
+    memoryBudget (in scans of 320 x 240 RGB here), which also reads the scans ahead"""
+    import funcs.pipeline
+    from funcs.crop import cropMemory
+    calls = []
+    runBounded = funcs.pipeline.runBounded
+
+    def spyRunBounded(executor, func, jobs, chunkSize=1, maxChunks=None, prefetchPaths=None):
+        calls.append((maxChunks, prefetchPaths != None))
+        return runBounded(executor, func, jobs, chunkSize, maxChunks, prefetchPaths)
+    monkeypatch.setattr(funcs.pipeline, 'runBounded', spyRunBounded)
+    path, sampleInfo, _ = experiment(measureTypes=('centreDisk', ))
+    if memoryBudget != None:
+        memoryBudget = int(memoryBudget * cropMemory((320, 240), 'RGB'))
+    runPipeline(path, sampleInfo, workers=2, memoryBudget=memoryBudget)
+    assert calls == [(scansInFlight, memoryBudget != None)]
@@ -0,0 +1,18 @@
+import os
+
+from funcs.preview import makeHqResized
+
+
+def test_makeHqResized(experiment, runPipeline, monkeypatch):
+    path, sampleInfo, _ = experiment(frames=8)
+    runPipeline(path, sampleInfo)
+    resizedNames = sorted(f for f in os.listdir(os.path.join(path, 'resized')) if f.endswith('_resized.jpg'))
+    assert len(resizedNames) == 8
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda folder: listed.append(folder) or listdir(folder))
+    hqFiles = makeHqResized(path, lowPriority=False)
+    # the source folder is listed once, not for every image
+    assert listed.count(os.path.join(path, 'original_images')) == 1
+    assert sorted(os.path.basename(f) for f in hqFiles) == resizedNames
+    assert all(os.path.isfile(f) for f in hqFiles)
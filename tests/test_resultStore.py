@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from funcs.resultStore import saveResults, loadResults, exportTables, measuredToTable, tableToMeasured, tableToStats
+
+
+@pytest.fixture
+def table():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(5, 3)), index=[0., 1.5, 3., 4.5, 6.], columns=['P1', 'P2', 'S1_P3'])
+    data.iloc[2, 1] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_roundTrip(tmp_path, table, mmap):
+    tableDir = str(tmp_path / 'allData')
+    saveResults(tableDir, table, meta={'measuredFiles': ['scan_1.jpg']})
+    data, meta = loadResults(tableDir, mmap=mmap)
+    assert list(data.columns) == list(table.columns)
+    np.testing.assert_array_equal(data.index.values, table.index.values)
+    np.testing.assert_array_equal(data.values, table.values.astype(np.float32))
+    assert meta == {'measuredFiles': ['scan_1.jpg']}
+
+
+def test_incompleteTable(tmp_path, table):
+    tableDir = str(tmp_path / 'allData')
+    saveResults(tableDir, table)
+    os.remove(os.path.join(tableDir, 'meta.json'))
+    assert loadResults(tableDir) == (None, None)
+
+
+def test_exportTables(tmp_path, table):
+    tableDir = str(tmp_path / 'allData')
+    saveResults(tableDir, table)
+    written = exportTables(tableDir, formats=('tsv', ))
+    assert written == [f'{tableDir}.tsv']
+    exported = pd.read_csv(written[0], sep='\t', index_col=0)
+    np.testing.assert_allclose(exported.values, table.values.astype(np.float32), rtol=1e-6)
+
+
+def test_measuredRoundTrip(tmp_path):
+    # positions measured at different times (an appended scan not measured everywhere yet)
+    measuredData = {'P1': np.array([[0., 10.], [1., 11.], [2., 12.]]), 'P2': np.array([[0., 20.], [1., 21.]])}
+    measuredStats = {'P1': np.array([[.1, .2], [.3, .4], [.5, .6]]), 'P2': np.array([[.7, .8], [.9, 1.]])}
+    statNames = ['gray.mean', 'gray.p90']
+    tableDir = str(tmp_path / 'raw')
+    saveResults(tableDir, measuredToTable(measuredData, measuredStats, statNames))
+    data, _ = loadResults(tableDir)
+    assert list(data.columns) == ['P1', 'P1.gray.mean', 'P1.gray.p90', 'P2', 'P2.gray.mean', 'P2.gray.p90']
+    measured, stats = tableToMeasured(data, statNames), tableToStats(data, statNames)
+    assert list(measured) == ['P1', 'P2']
+    for posName in measuredData:
+        np.testing.assert_allclose(measured[posName], measuredData[posName], rtol=1e-6)
+        np.testing.assert_allclose(stats[posName], measuredStats[posName], rtol=1e-6)
+
+
+def test_storedResultsReused(experiment, runPipeline):
+    path, sampleInfo, _ = experiment()
+    first = runPipeline(path, sampleInfo)
+    assert os.path.isfile(os.path.join(path, 'measuredData', 'processed', 'meta.json'))
+    second = runPipeline(path, sampleInfo)
+    assert not second.needMeasure
+    pd.testing.assert_frame_equal(second.allPicsData, first.allPicsData.astype(np.float32), check_dtype=False)
+
+
+def test_storedResultsProcessedAgain(experiment, runPipeline, monkeypatch):
+    """Other zeroing and normalisation arguments process the stored raw data again, without measuring"""
+    from funcs.measureImages import processMeasurements
+    import funcs.measureImages
+    import funcs.subImageStack
+    path, sampleInfo, _ = experiment()
+    first = runPipeline(path, sampleInfo)
+
+    def measured(*args, **kwargs):
+        raise AssertionError('measured again')
+    monkeypatch.setattr(funcs.measureImages, 'measureFolders', measured)
+    monkeypatch.setattr(funcs.subImageStack, 'measureStacks', measured)
+    second = runPipeline(path, sampleInfo, noZeroing=True, normType='None')
+    expected = processMeasurements(first.measuredData, zeroing=False, normType='None')
+    pd.testing.assert_frame_equal(second.allPicsData, expected, check_dtype=False, rtol=1e-5)
+    assert not second.allPicsData.equals(first.allPicsData)
+    # stored with the arguments they are processed with
+    third = runPipeline(path, sampleInfo, noZeroing=True, normType='None')
+    pd.testing.assert_frame_equal(third.allPicsData, second.allPicsData, check_dtype=False)
+
+
+def test_appendOnlyNewScans(experiment, runPipeline, readRaw, monkeypatch):
+    """A run in append mode crops and measures the scans that arrived since the last run only, with the
+    same values as a run over all of them"""
+    import shutil
+    from funcs.pipeline import Pipeline
+    path, sampleInfo, _ = experiment(measureTypes=('centreDisk', ))
+    fullPath = f'{path}_full'
+    shutil.copytree(path, fullPath)
+    runPipeline(fullPath, os.path.join(fullPath, os.path.basename(sampleInfo)))
+    heldBack = f'{path}_heldBack'
+    os.makedirs(heldBack)
+    for i in [5, 6]:
+        shutil.move(os.path.join(path, f'scan_{i}.jpg'), heldBack)
+    cropped = []
+    runJobs = Pipeline.runJobs
+
+    def spyRunJobs(self, func, jobs, chunkSize=1, filePaths=None):
+        cropped.extend(os.path.basename(f) for f in filePaths or [])
+        return runJobs(self, func, jobs, chunkSize, filePaths)
+    monkeypatch.setattr(Pipeline, 'runJobs', spyRunJobs)
+
+    def appendRun():
+        pipeline = Pipeline(path, sampleInfo, None, append=True, workers=1)
+        try:
+            pipeline.rename()
+            pipeline.extract()
+            pipeline.measure()
+            pipeline.aggregate()
+            pipeline.append()
+        finally:
+            pipeline.close()
+        return pipeline
+    appendRun()
+    assert len(cropped) == 4
+    for fileName in os.listdir(heldBack):
+        shutil.move(os.path.join(heldBack, fileName), path)
+    cropped.clear()
+    pipeline = appendRun()
+    assert cropped == pipeline.scanFiles[4:] and len(pipeline.measuredFiles) == 6
+    measured, expected = readRaw(path), readRaw(fullPath)
+    assert sorted(measured) == sorted(expected)
+    for posName in expected:
+        np.testing.assert_allclose(measured[posName], expected[posName], rtol=1e-6)
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pytest
+from skimage.color import rgb2gray, rgb2hsv, rgb2lab
+
+from funcs.resultStore import loadResults, tableToStats
+from funcs.roiStats import statSpec, statNames, statKey, rgbToHsv, roiStatistics
+
+
+@pytest.fixture
+def pixels():
+    """(T, N, 3) uint8 pixels of 3 frames, with grey and saturated ones"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (3, 500, 3), dtype=np.uint8)
+    pixels[:, :20] = pixels[:, :20, :1]  # grey
+    pixels[:, 20:25] = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [0, 0, 0], [255, 255, 255]]
+    return pixels
+
+
+def statistics(pixels, mode, channels, statistics, histBins=8):
+    spec = statSpec(statistics, channels, histBins)
+    values = roiStatistics(pixels, mode, spec)
+    assert values.shape == (len(pixels), len(statNames(spec)))
+    return dict(zip(statNames(spec), values.T))
+
+
+def test_statSpec():
+    assert statSpec(None) == None and statSpec([]) == None
+    spec = statSpec(['mean', 'p90', 'mean'], ['lab', 'gray'], histBins=2)
+    assert spec == (('lab', 'gray'), ('mean', 'p90'), 2)
+    assert statNames(spec) == ['L.mean', 'L.p90', 'a.mean', 'a.p90', 'b.mean', 'b.p90', 'gray.mean', 'gray.p90']
+    assert statNames(statSpec(['hist'], histBins=3)) == ['gray.hist0', 'gray.hist1', 'gray.hist2']
+    assert statKey(None) == () and statKey(spec) != statKey(statSpec(['mean'], ['lab', 'gray']))
+    for statistic in ['p101', 'max', 'p']:
+        with pytest.raises(ValueError):
+            statSpec([statistic])
+    with pytest.raises(ValueError):
+        statSpec(['mean'], ['cmyk'])
+    with pytest.raises(ValueError):
+        statSpec(['mean'], histBins=0)
+
+
+def test_rgbToHsv(pixels):
+    rgb = pixels.astype(np.float32) / 255
+    np.testing.assert_allclose(rgbToHsv(rgb), rgb2hsv(rgb), atol=1e-6)
+
+
+def test_rgbStatistics(pixels):
+    values = statistics(pixels, 'RGB', ['gray', 'rgb', 'hsv', 'lab'], ['mean', 'std', 'median', 'p10', 'p90'])
+    unit = pixels / 255
+    for channel, reference in [('gray', rgb2gray(unit)), ('R', unit[..., 0]), ('B', unit[..., 2]),
+                               ('H', rgb2hsv(unit)[..., 0]), ('S', rgb2hsv(unit)[..., 1]),
+                               ('L', rgb2lab(unit)[..., 0]), ('a', rgb2lab(unit)[..., 1]), ('b', rgb2lab(unit)[..., 2])]:
+        np.testing.assert_allclose(values[f'{channel}.mean'], reference.mean(axis=1), rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(values[f'{channel}.std'], reference.std(axis=1), rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(values[f'{channel}.median'], np.median(reference, axis=1), rtol=1e-4, atol=1e-4)
+        for q in [10, 90]:
+            np.testing.assert_allclose(values[f'{channel}.p{q}'], np.percentile(reference, q, axis=1),
+                                       rtol=1e-4, atol=1e-4)
+
+
+def test_histogram(pixels):
+    values = statistics(pixels, 'RGB', ['rgb', 'lab'], ['hist'], histBins=4)
+    unit = pixels / 255
+    for channel, reference, valueRange in [('G', unit[..., 1], (0, 1)), ('L', rgb2lab(unit)[..., 0], (0, 100)),
+                                           ('a', rgb2lab(unit)[..., 1], (-128, 128))]:
+        hist = np.array([np.histogram(frame, bins=4, range=valueRange)[0] / frame.size for frame in reference])
+        np.testing.assert_allclose(np.column_stack([values[f'{channel}.hist{i}'] for i in range(4)]), hist)
+    assert np.allclose(sum(values[f'L.hist{i}'] for i in range(4)), 1)
+
+
+@pytest.mark.parametrize('mode, scale', [('L', 255), ('I;16', 65535), ('F', 1)])
+def test_greyImages(mode, scale):
+    rng = np.random.default_rng(1)
+    pixels = rng.uniform(0, scale, (2, 300)).astype(np.uint16 if mode == 'I;16' else np.uint8 if mode == 'L' else np.float32)
+    values = statistics(pixels, mode, ['gray', 'hsv'], ['mean', 'p90'])
+    np.testing.assert_allclose(values['gray.mean'], (pixels / scale).mean(axis=1), rtol=1e-5)
+    np.testing.assert_allclose(values['V.p90'], np.percentile(pixels / scale, 90, axis=1), rtol=1e-5)
+    assert (values['S.mean'] == 0).all()
+
+
+def test_measuredStatistics(experiment, runPipeline, readRaw):
+    """gray.mean of colour scans is their greyness"""
+    path, sampleInfo, _ = experiment()
+    names = statNames(statSpec(['mean'], ['gray', 'rgb']))
+    runPipeline(path, sampleInfo, statistics=['mean'], channels=['gray', 'rgb'])
+    data, meta = loadResults(os.path.join(path, 'measuredData', 'raw'), mmap=False)
+    assert meta['statNames'] == names
+    stats = tableToStats(data, names)
+    for posName, values in readRaw(path).items():
+        np.testing.assert_allclose(stats[posName][:, 0], values[:, 1], rtol=1e-5)
+        # the colonies are yellowish
+        assert (stats[posName][:, 3] <= stats[posName][:, 1]).all()
@@ -0,0 +1,88 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+
+from funcs.scanCatalog import ScanCatalog, genCatalogFile, genLegacyLogFile, catalogExists, scanNumber
+
+t0 = 1.6e9
+repoPath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    """Catalog of 120 scans an hour apart, added in two parts"""
+    scans = [(f'Image_{n + 1}.jpg', f'Image_{n:03d}.jpg', t0 + n * 3600, 1000 + n) for n in range(120)]
+    with ScanCatalog(str(tmp_path)) as catalog:
+        catalog.addScans(scans[:100], True)
+        catalog.addScans(scans[90:])
+        yield catalog
+
+
+def test_scanNumber():
+    assert scanNumber('Image_012.jpg') == 12
+    assert scanNumber('plate2_img_7.tif') == 7
+
+
+def test_names(catalog):
+    assert len(catalog) == 120
+    assert catalog.isNew
+    names = catalog.names()
+    assert names[0] == ('Image_1.jpg', 'Image_000.jpg')
+    assert [newName for _, newName in names] == [f'Image_{n:03d}.jpg' for n in range(120)]
+    assert catalog.dictOldScanTime()['Image_100.jpg'] == t0 + 100 * 3600
+    assert catalog.lastScan()['newName'] == 'Image_119.jpg'
+
+
+def test_lookup(catalog):
+    scan = catalog.lookup('Image_050.jpg')
+    assert scan['oldName'] == 'Image_51.jpg' and scan['size'] == 1050
+    # old names first
+    assert catalog.lookup('Image_51.jpg')['newName'] == 'Image_050.jpg'
+    assert catalog.lookup('Image_999.jpg') == None
+    assert catalog.index('Image_050.jpg') == 50
+    assert catalog.index('Image_1.jpg') == 0
+    assert catalog.index('Image_999.jpg') == None
+
+
+def test_scansBetween(catalog):
+    scans = catalog.scans(t0 + 10 * 3600, t0 + 12 * 3600)
+    assert [scan['newName'] for scan in scans] == ['Image_010.jpg', 'Image_011.jpg', 'Image_012.jpg']
+    assert len(catalog.scans(end=t0 + 1)) == 1
+    assert len(catalog.scans(start=t0 + 119 * 3600)) == 1
+    assert len(catalog.scans()) == 120
+
+
+def test_setDetails(catalog):
+    assert len(catalog.missingDetails()) == 120
+    catalog.setDetails({'Image_000.jpg': {'width': 32, 'height': 24, 'timeSource': 'mtime', 'unknown': 1},
+                        'Image_001.jpg': {'unknown': 1}})
+    assert catalog.missingDetails()[0] == 'Image_001.jpg'
+    assert catalog.lookup('Image_000.jpg')['width'] == 32
+    assert catalog.timeSourceCounts() == {'mtime': 1}
+
+
+def test_legacyLog(tmp_path):
+    path = str(tmp_path)
+    dictOld2New = {f'Image_{n + 1}.jpg': f'Image_{n:02d}.jpg' for n in range(12)}
+    dictOldScanTime = {newName: t0 + n * 60 for n, newName in enumerate(dictOld2New.values())}
+    with open(genLegacyLogFile(path), 'wb') as f:
+        pickle.dump((dictOld2New, dictOldScanTime, True), f)
+    assert catalogExists(path)
+    with ScanCatalog(path) as catalog:
+        assert catalog.names() == list(dictOld2New.items())
+        assert catalog.dictOldScanTime() == dictOldScanTime
+        assert catalog.isNew
+    # imported once, the catalog is used afterwards
+    os.remove(genLegacyLogFile(path))
+    with ScanCatalog(path) as catalog:
+        assert len(catalog) == 12
+    assert os.path.isfile(genCatalogFile(path))
+
+
+def test_commandLine(catalog):
+    output = subprocess.run([sys.executable, '-m', 'funcs.scanCatalog', catalog.path, '--name', 'Image_7.jpg'],
+                            cwd=repoPath, check=True, capture_output=True, text=True).stdout
+    assert 'Image_006.jpg' in output
@@ -0,0 +1,35 @@
+import os
+
+import funcs.measureCache
+from funcs.snapshot import readManifest
+
+
+def spyHashing(monkeypatch):
+    """Paths of the files read by fileFingerprint()"""
+    hashed = []
+
+    def spyOpen(filePath, mode='r', *args, **kwargs):
+        if mode == 'rb' and not filePath.endswith('measureCache.pickle'):
+            hashed.append(filePath)
+        return open(filePath, mode, *args, **kwargs)
+    monkeypatch.setattr(funcs.measureCache, 'open', spyOpen, raising=False)
+    return hashed
+
+
+def test_saveLinksSubImages(experiment, runPipeline, monkeypatch):
+    path, sampleInfo, _ = experiment()
+    pipeline = runPipeline(path, sampleInfo)
+    resultDir = pipeline.save()
+    entries = readManifest(resultDir)
+    assert len(entries) == 3 * 6
+    for relPath, size, _ in entries:
+        src, dst = os.path.join(path, relPath), os.path.join(resultDir, relPath)
+        assert os.path.samefile(src, dst) and os.path.getsize(dst) == int(size)
+    os.rename(resultDir, f'{resultDir}_first')  # result folders are named to the second
+
+    # linking changes the inode change time only, the remembered hashes stay valid
+    hashed = spyHashing(monkeypatch)
+    pipeline = runPipeline(path, sampleInfo, reMeasure=True)
+    assert hashed == []
+    pipeline.save()
+    assert hashed == []
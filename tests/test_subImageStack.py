@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+from funcs.resultStore import loadResults, tableToStats
+from funcs.roiStats import statSpec, statNames
+from funcs.subImageStack import allocateStack, loadStackIndex, openStack
+
+
+def test_allocateStack(tmp_path):
+    path = str(tmp_path)
+    box = (10, 20, 40, 60)
+    stackInfo, slots = allocateStack(path, 'P1', 0, box, ['scan_0', 'scan_1'], 'RGB')
+    assert slots == {'scan_0': 0, 'scan_1': 1}
+    assert openStack(stackInfo).shape == (2, 40, 30, 3)
+    openStack(stackInfo, 'r+')[1] = 7
+
+    # stored scans keep their slot and their frame, the stack grows in place
+    stackInfo, slots = allocateStack(path, 'P1', 0, box, ['scan_1', 'scan_2'], 'RGB')
+    assert slots == {'scan_1': 1, 'scan_2': 2}
+    assert stackInfo['length'] == 3
+    assert (openStack(stackInfo)[1] == 7).all()
+
+    # a new box starts the stack again, other groups are kept
+    allocateStack(path, 'P1', 1, box, ['scan_3'], 'L')
+    stackInfo, slots = allocateStack(path, 'P1', 0, (10, 20, 50, 60), ['scan_1'], 'RGB')
+    assert slots == {'scan_1': 0}
+    assert openStack(stackInfo).shape == (1, 40, 40, 3)
+    index = loadStackIndex(path, 'P1')
+    assert index['groups']['1']['names'] == ['scan_3']
+    assert index['groups']['1']['shape'] == [40, 30]
+
+
+def test_unsupportedMode(tmp_path):
+    with pytest.raises(AssertionError):
+        allocateStack(str(tmp_path), 'P1', 0, (0, 0, 10, 10), ['scan_0'], 'I;16')
+
+
+@pytest.mark.parametrize('diffPosSplits', [0, 1])
+def test_stackMeasurement(experiment, runPipeline, readRaw, diffPosSplits):
+    """Stacks keep the pixels of the scans: same values as measured while cropping (fusedMeasure),
+    close to the values of the sub-image files, which are re-encoded"""
+    options = dict(statistics=['mean', 'p90'], channels=['gray', 'hsv'])
+    names = statNames(statSpec(options['statistics'], options['channels']))
+    measured = {}
+    for store, storeOptions in [('fused', dict(fusedMeasure=True)), ('files', dict(saveSubImages=True)),
+                                ('stack', dict(saveSubImages=True, subImageStore='stack'))]:
+        path, sampleInfo, diffPos = experiment(diffPosSplits=diffPosSplits)
+        runPipeline(path, sampleInfo, diffPos, **storeOptions, **options)
+        data, _ = loadResults(os.path.join(path, 'measuredData', 'raw'), mmap=False)
+        measured[store] = readRaw(path), tableToStats(data, names)
+    assert os.path.isfile(os.path.join(path, 'subImages', 'P1', f'group{diffPosSplits}.u8'))
+    stackValues, stackStats = measured['stack']
+    fusedValues, fusedStats = measured['fused']
+    assert sorted(stackValues) == sorted(fusedValues)
+    for posName in fusedValues:
+        np.testing.assert_allclose(stackValues[posName], fusedValues[posName], rtol=1e-6)
+        np.testing.assert_allclose(stackStats[posName], fusedStats[posName], rtol=1e-6, atol=1e-6)
+        # the hue of the nearly grey plate is changed by re-encoding, compare the greyness only
+        np.testing.assert_allclose(stackValues[posName], measured['files'][0][posName], rtol=1e-2)
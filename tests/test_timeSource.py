@@ -0,0 +1,111 @@
+import os
+import shutil
+import time
+from datetime import datetime
+
+import pytest
+from PIL import Image
+
+from funcs.pipeline import Pipeline
+from funcs.scanCatalog import ScanCatalog, readHeaderTime, parseHeaderTime, fillScanDetails
+
+
+def setHeaderTime(filePath, timestamp, tag=36867):
+    """Write the capture time (DateTimeOriginal, or DateTime with tag 306) in the header of a jpg, keep its mtime"""
+    stat = os.stat(filePath)
+    with Image.open(filePath) as im:
+        im.load()
+    exif = Image.Exif()
+    dateTime = datetime.fromtimestamp(timestamp).strftime('%Y:%m:%d %H:%M:%S')
+    if tag == 306:
+        exif[306] = dateTime
+    else:
+        exif.get_ifd(0x8769)[tag] = dateTime
+    im.save(filePath, 'jpeg', quality=90, exif=exif)
+    os.utime(filePath, (stat.st_atime, stat.st_mtime))
+
+
+def test_parseHeaderTime():
+    local = datetime(2020, 9, 13, 10, 0, 0).timestamp()
+    assert parseHeaderTime('2020:09:13 10:00:00') == local
+    assert parseHeaderTime('2020:09:13 10:00:00\x00', subSec='25') == local + 0.25
+    assert parseHeaderTime('2020:09:13 10:00:00', offset='+02:00') == datetime.fromisoformat('2020-09-13T08:00:00+00:00').timestamp()
+    with pytest.raises(ValueError):
+        parseHeaderTime('    :  :     :  :  ')
+
+
+def test_readHeaderTime(tmp_path):
+    filePath = str(tmp_path / 'a.jpg')
+    Image.new('RGB', (8, 8)).save(filePath)
+    with Image.open(filePath) as im:
+        assert readHeaderTime(im) == (None, 'mtime')
+    setHeaderTime(filePath, 1.6e9, tag=306)
+    with Image.open(filePath) as im:
+        assert readHeaderTime(im) == (1.6e9, 'tiff')
+    setHeaderTime(filePath, 1.6e9 + 60)
+    with Image.open(filePath) as im:
+        assert readHeaderTime(im) == (1.6e9 + 60, 'exif')
+
+
+def test_scanTimes(tmp_path):
+    path = str(tmp_path)
+    os.makedirs(os.path.join(path, 'original_images'))
+    with ScanCatalog(path) as catalog:
+        catalog.addScans([(f'Image_{n + 1}.jpg', f'Image_{n}.jpg', 1.6e9 + n * 3600, None) for n in range(3)], True)
+    for n in range(3):
+        filePath = os.path.join(path, 'original_images', f'Image_{n}.jpg')
+        Image.new('RGB', (8, 8)).save(filePath)
+        if n < 2:
+            setHeaderTime(filePath, 1.6e9 + n * 1800)
+    assert fillScanDetails(path, workers=1) == 3
+    with ScanCatalog(path) as catalog:
+        assert catalog.timeSourceCounts() == {'exif': 2, 'mtime': 1}
+        # not every scan has a header time
+        assert catalog.scanTimes() == ({f'Image_{n}.jpg': 1.6e9 + n * 3600 for n in range(3)}, 'file')
+        # the file time of the scans without one
+        assert catalog.scanTimes('header') == ({'Image_0.jpg': 1.6e9, 'Image_1.jpg': 1.6e9 + 1800,
+                                                'Image_2.jpg': 1.6e9 + 7200}, 'header')
+
+
+def test_timeSourceOfWatchedScans(experiment, monkeypatch):
+    """Scans arriving while watching keep the time source of the run, a scan without a header time
+    does not change the times of the scans measured before"""
+    path, sampleInfo, _ = experiment(frames=8, measureTypes=('centreDisk', ))
+    heldBack = os.path.join(os.path.dirname(path), 'heldBack')
+    os.makedirs(heldBack)
+    for i in range(1, 9):
+        filePath = os.path.join(path, f'scan_{i}.jpg')
+        # capture times half an hour apart, the file times are an hour apart
+        if i < 8:
+            setHeaderTime(filePath, 1.6e9 + i * 1800)
+        if i > 5:
+            shutil.move(filePath, heldBack)
+
+    pipeline = Pipeline(path, sampleInfo, None, append=True, fusedMeasure=True, workers=1)
+    pipeline.rename()
+    pipeline.extract()
+    pipeline.measure()
+    pipeline.aggregate()
+    assert pipeline.timeSource == 'header'
+    sleeps = []
+
+    def scansArrive(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 1:
+            raise KeyboardInterrupt
+        for fileName in os.listdir(heldBack):
+            shutil.move(os.path.join(heldBack, fileName), path)
+        # older than minAge of appendNewFiles()
+        now = time.time()
+        for fileName in os.listdir(path):
+            if fileName.endswith('.jpg'):
+                os.utime(os.path.join(path, fileName), (now - 60, now - 60))
+    monkeypatch.setattr(time, 'sleep', scansArrive)
+    try:
+        pipeline.append(0.001)
+    finally:
+        pipeline.close()
+    assert pipeline.timeSource == 'header'
+    assert len(pipeline.measuredFiles) == 8
+    hours = pipeline.allPicsData.index.values
+    assert list(hours[:7]) == pytest.approx([i * 0.5 for i in range(7)])